@@ -0,0 +1,70 @@
+"""
+Compares the brute force and sweep paths of ``collide_groups()`` and
+``aabb_collide_groups()`` for growing group sizes, and reports where the
+sweep starts to win.
+
+    python benchmarks/collide_groups.py
+
+``rabbyt.collisions._group_sweep_threshold`` is the value of
+``len(group_a) * len(group_b)`` at which the sweep is used.
+"""
+
+from __future__ import print_function
+
+import random
+import timeit
+
+import rabbyt.collisions
+
+
+class Box(object):
+    def __init__(self, x, y, r):
+        self.x = x
+        self.y = y
+        self.bounding_radius = r
+        self.left = x - r
+        self.right = x + r
+        self.bottom = y - r
+        self.top = y + r
+
+
+def make_group(n, size, rnd):
+    return [Box(rnd.uniform(0, size), rnd.uniform(0, size), rnd.uniform(2, 8))
+            for i in range(n)]
+
+def best_time(function, a, b, threshold):
+    rabbyt.collisions._group_sweep_threshold = threshold
+    number = max(1, 20000 // (len(a) * len(b) + 1))
+    return min(timeit.repeat(lambda: function(a, b), number=number,
+            repeat=5)) / number
+
+def main():
+    rnd = random.Random(0)
+    old_threshold = rabbyt.collisions._group_sweep_threshold
+    sizes = [2, 4, 8, 16, 32, 64, 128, 181, 256, 512, 1024]
+    try:
+        for function in (rabbyt.collisions.collide_groups,
+                rabbyt.collisions.aabb_collide_groups):
+            print(function.__name__)
+            print("%8s %8s %12s %12s" % ("n*m", "n", "brute (us)",
+                    "sweep (us)"))
+            crossover = None
+            for n in sizes:
+                # Keep the density about the same as the groups grow.
+                size = 20 * n ** .5
+                a = make_group(n, size, rnd)
+                b = make_group(n, size, rnd)
+                brute = best_time(function, a, b, 1 << 62)
+                sweep = best_time(function, a, b, 0)
+                print("%8d %8d %12.1f %12.1f" % (n * n, n, brute * 1e6,
+                        sweep * 1e6))
+                if sweep >= brute:
+                    crossover = None
+                elif crossover is None:
+                    crossover = n * n
+            print("sweep is faster from n*m = %s\n" % crossover)
+    finally:
+        rabbyt.collisions._group_sweep_threshold = old_threshold
+
+if __name__ == "__main__":
+    main()
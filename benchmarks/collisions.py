@@ -0,0 +1,243 @@
+"""
+Times the collision functions on synthetic scenes of growing size, so that
+changes to ``rabbyt.collisions`` can be checked for regressions.
+
+    python benchmarks/collisions.py
+    python benchmarks/collisions.py --format json > before.json
+    python benchmarks/collisions.py --sizes 100,1000 --functions collide,rdc
+
+Each scene is built from one of these distributions:
+
+    ``uniform``
+        Spread evenly over a square that grows with the number of objects,
+        so the density stays about the same.
+
+    ``clustered``
+        Tight gaussian clusters of about 100 objects each.
+
+    ``line``
+        A long, thin horizontal band, which sorts well along x but not at
+        all along y.
+
+    ``mixed``
+        Uniform positions, with radii from 1 to 64 (mostly small.)
+
+and the objects are either ``tuple`` (a namedtuple with the attributes the
+functions read) or ``sprite`` (``rabbyt.Sprite``.)
+
+The results are printed as a table, or with ``--format json`` or
+``--format csv`` as one record per measurement.  ``seconds`` is the best
+time for one call.  Functions that check every pair can get very slow; once
+the time for a smaller scene, scaled up by the square of the size, is past
+``--max-time``, the larger scenes are skipped and recorded with a
+``skipped`` reason instead of a time.
+"""
+
+from __future__ import print_function
+
+import argparse
+import collections
+import csv
+import json
+import math
+import platform
+import random
+import sys
+import timeit
+
+import rabbyt
+import rabbyt.collisions
+from rabbyt.sprites import Sprite
+
+
+Body = collections.namedtuple("Body", "x y bounding_radius "
+        "bounding_radius_squared left top right bottom")
+
+def make_body(x, y, r):
+    return Body(x, y, r, r*r, x - r, y + r, x + r, y - r)
+
+def make_sprite(x, y, r):
+    # A square whose corners are on the bounding circle.
+    h = r / math.sqrt(2)
+    return Sprite(x=x, y=y, shape=(-h, h, h, -h))
+
+
+def uniform(n, rnd):
+    size = 30 * math.sqrt(n)
+    return [(rnd.uniform(0, size), rnd.uniform(0, size), rnd.uniform(2, 8))
+            for i in range(n)]
+
+def clustered(n, rnd):
+    size = 30 * math.sqrt(n)
+    centers = [(rnd.uniform(0, size), rnd.uniform(0, size))
+            for i in range(max(1, n // 100))]
+    points = []
+    for i in range(n):
+        cx, cy = rnd.choice(centers)
+        points.append((rnd.gauss(cx, 30), rnd.gauss(cy, 30),
+                rnd.uniform(2, 8)))
+    return points
+
+def line(n, rnd):
+    return [(rnd.uniform(0, n * 12), rnd.uniform(0, 20), rnd.uniform(2, 8))
+            for i in range(n)]
+
+def mixed(n, rnd):
+    size = 30 * math.sqrt(n)
+    return [(rnd.uniform(0, size), rnd.uniform(0, size),
+            64 ** (rnd.random() ** 3)) for i in range(n)]
+
+DISTRIBUTIONS = collections.OrderedDict([
+    ("uniform", uniform),
+    ("clustered", clustered),
+    ("line", line),
+    ("mixed", mixed),
+])
+
+KINDS = collections.OrderedDict([
+    ("tuple", make_body),
+    ("sprite", make_sprite),
+])
+
+
+def halves(function):
+    # The group functions collide the first half against the second.
+    def run(objects):
+        middle = len(objects) // 2
+        return function(objects[:middle], objects[middle:])
+    return run
+
+collisions = rabbyt.collisions
+FUNCTIONS = collections.OrderedDict([
+    ("rdc", lambda objects: collisions.rdc(objects, min_split=10)),
+    ("collide", collisions.collide),
+    ("brute_force", collisions.brute_force),
+    ("aabb_collide", collisions.aabb_collide),
+    ("collide_groups", halves(collisions.collide_groups)),
+    ("aabb_collide_groups", halves(collisions.aabb_collide_groups)),
+])
+
+
+def best_time(function, objects, repeat, min_time):
+    """
+    Returns the best time for one call, and the result of the first call.
+    """
+    start = timeit.default_timer()
+    result = function(objects)
+    first = timeit.default_timer() - start
+    if first > min_time * 2:
+        # A single call is already long enough to time on its own.
+        return first, result
+    number = max(1, int(min_time / max(first, 1e-9)))
+    times = timeit.repeat(lambda: function(objects), number=number,
+            repeat=repeat)
+    return min(times) / number, result
+
+def run(sizes, distributions, kinds, functions, repeat, min_time, max_time,
+        seed, report):
+    for distribution in distributions:
+        for kind in kinds:
+            last = {}
+            for n in sizes:
+                rnd = random.Random(seed)
+                objects = [KINDS[kind](*p)
+                        for p in DISTRIBUTIONS[distribution](n, rnd)]
+                for name in functions:
+                    record = collections.OrderedDict([
+                        ("function", name),
+                        ("distribution", distribution),
+                        ("kind", kind),
+                        ("objects", n),
+                        ("seconds", None),
+                        ("result_size", None),
+                        ("skipped", None),
+                    ])
+                    if name in last:
+                        m, seconds = last[name]
+                        estimate = seconds * (float(n) / m) ** 2
+                        if estimate > max_time:
+                            record["skipped"] = ("estimated %.1fs" %
+                                    estimate)
+                            report(record)
+                            continue
+                    seconds, result = best_time(FUNCTIONS[name], objects,
+                            repeat, min_time)
+                    last[name] = (n, seconds)
+                    record["seconds"] = seconds
+                    record["result_size"] = len(result)
+                    report(record)
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0],
+            formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--sizes", default="100,1000,10000,100000",
+            help="comma separated object counts (default %(default)s)")
+    parser.add_argument("--distributions", default=",".join(DISTRIBUTIONS),
+            help="comma separated, from: %(default)s")
+    parser.add_argument("--kinds", default=",".join(KINDS),
+            help="comma separated, from: %(default)s")
+    parser.add_argument("--functions", default=",".join(FUNCTIONS),
+            help="comma separated, from: %(default)s")
+    parser.add_argument("--format", default="table",
+            choices=["table", "json", "csv"])
+    parser.add_argument("--repeat", type=int, default=3)
+    parser.add_argument("--min-time", type=float, default=0.05,
+            help="seconds to run each repeat for (default %(default)s)")
+    parser.add_argument("--max-time", type=float, default=5.0,
+            help="skip calls expected to take longer (default %(default)s)")
+    parser.add_argument("--seed", type=int, default=0)
+    args = parser.parse_args(argv)
+
+    def names(value, choices):
+        result = [v for v in value.split(",") if v]
+        for v in result:
+            if v not in choices:
+                parser.error("unknown name %r" % v)
+        return result
+
+    sizes = [int(n) for n in args.sizes.split(",")]
+    distributions = names(args.distributions, DISTRIBUTIONS)
+    kinds = names(args.kinds, KINDS)
+    functions = names(args.functions, FUNCTIONS)
+
+    records = []
+    if args.format == "table":
+        print("%-20s %-10s %-7s %8s %12s %8s" % ("function", "dist",
+                "kind", "n", "ms", "result"))
+        def report(record):
+            if record["skipped"]:
+                time = "-"
+                size = record["skipped"]
+            else:
+                time = "%.3f" % (record["seconds"] * 1e3)
+                size = record["result_size"]
+            print("%-20s %-10s %-7s %8d %12s %8s" % (record["function"],
+                    record["distribution"], record["kind"],
+                    record["objects"], time, size))
+            sys.stdout.flush()
+    elif args.format == "csv":
+        writer = csv.writer(sys.stdout)
+        header = []
+        def report(record):
+            if not header:
+                header.extend(record)
+                writer.writerow(header)
+            writer.writerow(list(record.values()))
+    else:
+        report = records.append
+
+    run(sizes, distributions, kinds, functions, args.repeat, args.min_time,
+            args.max_time, args.seed, report)
+
+    if args.format == "json":
+        json.dump({
+            "rabbyt_version": rabbyt.__version__,
+            "python_version": platform.python_version(),
+            "platform": platform.platform(),
+            "results": records,
+        }, sys.stdout, indent=1)
+        print()
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,73 @@
+"""
+Times importing rabbyt and its modules, each in a fresh interpreter, and
+shows whether OpenGL got loaded along the way.
+
+    python benchmarks/import_time.py
+    python benchmarks/import_time.py --repeat 20
+
+``import rabbyt`` only imports the scheduler; the rest of the top level names
+are imported the first time they're used.  ``rabbyt.anims``,
+``rabbyt.collisions``, ``rabbyt.primitives`` and ``rabbyt.sprites`` don't load
+OpenGL; the OpenGL backend is only imported when something of it is used,
+such as ``render_unsorted()`` or ``Sprite.render()``, and never with the
+``"null"`` backend.
+"""
+
+from __future__ import print_function
+
+import argparse
+import subprocess
+import sys
+
+
+STATEMENTS = [
+    "import rabbyt",
+    "import rabbyt.anims",
+    "import rabbyt.collisions",
+    "import rabbyt.primitives",
+    "import rabbyt.sprites",
+    "from rabbyt import *",
+    "import rabbyt; rabbyt.set_backend('null'); rabbyt.Sprite().render()",
+]
+
+# Run in the child.  The statement is timed on its own, without the time it
+# takes to start the interpreter.
+CHILD = """
+import sys, time
+start = time.perf_counter()
+%s
+elapsed = time.perf_counter() - start
+try:
+    gl = "libGL" in open("/proc/self/maps").read()
+except IOError:
+    gl = None
+print(elapsed, gl)
+"""
+
+def time_statement(statement):
+    output = subprocess.check_output([sys.executable, "-c",
+            CHILD % statement])
+    elapsed, gl = output.decode().split()
+    return float(elapsed), {"True": "yes", "False": "no"}.get(gl, "?")
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__.split("\n\n")[0])
+    parser.add_argument("--repeat", type=int, default=10,
+            help="interpreters to start for each statement "
+            "(default %(default)s)")
+    args = parser.parse_args(argv)
+
+    width = max(len(statement) for statement in STATEMENTS)
+    print("%-*s %10s %10s %6s" % (width, "statement", "best ms", "median ms",
+            "GL"))
+    for statement in STATEMENTS:
+        times = []
+        for i in range(args.repeat):
+            elapsed, gl = time_statement(statement)
+            times.append(elapsed)
+        times.sort()
+        print("%-*s %10.2f %10.2f %6s" % (width, statement, times[0] * 1e3,
+                times[len(times) // 2] * 1e3, gl))
+
+if __name__ == "__main__":
+    main()
@@ -28,37 +28,214 @@ THE SOFTWARE.
 __author__ = "Matthew Marshall <matthew@matthewmarshall.org>"
 __version__ = "0.8.4"
 
-import heapq
+import importlib
 import os.path
 import sys
-
-from rabbyt._rabbyt import *
-from rabbyt.sprites import *
-from rabbyt.anims import *
-import rabbyt.collisions
+import types
+
+# Only what the scheduler needs is imported up front.  The names from
+# rabbyt.anims and rabbyt.sprites, and the submodules, are imported the first
+# time they're used (see _LazyModule at the bottom), and the names that come
+# from the backend (such as render_unsorted and Camera) only import it when
+# they're called.  So tools and servers that only need rabbyt.anims or
+# rabbyt.collisions don't load anything else.
+from rabbyt._anims import get_time
+from rabbyt import stats
+from rabbyt import backends
+from rabbyt.backends import set_backend, get_backend
 
 from warnings import warn
 
 
+# The scheduler keeps its timers in a hierarchical timer wheel.  The first
+# wheel has a slot for each of the next 256 ticks; each slot of the next wheel
+# covers 256 ticks, then 256*64, and so on.  When the first wheel comes round
+# to the start of a slot of the next one, that slot's timers are spread out
+# over the finer wheel (they "cascade".)  Timers further away than the last
+# wheel reaches wait in an overflow slot.
+_WHEEL_BITS = (8, 6, 6, 6)
+_WHEEL_SHIFTS = (0, 8, 14, 20)
+
+class Timer(object):
+    """
+    ``Timer``
+
+    The handle returned by ``Scheduler.add()``.
+
+    ``time`` and ``callback`` are what was passed to ``add()``.
+    """
+    __slots__ = ("time", "callback", "_tick", "_seq", "_slot", "_level",
+            "_scheduler")
+
+    def cancel(self):
+        """
+        ``cancel()``
+
+        Stops the callback from being called.  Cancelling a timer that has
+        already fired (or been cancelled) does nothing.
+        """
+        if self._slot is not None:
+            del self._slot[self]
+            self._scheduler._counts[self._level] -= 1
+            self._slot = None
+
+    @property
+    def active(self):
+        """
+        ``True`` until the timer fires or is cancelled.
+        """
+        return self._slot is not None
+
+    def __repr__(self):
+        return "<Timer time=%r callback=%r%s>" % (self.time, self.callback,
+                "" if self.active else " inactive")
+
+
 class Scheduler(object):
     """
-    ``Scheduler()``
+    ``Scheduler(resolution=1)``
 
     Scheduler provides... (wait for it...)  scheduling!
 
     You may create your own scheduler instances, or use the default
     ``rabbyt.scheduler``
+
+    Timers are kept in a timer wheel, so adding and cancelling them takes
+    the same time however many are pending, and ``pump()`` only does work
+    for the timers that are due.  ``resolution`` is the length of a tick of
+    the wheel, in the same units as the times given to ``add()``.  It doesn't
+    change when callbacks are called, only how timers are sorted internally;
+    the default of ``1`` suits times in milliseconds.
     """
-    def __init__(self):
-        self.heap = []
+    def __init__(self, resolution=1):
+        self.resolution = resolution
+        self._wheels = [[{} for i in range(1 << bits)]
+                for bits in _WHEEL_BITS]
+        self._overflow = {}
+        # One count for each wheel, and one for the overflow.
+        self._counts = [0] * (len(_WHEEL_BITS) + 1)
+        # The earliest tick that hasn't been passed by pump().
+        self._tick = int(get_time() // resolution)
+        self._seq = 0
 
     def add(self, time, callback):
         """
-        ``add(time, callback)``
+        ``add(time, callback) -> Timer``
 
         Schedules a ``callback`` to be called at a given ``time``.
+
+        Callbacks scheduled for the same time are called in the order they
+        were added.  The returned ``Timer`` can be used to cancel the
+        callback.
+        """
+        timer = Timer()
+        timer.time = time
+        timer.callback = callback
+        timer._tick = int(time // self.resolution)
+        timer._seq = self._seq
+        timer._scheduler = self
+        self._seq += 1
+        self._place(timer)
+        return timer
+
+    def start(self, coroutine, time=None):
+        """
+        ``start(coroutine, [time]) -> Task``
+
+        Runs ``coroutine`` from this scheduler's ``pump()``, starting at
+        ``time`` (or ``rabbyt.get_time()``.)  The coroutine can wait on
+        ``rabbyt.sleep()``, ``rabbyt.anim_finished()`` and other ``Task``
+        instances::
+
+            async def blink(sprite):
+                while True:
+                    sprite.alpha = 0
+                    await rabbyt.sleep(200)
+                    sprite.alpha = 1
+                    await rabbyt.sleep(200)
+
+            rabbyt.scheduler.start(blink(sprite))
+
+        Before Python 3.5, use a generator with ``yield from`` in place of
+        ``await``.
+
+        Tasks only hold on to a timer while they are waiting, so there can be
+        many thousands of them.
+        """
+        task = Task(coroutine, self)
+        task._schedule(get_time() if time is None else time)
+        return task
+
+    def _place(self, timer):
+        delta = timer._tick - self._tick
+        if delta < 0:
+            # Late timers go in the current slot, which pump() always checks.
+            delta = 0
+        tick = self._tick + delta
+        for level, shift in enumerate(_WHEEL_SHIFTS):
+            if delta < 1 << (shift + _WHEEL_BITS[level]):
+                slot = self._wheels[level][(tick >> shift) &
+                        ((1 << _WHEEL_BITS[level]) - 1)]
+                break
+        else:
+            level = len(_WHEEL_BITS)
+            slot = self._overflow
+        slot[timer] = None
+        timer._slot = slot
+        timer._level = level
+        self._counts[level] += 1
+
+    def _cascade(self, level):
+        """
+        Spreads out the timers in the current slot of wheel ``level`` (or the
+        overflow) over the finer wheels.
         """
-        heapq.heappush(self.heap, (time, callback))
+        if level == len(_WHEEL_BITS):
+            slot = self._overflow
+        else:
+            slot = self._wheels[level][(self._tick >> _WHEEL_SHIFTS[level]) &
+                    ((1 << _WHEEL_BITS[level]) - 1)]
+        if not slot:
+            return
+        timers = list(slot)
+        slot.clear()
+        self._counts[level] -= len(timers)
+        for timer in timers:
+            self._place(timer)
+
+    def _advance(self, target):
+        """
+        Moves to the next tick that could have timers in it, without going
+        past ``target``.
+        """
+        tick = self._tick
+        # Skip over whole slots of the coarser wheels while the finer ones are
+        # empty.
+        level = 0
+        while level < len(self._counts) and not self._counts[level]:
+            level += 1
+        if level == len(self._counts):
+            self._tick = target
+            return
+        if level == 0:
+            # Look for the next slot with timers in it, up to the next
+            # cascade.
+            end = min((tick | 255) + 1, target)
+            wheel = self._wheels[0]
+            tick += 1
+            while tick < end and not wheel[tick & 255]:
+                tick += 1
+        else:
+            # The number of ticks between cascades of this wheel.
+            step = 1 << (_WHEEL_SHIFTS[level-1] + _WHEEL_BITS[level-1])
+            tick = min((tick // step + 1) * step, target)
+        self._tick = tick
+        # Cascade each wheel whose slot boundary we've reached, coarsest last.
+        for level in range(1, len(_WHEEL_BITS) + 1):
+            if tick & ((1 << (_WHEEL_SHIFTS[level-1] +
+                    _WHEEL_BITS[level-1])) - 1):
+                break
+            self._cascade(level)
 
     def pump(self, time=None):
         """
@@ -69,16 +246,218 @@ class Scheduler(object):
         If ``time`` is not given, the value returned by ``rabbyt.get_time()``
         will be used.
         """
+        if stats.enabled:
+            start = stats.clock()
+            try:
+                self._pump(time)
+            finally:
+                stats.pump_time += stats.clock() - start
+        else:
+            self._pump(time)
+
+    def _pump(self, time):
         if time is None:
             time = get_time()
+        target = int(time // self.resolution)
+        while True:
+            tick = self._tick
+            slot = self._wheels[0][tick & 255]
+            while slot:
+                due = [t for t in slot if t.time <= time]
+                if not due:
+                    break
+                due.sort(key=lambda t: (t.time, t._seq))
+                for timer in due:
+                    # An earlier callback might have cancelled this one.
+                    if timer._slot is slot:
+                        timer.cancel()
+                        timer.callback()
+            if tick >= target:
+                break
+            self._advance(target)
+
+    def __len__(self):
+        return sum(self._counts)
+
+
+class _Wait(object):
+    # What a task's coroutine yields to tell the task when to resume it.
+    # Either ``delay`` (since the task last resumed) or ``time`` is set.
+    __slots__ = ("delay", "time")
+
+    def __init__(self, delay, time):
+        self.delay = delay
+        self.time = time
+
+    def __await__(self):
+        yield self
+    __iter__ = __await__
+
+def sleep(dt):
+    """
+    ``sleep(dt)``
+
+    Returns an awaitable that resumes a ``Task`` ``dt`` after it was last
+    resumed.  That is the time the task was due, not when ``pump()`` got
+    round to it, so a loop of sleeps keeps in step with the clock::
+
+        await rabbyt.sleep(1000)
+
+    ``sleep(0)`` resumes the task on the next ``pump()``.
+    """
+    return _Wait(dt, None)
+
+def anim_finished(anim, name=None):
+    """
+    ``anim_finished(anim, [name])``
+
+    Returns an awaitable that resumes a ``Task`` at ``anim.end_time``.
+
+    Reading an anim slot of a sprite gives its current value rather than the
+    anim, so to wait on the anim in a slot, pass the sprite and the name of
+    the slot::
+
+        sprite.x = rabbyt.lerp(0, 100, dt=500)
+        await rabbyt.anim_finished(sprite, "x")
+
+    A slot without an anim (including one whose anim has finished and been
+    let go of) resumes the task straight away.  ``anim`` can also be a time.
+    """
+    if name is not None:
+        anim = getattr(type(anim), name).get_slot(anim).anim
+        if anim is None:
+            return _Wait(0, None)
+    if isinstance(anim, (int, float)):
+        return _Wait(None, anim)
+    try:
+        return _Wait(None, anim.end_time)
+    except AttributeError:
+        raise TypeError("%r doesn't have an end time" % (anim,))
+
+
+class Task(object):
+    """
+    ``Task``
+
+    A coroutine being run by a ``Scheduler``, as returned by
+    ``Scheduler.start()``.
+
+    ``done`` becomes ``True`` when the coroutine returns, raises or is
+    cancelled.  The value it returned is in ``result``; an exception it raised
+    is in ``exception``, and is also raised from ``pump()``.
+
+    A coroutine can ``await`` another task, which gives the value it
+    returned (or raises its exception.)
+    """
+    __slots__ = ("_coroutine", "_scheduler", "_timer", "_now", "_send",
+            "_throw", "_waiters", "_resume", "done", "cancelled", "result",
+            "exception")
+
+    def __init__(self, coroutine, scheduler):
+        self._coroutine = coroutine
+        self._scheduler = scheduler
+        self._timer = None
+        # The time the task was last resumed at.
+        self._now = None
+        # What to pass in to the coroutine when it's resumed.
+        self._send = None
+        self._throw = None
+        self._waiters = []
+        # Made once, so that each step doesn't create a new bound method.
+        self._resume = self._step
+        self.done = False
+        self.cancelled = False
+        self.result = None
+        self.exception = None
+
+    def _schedule(self, time):
+        if self._now is not None and time < self._now:
+            time = self._now
+        self._now = time
+        self._timer = self._scheduler.add(time, self._resume)
+
+    def _step(self):
+        self._timer = None
         try:
-            while self.heap[0][0] <= time:
-                heapq.heappop(self.heap)[1]()
-        except IndexError as e:
-            # If the IndexError was raised due to something other than an
-            # empty heap we don't want to silence it.
-            if len(self.heap) != 0:
-                raise
+            if self._throw is not None:
+                exception, self._throw = self._throw, None
+                wait = self._coroutine.throw(exception)
+            else:
+                value, self._send = self._send, None
+                wait = self._coroutine.send(value)
+        except StopIteration as e:
+            self._finish(getattr(e, "value", None), None)
+            return
+        except BaseException as e:
+            self._finish(None, e)
+            raise
+        if isinstance(wait, _Wait):
+            if wait.time is None:
+                self._schedule(self._now + wait.delay)
+            else:
+                self._schedule(wait.time)
+        elif isinstance(wait, Task):
+            if wait.done:
+                wait._wake(self)
+            else:
+                wait._waiters.append(self)
+        else:
+            self._coroutine.close()
+            error = TypeError("tasks can only wait on sleep(), "
+                    "anim_finished() and other tasks, not %r" % (wait,))
+            self._finish(None, error)
+            raise error
+
+    def _wake(self, waiter):
+        if waiter.done:
+            return
+        if self.exception is not None:
+            waiter._throw = self.exception
+        else:
+            waiter._send = self.result
+        waiter._schedule(self._now)
+
+    def _finish(self, result, exception):
+        self.done = True
+        self.result = result
+        self.exception = exception
+        waiters, self._waiters = self._waiters, []
+        for waiter in waiters:
+            self._wake(waiter)
+
+    def __await__(self):
+        if not self.done:
+            yield self
+        if self.exception is not None:
+            raise self.exception
+        return self.result
+    __iter__ = __await__
+
+    def cancel(self):
+        """
+        ``cancel()``
+
+        Stops the task, closing its coroutine (which raises ``GeneratorExit``
+        at the ``await`` it is waiting on.)  Tasks waiting on this one are
+        resumed with ``None``.  Cancelling a finished task does nothing.
+        """
+        if self.done:
+            return
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        self._coroutine.close()
+        self.cancelled = True
+        self._finish(None, None)
+
+    def __repr__(self):
+        if self.cancelled:
+            state = "cancelled"
+        elif self.done:
+            state = "done"
+        else:
+            state = "pending"
+        return "<Task %r %s>" % (self._coroutine, state)
 
 scheduler = Scheduler()
 
@@ -104,12 +483,13 @@ def init_display(size=(640, 480), flags = 0):
         rabbyt.set_viewport(size)
         rabbyt.set_default_attribs()
         """, stacklevel=2)
+    backend = backends.get_module()
     pygame = __import__("pygame", {},{},[])
     pygame.init()
     surface = pygame.display.set_mode(size, pygame.OPENGL |
             pygame.DOUBLEBUF | flags)
-    set_viewport(size)
-    set_default_attribs()
+    backend.set_viewport(size)
+    backend.set_default_attribs()
     return surface
 
 _texture_cache = {}
@@ -126,16 +506,22 @@ def pygame_load_texture(filename, filter=True, mipmap=True):
 
     If ``filename`` is a relative path, the working directory is searched
     first, then ``rabbyt.data_directory`` is searched for the file.
+
+    An ``AlphaMask`` is built from the image for ``collisions.pixel_filter()``.
+    (See ``collisions.set_alpha_mask()``.)
     """
     if filename not in _texture_cache:
+        from rabbyt import collisions
         pygame = __import__("pygame", {},{},[])
         if os.path.exists(filename):
             img = pygame.image.load(filename)
         else:
             img = pygame.image.load(os.path.join(data_directory, filename))
         data, size = pygame.image.tostring(img, 'RGBA', True), img.get_size()
-        _texture_cache[filename] = load_texture(data, size, "RGBA",
-                filter, mipmap), size
+        texture_id = backends.get_module().load_texture(data, size, "RGBA",
+                filter, mipmap)
+        collisions.set_alpha_mask(texture_id, data, size)
+        _texture_cache[filename] = texture_id, size
     return _texture_cache[filename]
 
 def pyglet_load_texture(filename):
@@ -188,12 +574,72 @@ def autodetect_load_texture(filename):
     else:
         func = pygame_load_texture
 
-    set_load_texture_file_hook(func)
+    backends.get_module().set_load_texture_file_hook(func)
     return func(filename)
-set_load_texture_file_hook(autodetect_load_texture)
 
-__all__ = __docs_all__ = ('sprites anims primitives collisions '
-'Scheduler '
+def _backend_function(name, signature):
+    # A function that calls the one called ``name`` in the current backend,
+    # so that it follows set_backend() without importing the backend now.
+    def function(*args, **kwargs):
+        return getattr(backends.get_module(), name)(*args, **kwargs)
+    function.__name__ = name
+    function.__doc__ = """
+    ``%s``
+
+    Calls ``%s()`` of the current backend (see ``rabbyt.backends``.)
+    """ % (signature, name)
+    return function
+
+render_unsorted = _backend_function("render_unsorted",
+        "render_unsorted(sprites, [camera])")
+render_sorted = _backend_function("render_sorted",
+        "render_sorted(sprites, [camera])")
+set_viewport = _backend_function("set_viewport",
+        "set_viewport(viewport, [projection])")
+set_default_attribs = _backend_function("set_default_attribs",
+        "set_default_attribs()")
+set_gl_color = _backend_function("set_gl_color", "set_gl_color(rgba)")
+clear = _backend_function("clear", "clear(rgba=(0.0,0.0,0.0,1.0))")
+get_gl_vendor = _backend_function("get_gl_vendor", "get_gl_vendor()")
+pick_texture_target = _backend_function("pick_texture_target",
+        "pick_texture_target()")
+load_texture = _backend_function("load_texture", "load_texture(byte_string, "
+        "size, type_='RGBA', filter=True, mipmap=True) -> texture_id")
+update_texture = _backend_function("update_texture", "update_texture("
+        "texture_id, byte_string, size, type_='RGBA', filter=True, "
+        "mipmap=True)")
+unload_texture = _backend_function("unload_texture",
+        "unload_texture(texture_id)")
+set_load_texture_file_hook = _backend_function("set_load_texture_file_hook",
+        "set_load_texture_file_hook(callback)")
+
+class _BackendClass(type):
+    # Creating an instance, isinstance() and issubclass() all go to the class
+    # with the same name in the current backend.
+    def _backend_class(cls):
+        return getattr(backends.get_module(), cls.__name__)
+
+    def __call__(cls, *args, **kwargs):
+        return cls._backend_class()(*args, **kwargs)
+
+    def __instancecheck__(cls, obj):
+        return isinstance(obj, cls._backend_class())
+
+    def __subclasscheck__(cls, subclass):
+        return issubclass(subclass, cls._backend_class())
+
+class Camera(object, metaclass=_BackendClass):
+    """
+    ``Camera(viewport, x=0, y=0, zoom=1, rot=0)``
+
+    Creates a ``Camera`` of the current backend (see ``rabbyt.backends``.)
+    To subclass it, use ``rabbyt.backends.get_module().Camera``.
+    """
+
+__all__ = __docs_all__ = ('sprites anims primitives collisions stats '
+'backends '
+'Scheduler Timer Task sleep anim_finished Camera '
+'set_backend get_backend '
 'set_viewport set_default_attribs clear '
 'get_gl_vendor '
 'render_unsorted '
@@ -203,3 +649,46 @@ __all__ = __docs_all__ = ('sprites anims primitives collisions '
 # Some people might be using from rabbyt import *.  I might as well keep
 # init_display there for now.
 __all__.append("init_display")
+
+_submodules = frozenset(
+        "sprites anims primitives collisions glstate stats".split())
+# The names in these modules used to be imported into rabbyt with
+# ``import *``.
+_star_modules = ("rabbyt.anims", "rabbyt.sprites")
+
+class _LazyModule(types.ModuleType):
+    # Stands in for this module in sys.modules, so that the names above can
+    # be looked up when they're first used.  (A module level __getattr__
+    # would do, but needs Python 3.7.)  The functions defined here still use
+    # the module's own globals, so anything set on this is set there too.
+    def __init__(self, module_globals):
+        types.ModuleType.__init__(self, module_globals["__name__"])
+        object.__setattr__(self, "_globals", module_globals)
+        self.__dict__.update(module_globals)
+
+    def __setattr__(self, name, value):
+        types.ModuleType.__setattr__(self, name, value)
+        self._globals[name] = value
+
+    def __delattr__(self, name):
+        types.ModuleType.__delattr__(self, name)
+        self._globals.pop(name, None)
+
+    def __getattr__(self, name):
+        # Only called for names that haven't been looked up yet.
+        if name in _submodules:
+            return importlib.import_module("rabbyt." + name)
+        if not name.startswith("_"):
+            for module_name in _star_modules:
+                module = importlib.import_module(module_name)
+                if name in module.__dict__:
+                    value = module.__dict__[name]
+                    setattr(self, name, value)
+                    return value
+        raise AttributeError("module %r has no attribute %r" % (
+                self.__name__, name))
+
+    def __dir__(self):
+        return sorted(set(self.__dict__) | set(__all__))
+
+sys.modules[__name__] = _LazyModule(globals())
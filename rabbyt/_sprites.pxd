@@ -7,8 +7,10 @@ cdef class cBaseSprite(cAnimable):
     cdef AnimSlot_s     _x, _y, _rot
     cdef AnimSlot_s _red, _green, _blue, _alpha
     cdef AnimSlot_s _scale_x, _scale_y
+    cdef unsigned int _collision_category, _collision_mask
     cdef _modify_slots(self)
     cdef Point2d _convert_offset(self, float ox, float oy)
+    cdef double _get_bounding_radius(self)
 
 
 
@@ -19,11 +21,28 @@ cdef class cSprite(cBaseSprite):
     cdef AnimSlot_s _u, _v
 
     cdef int _texture_id
+    cdef int _texture_target
 
     cdef int _bounding_radius_is_explicit
 
     cdef _modify_slots(self)
     cdef int _render(self) except -1
+    cdef double _get_bounding_radius(self)
 
     cdef float2 _bounds_x(self)
     cdef float2 _bounds_y(self)
+
+
+# How sprites get drawn.  render_sprite() draws a Sprite (it's what
+# cSprite._render() calls.)  push_transform() and pop_transform() wrap
+# BaseSprite.render_after_transform(), and invalidate() is called when
+# something other than the renderer may have changed its state.
+ctypedef struct sprite_renderer_s:
+    int (*render_sprite)(cSprite sprite) except -1
+    void (*push_transform)(float x, float y, float rot, float scale_x,
+            float scale_y)
+    void (*pop_transform)()
+    void (*invalidate)()
+
+cdef void set_sprite_renderer(sprite_renderer_s * renderer)
+cdef sprite_renderer_s * get_sprite_renderer()
@@ -4,10 +4,19 @@
 #include "stdio.h"
 #include "include_math.h"
 
+#ifdef _WIN32
+#include <windows.h>
+#else
+#include <time.h>
+#endif
+
 int system_step=1;
 float system_time;
 int exception_state;
 
+FrameStats frame_stats;
+AnimProfiler anim_profiler;
+
 void _set_time(float t){
     system_time = t;
     system_step += 1;
@@ -26,6 +35,20 @@ void _invalidate_caches(void){
     system_step += 1;
 }
 
+/* Monotonic wall clock in seconds, used for timing in rabbyt.stats. */
+double _get_clock(void){
+#ifdef _WIN32
+    LARGE_INTEGER frequency, counter;
+    QueryPerformanceFrequency(&frequency);
+    QueryPerformanceCounter(&counter);
+    return (double)counter.QuadPart / (double)frequency.QuadPart;
+#else
+    struct timespec ts;
+    clock_gettime(CLOCK_MONOTONIC, &ts);
+    return ts.tv_sec + ts.tv_nsec * 1e-9;
+#endif
+}
+
 float _out_bounce(float t){
     float x;
     if (t < 1./2.75) x = 7.5625*t*t;
@@ -42,7 +65,10 @@ float interpolate_func(AnimSlot_s * slot){
     float x;
     float s;
     InterpolateAnim_data * d;
+    if (ANIM_PROFILING(slot))
+        return anim_profiler.hook(slot, interpolate_func);
     d = (InterpolateAnim_data *)(slot->anim->data);
+    COUNT_ANIM_EVAL();
     
 
     if (d->use_global_time){
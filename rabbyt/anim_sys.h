@@ -7,6 +7,27 @@ extern float system_time;
 extern int exception_state;
 
 
+/* Counters for rabbyt.stats.  Nothing is counted unless enabled is set. */
+typedef struct {
+    int enabled;
+    long sprites_rendered;
+    long sprites_culled;
+    long draw_calls;
+    long texture_binds;
+    long vertices;
+    long anim_evaluations;
+    double render_time;
+    double collision_time;
+} FrameStats;
+
+extern FrameStats frame_stats;
+
+/* Only usable from code linked with anim_sys.c */
+#define COUNT_ANIM_EVAL() do {\
+    if (frame_stats.enabled) frame_stats.anim_evaluations++;\
+    } while(0)
+
+
 #define SLOT_ANIM -1
 #define SLOT_LOCAL -2
 
@@ -75,6 +96,7 @@ typedef struct {
     void * data;
     float (*on_end)(struct s_AnimSlot_s * slot, void * data, float end);
     void * on_end_data;
+    void * owner;   /* The python Anim object that this is a part of. */
 } Anim_s;
 
 typedef struct s_AnimSlot_s {
@@ -88,8 +110,27 @@ typedef struct s_AnimSlot_s {
         float local;        // if type is SLOT_LOCAL
     };
     int recursion_check;
+    /* The python AnimSlot holding the reference to the anim, if any.  It
+     * lets go of the anim when the anim finishes. */
+    void * owner;
 } AnimSlot_s;
 
+/* State for the anim profiler in _anims.pyx.  While enabled, every anim
+ * function passes its call through hook(), which times it and then calls the
+ * function again with current set to the anim, so that it runs normally. */
+typedef struct {
+    int enabled;
+    Anim_s * current;
+    double child_time;
+    float (*hook)(AnimSlot_s * slot, AnimFunc func);
+} AnimProfiler;
+
+extern AnimProfiler anim_profiler;
+
+/* Only usable from code linked with anim_sys.c */
+#define ANIM_PROFILING(slot) \
+    (anim_profiler.enabled && anim_profiler.current != (slot)->anim)
+
 typedef struct {
     AnimSlot_s start, end;
     AnimSlot_s t;
@@ -104,3 +145,5 @@ void _set_time(float t);
 void _add_time(float t);
 float _get_time(void);
 
+double _get_clock(void);
+
@@ -730,4 +730,6 @@ def rate(target):
 __docs_all__ = ('set_time get_time add_time '
 'lerp ease ease_in ease_out chain wrap '
 'Anim AnimConst AnimPyFunc AnimProxy '
+'enable_anim_profiling disable_anim_profiling reset_anim_profile '
+'get_anim_profile '
 ).split()
@@ -0,0 +1,89 @@
+"""
+Rabbyt's rendering and texture functions (``render_unsorted()``,
+``load_texture()``, ``Camera`` and so on) come from a backend, as does the
+code that draws a ``Sprite`` when its ``render()`` method is called.
+
+``"gl"``
+    The default.  Draws with OpenGL (``rabbyt._rabbyt``.)
+
+``"null"``
+    Doesn't draw anything, and doesn't need OpenGL (``rabbyt.nullbackend``.)
+    Anims, collisions and the bounds of sprites all work as usual, so a
+    server can run the same game code as the client.
+
+Pick the backend before using any of its names, as ``from rabbyt import
+render_unsorted`` keeps whichever function was current at the time::
+
+    import rabbyt
+    rabbyt.set_backend("null")
+"""
+
+__credits__ = (
+"""
+Copyright (C) 2007  Matthew Marshall
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+""")
+
+__author__ = "Matthew Marshall <matthew@matthewmarshall.org>"
+
+import importlib
+
+_modules = {
+    "gl": "rabbyt._rabbyt",
+    "null": "rabbyt.nullbackend",
+}
+
+_name = "gl"
+_module = None
+
+def set_backend(name):
+    """
+    ``set_backend(name)``
+
+    Switches to the backend called ``name``, either ``"gl"`` or ``"null"``.
+    """
+    global _name, _module
+    if name not in _modules:
+        raise ValueError("unknown backend %r (expected one of %s)" %
+                (name, ", ".join(sorted(_modules))))
+    module = importlib.import_module(_modules[name])
+    module._install_renderer()
+    _name = name
+    _module = module
+
+def get_backend():
+    """
+    ``get_backend() -> name``
+
+    Returns the name of the current backend.
+    """
+    return _name
+
+def get_module():
+    """
+    ``get_module() -> module``
+
+    Returns the module of the current backend, importing it if needed.
+    """
+    if _module is None:
+        set_backend(_name)
+    return _module
+
+__docs_all__ = ["set_backend", "get_backend", "get_module"]
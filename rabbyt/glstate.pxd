@@ -0,0 +1,7 @@
+cdef void gl_enable(unsigned int cap)
+cdef void gl_disable(unsigned int cap)
+cdef void gl_bind_texture(unsigned int target, unsigned int texture)
+cdef void gl_color4fv(float * color)
+cdef void gl_blend_func(unsigned int sfactor, unsigned int dfactor)
+cdef void gl_forget_texture(unsigned int texture)
+cdef void gl_invalidate()
@@ -0,0 +1,208 @@
+"""
+The ``"null"`` backend, selected with ``rabbyt.set_backend("null")``.
+
+It has the same functions as the OpenGL backend, but nothing is drawn and
+OpenGL is never loaded.  Sprites, anims and collisions work as usual, so the
+same game code can run on a headless server.
+
+``render_unsorted()`` only counts the sprites that would have been drawn (and
+culled) in ``rabbyt.stats``.  ``load_texture()`` hands out texture ids
+without storing anything.  Texture files are still read with pygame (which
+doesn't need OpenGL) so that sprites get the same ``shape`` and alpha masks
+as on the client; use ``set_load_texture_file_hook()`` to do something else.
+"""
+
+__credits__ = (
+"""
+Copyright (C) 2007  Matthew Marshall
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+""")
+
+__author__ = "Matthew Marshall <matthew@matthewmarshall.org>"
+
+import itertools
+import math
+
+from rabbyt import stats, collisions
+from rabbyt._anims import _count_render
+from rabbyt._sprites import cBaseSprite, cSprite, _install_null_renderer
+
+# From GL/gl.h
+GL_TEXTURE_2D = 0x0DE1
+
+def _install_renderer():
+    # Called by rabbyt.backends when this backend is selected.
+    _install_null_renderer()
+
+
+def _in_bounds(obj, l, t, r, b):
+    # Objects that aren't sprites are assumed to be visible.
+    if not isinstance(obj, cBaseSprite):
+        return True
+    x, y, radius = obj.x, obj.y, obj.bounding_radius
+    return (x + radius >= l and x - radius <= r and
+            y + radius >= b and y - radius <= t)
+
+class Camera(object):
+    """
+    ``Camera(viewport, x=0, y=0, zoom=1, rot=0)``
+
+    The same as the OpenGL backend's ``Camera``, except that ``apply()``
+    doesn't do anything.  ``bounds``, ``is_visible()`` and ``cull()`` can be
+    used to find out what a player can see.
+    """
+    def __init__(self, viewport, x=0, y=0, zoom=1, rot=0):
+        self.viewport = viewport
+        self.x = x
+        self.y = y
+        self.zoom = zoom
+        self.rot = rot
+
+    def _get_viewport(self):
+        return self._viewport
+    def _set_viewport(self, viewport):
+        if len(viewport) == 4:
+            l, t, r, b = viewport
+        else:
+            l, t = 0, 0
+            r, b = viewport
+        for i in (l,t,r,b):
+            if i < 0:
+                raise ValueError("Viewport values cannot be negative")
+        self._viewport = (int(l), int(t), int(r), int(b))
+    viewport = property(_get_viewport, _set_viewport)
+
+    def _get_xy(self):
+        return (self.x, self.y)
+    def _set_xy(self, value):
+        self.x, self.y = value
+    xy = property(_get_xy, _set_xy)
+
+    @property
+    def bounds(self):
+        vl, vt, vr, vb = self._viewport
+        hw = (vr - vl) / (2.0 * self.zoom)
+        hh = (vb - vt) / (2.0 * self.zoom)
+        if self.rot != 0:
+            co = abs(math.cos(math.radians(self.rot)))
+            si = abs(math.sin(math.radians(self.rot)))
+            hw, hh = hw*co + hh*si, hw*si + hh*co
+        return (self.x - hw, self.y + hh, self.x + hw, self.y - hh)
+
+    def is_visible(self, obj):
+        return _in_bounds(obj, *self.bounds)
+
+    def cull(self, sprites):
+        l, t, r, b = self.bounds
+        return [s for s in sprites if _in_bounds(s, l, t, r, b)]
+
+    def apply(self):
+        pass
+
+    def __repr__(self):
+        return "<Camera (%r, %r) zoom=%r rot=%r>" % (self.x, self.y,
+                self.zoom, self.rot)
+
+
+def render_unsorted(sprites, camera=None):
+    """
+    ``render_unsorted(sprites, [camera])``
+
+    Counts the sprites that would be rendered, and the ones outside of
+    ``camera``'s view, in ``rabbyt.stats``.  ``render()`` isn't called.
+    """
+    if not stats.enabled:
+        return
+    start = stats.clock()
+    rendered = culled = vertices = 0
+    if camera is not None:
+        l, t, r, b = camera.bounds
+    for s in sprites:
+        if camera is not None and not _in_bounds(s, l, t, r, b):
+            culled += 1
+            continue
+        rendered += 1
+        if isinstance(s, cSprite):
+            vertices += 4
+    _count_render(rendered, culled, vertices, stats.clock() - start)
+
+def render_sorted(sprites, camera=None):
+    render_unsorted(sprites, camera)
+
+def set_viewport(viewport, projection=None):
+    pass
+
+def set_default_attribs():
+    pass
+
+def set_gl_color(rgba):
+    pass
+
+def clear(rgba=(0.0,0.0,0.0,1.0)):
+    pass
+
+def get_gl_vendor():
+    """
+    ``get_gl_vendor()``
+
+    Returns None, as there is never an OpenGL context.
+    """
+    return None
+
+def pick_texture_target():
+    return GL_TEXTURE_2D
+
+
+_texture_ids = itertools.count(1)
+
+def load_texture(byte_string, size, type_='RGBA', filter=True, mipmap=True):
+    """
+    ``load_texture(byte_string, size, type_='RGBA', filter=True, mipmap=True)``
+
+    Returns a new texture id.  Nothing is loaded.
+    """
+    return next(_texture_ids)
+
+def update_texture(texture_id, byte_string, size, type_='RGBA', filter=True,
+        mipmap=True):
+    collisions._update_alpha_mask(texture_id, byte_string, size, type_)
+
+def unload_texture(texture_id):
+    collisions.remove_alpha_mask(texture_id)
+
+
+def _pygame_load_texture(filename):
+    import rabbyt
+    return rabbyt.pygame_load_texture(filename)
+
+load_texture_file_hook = _pygame_load_texture
+
+def set_load_texture_file_hook(callback):
+    """
+    ``set_load_texture_file_hook(callback)``
+
+    Sets the ``callback`` that is used to load a texture from a file.  The
+    default uses ``rabbyt.pygame_load_texture()``.
+    """
+    global load_texture_file_hook
+    load_texture_file_hook = callback
+
+__docs_all__ = ["Camera", "render_unsorted", "render_sorted", "load_texture",
+        "set_load_texture_file_hook"]
@@ -6,6 +6,7 @@ cdef extern from "anim_sys.h":
         void * data
         float (*on_end)(AnimSlot_s * slot, void * data, float end)
         void * on_end_data
+        void * owner
 
     ctypedef struct AnimSlot_s:
         #union {
@@ -18,6 +19,7 @@ cdef extern from "anim_sys.h":
         float local        # if type is SLOT_LOCAL
         #};
         int recursion_check
+        void * owner
 
     cdef int SLOT_ANIM, SLOT_LOCAL
     cdef int EXTEND_CONSTANT, EXTEND_EXTRAPOLATE, EXTEND_REPEAT, EXTEND_REVERSE
@@ -31,6 +33,20 @@ cdef extern from "anim_sys.h":
 
     cdef void READ_SLOT(AnimSlot_s * slot, float * out)
 
+    ctypedef struct FrameStats:
+        int enabled
+        long sprites_rendered
+        long sprites_culled
+        long draw_calls
+        long texture_binds
+        long vertices
+        long anim_evaluations
+        double render_time
+        double collision_time
+
+cdef FrameStats * get_frame_stats()
+cdef double stats_clock()
+
 cdef class cAnimable:
     cdef object _anim_list
     cdef int c_slot_count
@@ -49,6 +49,9 @@ cdef extern from "stdlib.h":
 cdef extern from "Python.h":
     cdef int PyNumber_Check(object o)
 
+cdef extern from "string.h":
+    cdef void *memset(void *s, int c, size_t n)
+
 cdef extern from "anim_sys.h":
     cdef void _set_time(float t)
     cdef void _add_time(float t)
@@ -63,7 +66,21 @@ cdef extern from "anim_sys.h":
 
     cdef AnimFunc interpolate_func
 
+    cdef FrameStats frame_stats
+    cdef void COUNT_ANIM_EVAL()
+    cdef double _get_clock()
+
+    cdef int system_step
+    ctypedef struct AnimProfiler:
+        int enabled
+        Anim_s * current
+        double child_time
+        float (*hook)(AnimSlot_s * slot, AnimFunc func)
+    cdef AnimProfiler anim_profiler
+    cdef int ANIM_PROFILING(AnimSlot_s * slot)
+
 import warnings
+from collections import namedtuple as _namedtuple
 
 def set_time(float t):
     """
@@ -111,10 +128,200 @@ def add_time(float t):
     _add_time(t)
     return _get_time()
 
+cdef FrameStats * get_frame_stats():
+    """
+    Returns the counters used by ``rabbyt.stats``.  The other rabbyt modules
+    use this to get at the (one and only) set of counters.
+    """
+    return &frame_stats
+
+cdef double stats_clock():
+    return _get_clock()
+
+# The following are used by rabbyt.stats; look there for the public interface.
+
+def _set_frame_stats_enabled(enabled):
+    frame_stats.enabled = bool(enabled)
+
+def _reset_frame_stats():
+    cdef int enabled
+    enabled = frame_stats.enabled
+    memset(&frame_stats, 0, sizeof(FrameStats))
+    frame_stats.enabled = enabled
+
+def _count_render(rendered, culled, vertices, render_time):
+    # Used by rabbyt.nullbackend, which renders in python.
+    if frame_stats.enabled:
+        frame_stats.sprites_rendered = frame_stats.sprites_rendered + rendered
+        frame_stats.sprites_culled = frame_stats.sprites_culled + culled
+        frame_stats.vertices = frame_stats.vertices + vertices
+        frame_stats.render_time = frame_stats.render_time + render_time
+
+def _get_frame_stats():
+    return {
+        "sprites_rendered": frame_stats.sprites_rendered,
+        "sprites_culled": frame_stats.sprites_culled,
+        "draw_calls": frame_stats.draw_calls,
+        "texture_binds": frame_stats.texture_binds,
+        "vertices": frame_stats.vertices,
+        "anim_evaluations": frame_stats.anim_evaluations,
+        "render_time": frame_stats.render_time,
+        "collision_time": frame_stats.collision_time,
+    }
+
+AnimProfile = _namedtuple("AnimProfile", ["anim", "evaluations", "total_time",
+        "self_time", "max_per_step", "repeated"])
+AnimTypeProfile = _namedtuple("AnimTypeProfile", ["type", "anims",
+        "evaluations", "total_time", "self_time", "repeated"])
+
+# Anims with at least one evaluation since the last reset_anim_profile().
+cdef object _profiled_anims
+_profiled_anims = []
+
+cdef float _profile_anim(AnimSlot_s * slot, AnimFunc func):
+    """
+    Installed as ``anim_profiler.hook``.  Times ``func`` for the anim in
+    ``slot`` and charges it to the ``Anim`` that owns it.
+    """
+    cdef Anim anim
+    cdef AnimProfile_s * p
+    cdef Anim_s * outer
+    cdef double outer_child_time, start, elapsed
+    cdef float v
+    # Holding a reference keeps the anim alive even if evaluating it drops
+    # the last one (an AnimPyFunc can do just about anything.)
+    anim = <Anim>slot.anim.owner
+    p = &anim._profile
+    if p.evaluations == 0:
+        _profiled_anims.append(anim)
+
+    outer = anim_profiler.current
+    outer_child_time = anim_profiler.child_time
+    anim_profiler.current = slot.anim
+    anim_profiler.child_time = 0
+    start = _get_clock()
+    v = func(slot)
+    elapsed = _get_clock() - start
+
+    p.evaluations = p.evaluations + 1
+    p.total_time = p.total_time + elapsed
+    p.self_time = p.self_time + elapsed - anim_profiler.child_time
+    if p.last_step == system_step:
+        p.step_evaluations = p.step_evaluations + 1
+        p.repeated_evaluations = p.repeated_evaluations + 1
+    else:
+        p.last_step = system_step
+        p.step_evaluations = 1
+    if p.step_evaluations > p.max_step_evaluations:
+        p.max_step_evaluations = p.step_evaluations
+
+    anim_profiler.current = outer
+    anim_profiler.child_time = outer_child_time + elapsed
+    return v
+
+anim_profiler.hook = _profile_anim
+
+def enable_anim_profiling():
+    """
+    ``enable_anim_profiling()``
+
+    Starts counting and timing the evaluations of each anim.  Results are
+    read with ``get_anim_profile()``.
+
+    Profiling adds a couple of clock reads to every anim evaluation, so
+    expect things to get slower while it's on.  Profiled anims are kept
+    alive until ``reset_anim_profile()`` is called.
+    """
+    anim_profiler.enabled = 1
+
+def disable_anim_profiling():
+    """
+    ``disable_anim_profiling()``
+
+    Stops profiling.  Results collected so far are kept.
+    """
+    anim_profiler.enabled = 0
+
+def reset_anim_profile():
+    """
+    ``reset_anim_profile()``
+
+    Forgets all results collected by the profiler.
+    """
+    cdef Anim anim
+    for anim in _profiled_anims:
+        memset(&anim._profile, 0, sizeof(AnimProfile_s))
+    del _profiled_anims[:]
+
+def get_anim_profile(top=None, sort="self_time", by_type=False):
+    """
+    ``get_anim_profile(top=None, sort="self_time", by_type=False)``
+
+    Returns a list of ``AnimProfile`` records for the anims evaluated while
+    profiling, sorted from highest to lowest ``sort`` field.  If ``top`` is
+    given only that many are returned.
+
+    Each record has these fields:
+
+        ``anim``
+            The anim.
+
+        ``evaluations``
+            How many times it was evaluated.
+
+        ``total_time``
+            Seconds spent evaluating it, including the anims it reads.
+
+        ``self_time``
+            ``total_time``, minus the time spent in other profiled anims.
+
+        ``max_per_step``
+            The most times it was evaluated between two changes of the time
+            (as done by ``set_time()`` or ``add_time()``.)  Anything above
+            ``1`` means the same value was computed more than once; reading
+            the value once and reusing it, or using ``AnimProxy``, might help.
+
+        ``repeated``
+            The number of those extra evaluations.
+
+    If ``by_type`` is ``True``, ``AnimTypeProfile`` records are returned
+    instead, which add up the results for each class of anim.  They have the
+    fields ``type``, ``anims`` (the number of anims of that type), and
+    ``evaluations``, ``total_time``, ``self_time`` and ``repeated`` as above.
+    """
+    cdef Anim anim
+    if sort not in (AnimTypeProfile if by_type else AnimProfile)._fields[1:]:
+        raise ValueError("Can't sort by %r" % sort)
+    results = []
+    for anim in _profiled_anims:
+        results.append(AnimProfile(anim, anim._profile.evaluations,
+                anim._profile.total_time, anim._profile.self_time,
+                anim._profile.max_step_evaluations,
+                anim._profile.repeated_evaluations))
+    if by_type:
+        types = {}
+        for r in results:
+            t = types.get(type(r.anim), (0, 0, 0.0, 0.0, 0))
+            types[type(r.anim)] = (t[0]+1, t[1]+r.evaluations,
+                    t[2]+r.total_time, t[3]+r.self_time, t[4]+r.repeated)
+        results = [AnimTypeProfile(t, *v) for t, v in types.items()]
+    results.sort(key=lambda r: getattr(r, sort), reverse=True)
+    if top is not None:
+        results = results[:top]
+    return results
+
 cdef float _on_end_clear(AnimSlot_s * slot, void * data, float end):
+    cdef AnimSlot owner
     slot.anim = NULL
     slot.type = SLOT_LOCAL
     slot.local = end
+    if slot.owner != NULL:
+        # Let go of the finished anim, so that it (and whatever it depends
+        # on) can be freed.  Nothing touches the anim after on_end returns, so
+        # it's fine if this was the last reference.
+        owner = <AnimSlot>slot.owner
+        slot.owner = NULL
+        owner._py_anim = None
     return end
 
 cdef class IncompleteAnimBase:
@@ -150,6 +357,9 @@ cdef class Anim:
     will allways be up to date.
     """
 
+    def __cinit__(self, *args, **kwargs):
+        self._anim.owner = <void *>self
+
     def __init__(self):
         self._anim.on_end = _on_end_clear
         self._anim.on_end_data = NULL
@@ -181,6 +391,26 @@ cdef class Anim:
     def get(self):
         return self.get_value()
 
+    def on_complete(self, callback, scheduler=None):
+        """
+        ``on_complete(callback, [scheduler]) -> Timer``
+
+        Schedules ``callback`` to be called at the anim's ``end_time``, with
+        ``scheduler`` (``rabbyt.scheduler`` by default,) and returns the
+        ``Timer``.
+
+        Only anims that have an end time, such as the ones made by ``lerp()``
+        and ``chain()``, can be used.
+        """
+        try:
+            end_time = self.end_time
+        except AttributeError:
+            raise TypeError("%r doesn't have an end time" % (self,))
+        if scheduler is None:
+            import rabbyt
+            scheduler = rabbyt.scheduler
+        return scheduler.add(end_time, callback)
+
     cdef int add_dependency(self, source, AnimSlot_s * target) except -1:
         cdef AnimSlot slot
         if isinstance(source, IncompleteAnimBase):
@@ -190,6 +420,9 @@ cdef class Anim:
             slot._slot = target
             slot._slot.type = SLOT_LOCAL
             slot.anim = source
+            # The temporary slot is going away; self.dependencies keeps the
+            # anim alive instead.
+            target.owner = NULL
             self.dependencies.append(source)
         else:
             target.type = SLOT_LOCAL
@@ -209,10 +442,12 @@ cdef class AnimSlot:
         if anim is None:
             self._slot.anim = NULL
             self._slot.type = SLOT_LOCAL
+            self._slot.owner = NULL
         else:
             self._slot.anim = &self._py_anim._anim
             self._slot.type = SLOT_ANIM
             self._slot.recursion_check = 0
+            self._slot.owner = <void *>self
 
     cdef Anim c_get_anim(self):
         if self._slot.type != SLOT_ANIM:
@@ -234,7 +469,7 @@ cdef class AnimSlot:
 
     cdef int c_set_value(self, float value) except -1:
         if self._slot.type == SLOT_ANIM:
-            self._slot.type = SLOT_LOCAL
+            self.c_set_anim(None)
         if self._slot.type == SLOT_LOCAL:
             self._slot.local = value
         else:
@@ -350,6 +585,8 @@ cdef class anim_slot:
         if obj.c_anim_slots == NULL:
             raise RuntimeError("Animable is not yet initialized.")
         if PyNumber_Check(value):
+            if obj.c_anim_slots[self.index].type == SLOT_ANIM:
+                (<AnimSlot>obj._anim_list[self.index]).c_set_anim(None)
             obj.c_anim_slots[self.index].type = SLOT_LOCAL
             obj.c_anim_slots[self.index].local = value
         elif isinstance(value, Anim):
@@ -367,6 +604,9 @@ cdef class anim_slot:
 
 
 cdef float _anim_const_func(AnimSlot_s * slot):
+    if ANIM_PROFILING(slot):
+        return anim_profiler.hook(slot, <AnimFunc>_anim_const_func)
+    COUNT_ANIM_EVAL()
     return (<float *>(slot.anim.data))[0]
 
 cdef class AnimConst(Anim):
@@ -570,6 +810,10 @@ cdef class ChainAnim(Anim):
         def __get__(self):
             return list(self._anims)
 
+    property end_time:
+        def __get__(self):
+            return self.chain_data.links[self.chain_data.link_count-1].end_time
+
     def __dealloc___(self):
         if self.chain_data.links != NULL:
             free(self.chain_data.links)
@@ -609,6 +853,9 @@ ctypedef struct static_bezier3_data_s:
     AnimSlot_s t
 
 cdef float _static_bezier3_func(AnimSlot_s * slot):
+    if ANIM_PROFILING(slot):
+        return anim_profiler.hook(slot, <AnimFunc>_static_bezier3_func)
+    COUNT_ANIM_EVAL()
     cdef float t, t2, t3
     cdef static_bezier3_data_s * d
     d = <static_bezier3_data_s *>(slot.anim.data)
@@ -650,6 +897,9 @@ cdef class AnimStaticCubicBezier(Anim):
         return self.a*t3 + self.b*t2 + self.c*t + self.p0
 
 cdef float _slot_reader_func(AnimSlot_s * slot):
+    if ANIM_PROFILING(slot):
+        return anim_profiler.hook(slot, <AnimFunc>_slot_reader_func)
+    COUNT_ANIM_EVAL()
     cdef float v
     READ_SLOT((<AnimSlot_s **>slot.anim.data)[0], &v)
     return v
@@ -706,6 +956,9 @@ cdef class AnimWrap(Anim):
         self._anim.func = <AnimFunc>_wrap_func
 
 cdef float _wrap_func(AnimSlot_s * slot):
+    if ANIM_PROFILING(slot):
+        return anim_profiler.hook(slot, <AnimFunc>_wrap_func)
+    COUNT_ANIM_EVAL()
     cdef wrap_data * data
     data = <wrap_data *>(slot.anim.data)
     cdef float b1, b2, d
@@ -727,6 +980,9 @@ cdef struct op_data:
     AnimSlot_s a, b
 
 cdef float _add_func(AnimSlot_s * slot):
+    if ANIM_PROFILING(slot):
+        return anim_profiler.hook(slot, <AnimFunc>_add_func)
+    COUNT_ANIM_EVAL()
     cdef float a, b
     cdef op_data * data
     data = <op_data *>(slot.anim.data)
@@ -735,6 +991,9 @@ cdef float _add_func(AnimSlot_s * slot):
     return a + b
 
 cdef float _sub_func(AnimSlot_s * slot):
+    if ANIM_PROFILING(slot):
+        return anim_profiler.hook(slot, <AnimFunc>_sub_func)
+    COUNT_ANIM_EVAL()
     cdef float a, b
     cdef op_data * data
     data = <op_data *>(slot.anim.data)
@@ -743,6 +1002,9 @@ cdef float _sub_func(AnimSlot_s * slot):
     return a - b
 
 cdef float _mul_func(AnimSlot_s * slot):
+    if ANIM_PROFILING(slot):
+        return anim_profiler.hook(slot, <AnimFunc>_mul_func)
+    COUNT_ANIM_EVAL()
     cdef float a, b
     cdef op_data * data
     data = <op_data *>(slot.anim.data)
@@ -751,6 +1013,9 @@ cdef float _mul_func(AnimSlot_s * slot):
     return a * b
 
 cdef float _div_func(AnimSlot_s * slot):
+    if ANIM_PROFILING(slot):
+        return anim_profiler.hook(slot, <AnimFunc>_div_func)
+    COUNT_ANIM_EVAL()
     cdef float a, b
     cdef op_data * data
     data = <op_data *>(slot.anim.data)
@@ -791,6 +1056,9 @@ cdef struct _py_func_data:
     int do_cache
 
 cdef float _py_func_func(AnimSlot_s * slot):
+    if ANIM_PROFILING(slot):
+        return anim_profiler.hook(slot, <AnimFunc>_py_func_func)
+    COUNT_ANIM_EVAL()
     cdef object function
     cdef _py_func_data * d
     cdef float v
@@ -876,6 +1144,9 @@ cdef struct rate_data:
     float last, last_time, last_rate
 
 cdef float _rate_func(AnimSlot_s * slot):
+    if ANIM_PROFILING(slot):
+        return anim_profiler.hook(slot, <AnimFunc>_rate_func)
+    COUNT_ANIM_EVAL()
     cdef rate_data * d
     d = <rate_data *>(slot.anim.data)
     cdef float v, t, dt
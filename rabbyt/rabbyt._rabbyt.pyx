@@ -25,6 +25,8 @@ __author__ = "Matthew Marshall <matthew@matthewmarshall.org>"
 
 import sys
 
+from rabbyt import collisions
+
 from libc.stdio cimport printf
 
 cdef extern from "include_math.h":
@@ -32,6 +34,8 @@ cdef extern from "include_math.h":
     cdef float cosf(float x)
     cdef float sinf(float x)
     cdef float sqrtf(float x)
+    cdef float fabsf(float x)
+    cdef float PI_OVER_180
 
 cdef extern from "include_gl.h":
     ctypedef float GLfloat
@@ -73,6 +77,10 @@ cdef extern from "include_gl.h":
     cdef int GL_VENDOR, GL_RENDERER, GL_VERSION, GL_EXTENSIONS
 
     cdef void glTranslatef(GLfloat x, GLfloat y, GLfloat z)
+    cdef void glRotatef(GLfloat angle, GLfloat x, GLfloat y, GLfloat z)
+    cdef void glScalef(GLfloat x, GLfloat y, GLfloat z)
+    cdef void glPushMatrix()
+    cdef void glPopMatrix()
     cdef void glEnable(GLenum cap)
     cdef void glDisable(GLenum cap)
     cdef void glClear(GLbitfield mask)
@@ -86,7 +94,7 @@ cdef extern from "include_gl.h":
     cdef void glVertex2f(GLfloat x, GLfloat y)
     cdef void glEnd()
     cdef void glViewport(GLint x, GLint y, GLsizei width, GLsizei height)
-    cdef void glOrtho(GLint bottom, GLint left, GLint top, GLint bottom, GLint front, GLint back)
+    cdef void glOrtho(GLdouble left, GLdouble right, GLdouble bottom, GLdouble top, GLdouble near, GLdouble far)
     cdef void glMatrixMode(GLenum mode)
     cdef void glLoadIdentity()
     cdef void glTexParameteri(GLenum target, GLenum pname, GLint param)
@@ -99,10 +107,116 @@ cdef extern from "include_gl.h":
 
     cdef GLint gluBuild2DMipmaps( GLenum target, GLint internalFormat, GLsizei width, GLsizei height, GLenum format, GLenum type, void *data)
 
+from _anims cimport READ_SLOT, FrameStats, get_frame_stats, stats_clock
+
+cdef FrameStats * stats
+stats = get_frame_stats()
+from primitives cimport Point2d
+from _sprites cimport cBaseSprite, cSprite, sprite_renderer_s, \
+        set_sprite_renderer
+from glstate cimport gl_enable, gl_disable, gl_bind_texture, gl_color4fv, \
+        gl_blend_func, gl_forget_texture, gl_invalidate
+
+# Used to check if a cSprite subclass has overridden render().
+_cSprite_render = cSprite.render
+
+# The OpenGL sprite renderer, which rabbyt._sprites uses to draw sprites.
+
+cdef int _gl_render_sprite(cSprite sprite) except -1:
+    if sprite._texture_target == 0:
+        # Normally the target is picked when the texture is assigned, but
+        # subclasses might have their own ideas.
+        sprite.ensure_target()
+    if sprite._texture_id != 0:
+        gl_enable(sprite._texture_target)
+        gl_bind_texture(sprite._texture_target, sprite._texture_id)
+    else:
+        gl_disable(sprite._texture_target)
+
+    cdef float color[4]
+    READ_SLOT(&sprite._red, &color[0])
+    READ_SLOT(&sprite._green, &color[1])
+    READ_SLOT(&sprite._blue, &color[2])
+    READ_SLOT(&sprite._alpha, &color[3])
+    gl_color4fv(color)
+
+    cdef float x, y, u, v, sx, sy, r
+    READ_SLOT(&sprite._x, &x)
+    READ_SLOT(&sprite._y, &y)
+    READ_SLOT(&sprite._u, &u)
+    READ_SLOT(&sprite._v, &v)
+    READ_SLOT(&sprite._scale_x, &sx)
+    READ_SLOT(&sprite._scale_y, &sy)
+    READ_SLOT(&sprite._rot, &r)
+
+    cdef int i
+    cdef float vx, vy, co, si
+
+    cdef Point2d * vert, *tex
+    vert = sprite._shape.v
+    tex = sprite._tex_shape.v
+
+    if stats.enabled:
+        stats.sprites_rendered = stats.sprites_rendered + 1
+        stats.draw_calls = stats.draw_calls + 1
+        stats.vertices = stats.vertices + 4
+
+    glBegin(GL_QUADS)
+    if r == 0:
+        glTexCoord2f(tex[0].x+u,tex[0].y+v)
+        glVertex2f(vert[0].x*sx+x,vert[0].y*sy+y)
+        glTexCoord2f(tex[1].x+u,tex[1].y+v)
+        glVertex2f(vert[1].x*sx+x,vert[1].y*sy+y)
+        glTexCoord2f(tex[2].x+u,tex[2].y+v)
+        glVertex2f(vert[2].x*sx+x,vert[2].y*sy+y)
+        glTexCoord2f(tex[3].x+u,tex[3].y+v)
+        glVertex2f(vert[3].x*sx+x,vert[3].y*sy+y)
+    else:
+        r = r * PI_OVER_180
+        co = cosf(r)
+        si = sinf(r)
+        for i from 0 <= i < 4:
+            glTexCoord2f(tex[i].x+u,tex[i].y+v)
+            vx = vert[i].x*sx
+            vy = vert[i].y*sy
+            glVertex2f((vx*co - vy*si)+x, (vx*si + vy*co)+y)
+    glEnd()
+    return 0
+
+cdef void _gl_push_transform(float x, float y, float rot, float scale_x,
+        float scale_y):
+    glPushMatrix()
+    glTranslatef(x, y, 0)
+    if rot != 0:
+        glRotatef(rot, 0, 0, 1)
+    if scale_x != 1 or scale_y != 1:
+        glScalef(scale_x, scale_y, 1)
+
+cdef void _gl_pop_transform():
+    glPopMatrix()
+
+cdef void _gl_invalidate():
+    gl_invalidate()
+
+cdef sprite_renderer_s gl_renderer
+gl_renderer.render_sprite = _gl_render_sprite
+gl_renderer.push_transform = _gl_push_transform
+gl_renderer.pop_transform = _gl_pop_transform
+gl_renderer.invalidate = _gl_invalidate
+
+def _install_renderer():
+    # Called by rabbyt.backends when this backend is selected.
+    set_sprite_renderer(&gl_renderer)
 
 from warnings import warn
 
-load_texture_file_hook = None
+def _autodetect_load_texture(filename):
+    # rabbyt.autodetect_load_texture is the default, but this module can be
+    # imported before rabbyt/__init__.py has finished running.
+    import rabbyt
+    return rabbyt.autodetect_load_texture(filename)
+
+load_texture_file_hook = _autodetect_load_texture
 
 def pick_texture_target():
     pyglet_flag = False
@@ -160,23 +274,234 @@ def set_load_texture_file_hook(callback):
 
 
 
-def render_unsorted(sprites):
+cdef class Camera
+
+def render_unsorted(sprites, Camera camera=None):
     """
-    ``render_unsorted(sprites)``
+    ``render_unsorted(sprites, [camera])``
 
     Renders a list of sprites.
 
     Since this function is implemented in Pyrex, it should be a little faster
     than looping through the sprites in Python.
+
+    If a ``Camera`` is given it is applied once before any sprites are
+    rendered, and sprites that are entirely outside of its view are skipped.
+
+    Instances of ``Sprite`` (or any subclass that doesn't override
+    ``render()``) are rendered directly in C, without calling ``render()``.
+
+    OpenGL state is tracked by ``rabbyt.glstate`` while rendering, so calls
+    that wouldn't change anything (like binding the same texture again) are
+    skipped.
     """
+    cdef float l, t, r, b
+    cdef int use_camera, fast
+    cdef object last_type, s_type
+    cdef double start_time
+
+    start_time = 0
+    if stats.enabled:
+        start_time = stats_clock()
+
+    use_camera = camera is not None
+    if use_camera:
+        camera.apply()
+        l, t, r, b = camera._l, camera._t, camera._r, camera._b
+
+    gl_invalidate()
+
+    last_type = None
+    fast = 0
     for s in sprites:
-        s.render()
+        if use_camera and not _in_bounds(s, l, t, r, b):
+            if stats.enabled:
+                stats.sprites_culled = stats.sprites_culled + 1
+            continue
+        # Lists of sprites are usually made up of only a few types, so we
+        # only look up render() when the type changes.
+        s_type = type(s)
+        if s_type is not last_type:
+            last_type = s_type
+            fast = (issubclass(s_type, cSprite) and
+                    s_type.render is _cSprite_render)
+        if fast:
+            (<cSprite>s)._render()
+        else:
+            s.render()
+            # There's no telling what state a python render() leaves behind.
+            gl_invalidate()
+
+    if stats.enabled:
+        stats.render_time = stats.render_time + stats_clock() - start_time
 
 
-def render_sorted(sprites):
+def render_sorted(sprites, camera=None):
     ss = list(sprites)
     ss.sort()
-    render_unsorted(ss)
+    render_unsorted(ss, camera)
+
+
+cdef int _in_bounds(object obj, float l, float t, float r, float b) except -1:
+    """
+    Returns whether the bounding circle of ``obj`` touches the given rect.
+
+    Objects that aren't sprites are assumed to be visible.
+    """
+    cdef cBaseSprite sprite
+    cdef float x, y, radius
+    if not isinstance(obj, cBaseSprite):
+        return 1
+    sprite = obj
+    READ_SLOT(&sprite._x, &x)
+    READ_SLOT(&sprite._y, &y)
+    radius = sprite._get_bounding_radius()
+    return (x + radius >= l and x - radius <= r and
+            y + radius >= b and y - radius <= t)
+
+
+cdef class Camera:
+    """
+    ``Camera(viewport, x=0, y=0, zoom=1, rot=0)``
+
+    A camera decides which part of the world is drawn, and where on the
+    screen it is drawn to.
+
+    ``viewport`` gives the screen coordinates that will be drawn to, in the
+    same form accepted by ``set_viewport()``: either ``(width, height)`` or
+    ``(left, top, right, bottom)``.
+
+    ``x`` and ``y`` give the world coordinates that will appear in the center
+    of the viewport.  ``zoom`` scales the view (``2.0`` makes everything twice
+    as big) and ``rot`` rotates the camera counter-clockwise, in degrees.
+
+    Pass the camera to ``render_unsorted()`` (or ``render_sorted()``) to
+    render a list of sprites through it.  The projection is set up once for
+    the whole list, and sprites outside of the camera's ``bounds`` are not
+    rendered at all.  Several cameras can render the same list of sprites, for
+    example for split-screen or a minimap::
+
+        rabbyt.render_unsorted(sprites, player1_camera)
+        rabbyt.render_unsorted(sprites, player2_camera)
+        rabbyt.render_unsorted(sprites, minimap_camera)
+
+    Note that the camera leaves the viewport and projection in place after
+    rendering, just like ``set_viewport()`` does.
+    """
+    cdef public float x, y, zoom, rot
+    cdef int _vl, _vt, _vr, _vb
+    cdef float _l, _t, _r, _b
+
+    def __init__(self, viewport, x=0, y=0, zoom=1, rot=0):
+        self.viewport = viewport
+        self.x = x
+        self.y = y
+        self.zoom = zoom
+        self.rot = rot
+
+    property viewport:
+        """
+        The screen coordinates drawn to, as ``(left, top, right, bottom)``.
+
+        You can also assign ``(width, height)``.
+        """
+        def __get__(self):
+            return (self._vl, self._vt, self._vr, self._vb)
+        def __set__(self, viewport):
+            if len(viewport) == 4:
+                l, t, r, b = viewport
+            else:
+                l, t = 0, 0
+                r, b = viewport
+            for i in (l,t,r,b):
+                if i < 0:
+                    raise ValueError("Viewport values cannot be negative")
+            self._vl, self._vt, self._vr, self._vb = l, t, r, b
+
+    property xy:
+        """
+        The coordinates of the center of the view.
+        """
+        def __get__(self):
+            return (self.x, self.y)
+        def __set__(self, value):
+            self.x, self.y = value
+
+    cdef void _update_bounds(self):
+        cdef float hw, hh, co, si, ex, ey
+        hw = (self._vr - self._vl) / (2 * self.zoom)
+        hh = (self._vb - self._vt) / (2 * self.zoom)
+        if self.rot != 0:
+            co = fabsf(cosf(self.rot*PI_OVER_180))
+            si = fabsf(sinf(self.rot*PI_OVER_180))
+            ex = hw*co + hh*si
+            ey = hw*si + hh*co
+        else:
+            ex = hw
+            ey = hh
+        self._l = self.x - ex
+        self._r = self.x + ex
+        self._b = self.y - ey
+        self._t = self.y + ey
+
+    property bounds:
+        """
+        The world coordinates that are visible through the camera, as
+        ``(left, top, right, bottom)``.
+
+        If the camera is rotated this is the axis aligned box around the
+        visible area.
+        """
+        def __get__(self):
+            self._update_bounds()
+            return (self._l, self._t, self._r, self._b)
+
+    def is_visible(self, obj):
+        """
+        ``is_visible(obj) -> bool``
+
+        Returns ``False`` if the bounding circle of the sprite ``obj`` is
+        entirely outside of ``bounds``.
+        """
+        self._update_bounds()
+        return bool(_in_bounds(obj, self._l, self._t, self._r, self._b))
+
+    def cull(self, sprites):
+        """
+        ``cull(sprites) -> list``
+
+        Returns a list of the sprites that are visible through the camera.
+        """
+        self._update_bounds()
+        return [s for s in sprites
+                if _in_bounds(s, self._l, self._t, self._r, self._b)]
+
+    def apply(self):
+        """
+        ``apply()``
+
+        Sets the OpenGL viewport and matrices for this camera.
+
+        You don't need to call this if you pass the camera to one of the
+        render functions.
+        """
+        cdef float hw, hh
+        self._update_bounds()
+        glViewport(self._vl, self._vt, self._vr-self._vl, self._vb-self._vt)
+        glMatrixMode(GL_PROJECTION)
+        glLoadIdentity()
+        hw = (self._vr - self._vl) / (2 * self.zoom)
+        hh = (self._vb - self._vt) / (2 * self.zoom)
+        glOrtho(-hw, hw, -hh, hh, -1, 1)
+        glMatrixMode(GL_MODELVIEW)
+        glLoadIdentity()
+        if self.rot != 0:
+            glRotatef(-self.rot, 0, 0, 1)
+        glTranslatef(-self.x, -self.y, 0)
+
+    def __repr__(self):
+        return "<Camera (%r, %r) zoom=%r rot=%r>" % (self.x, self.y,
+                self.zoom, self.rot)
 
 
 def set_viewport(viewport, projection=None):
@@ -230,9 +555,9 @@ def set_default_attribs():
     before rendering any sprites.  (It is called automatically in
     ``rabbyt.init_display()``)
     """
-    glBlendFunc(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
+    gl_blend_func(GL_SRC_ALPHA, GL_ONE_MINUS_SRC_ALPHA)
     glTexEnvf(GL_TEXTURE_ENV, GL_TEXTURE_ENV_MODE, GL_MODULATE)
-    glEnable(GL_BLEND)
+    gl_enable(GL_BLEND)
     #glEnable(GL_POLYGON_SMOOTH)
 
 
@@ -308,7 +633,7 @@ def update_texture(texture_id, byte_string, size, type_='RGBA', filter=True,
 
     target = pick_texture_target()
 
-    glBindTexture(target, texture_id)
+    gl_bind_texture(target, texture_id)
     glTexParameteri(target, GL_TEXTURE_MAG_FILTER, filter_type)
     if mipmap:
         glTexParameteri(target, GL_TEXTURE_MIN_FILTER, GL_LINEAR_MIPMAP_NEAREST)
@@ -316,16 +641,20 @@ def update_texture(texture_id, byte_string, size, type_='RGBA', filter=True,
     else:
         glTexParameteri(target, GL_TEXTURE_MIN_FILTER, filter_type)
         glTexImage2D(target, 0, ptype, size[0], size[1], 0, ptype, GL_UNSIGNED_BYTE, data)
+    collisions._update_alpha_mask(texture_id, byte_string, size, type_)
 
 def unload_texture(texture_id):
     """
     ``unload_texture(texture_id)``
 
-    Unload a texture from memory.
+    Unload a texture from memory.  Its ``AlphaMask`` is forgotten too, as
+    OpenGL can give the id to the next texture loaded.
     """
     cdef GLuint textures[1]
     textures[0] = texture_id
     glDeleteTextures(1, textures)
+    gl_forget_texture(texture_id)
+    collisions.remove_alpha_mask(texture_id)
 
 def clear(rgba=(0.0,0.0,0.0,1.0)):
     """
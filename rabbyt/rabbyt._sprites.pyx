@@ -44,96 +44,77 @@ cdef extern from "stdlib.h":
     cdef void free(void *ptr)
     cdef void *realloc(void *ptr, size_t size)
 
-cdef extern from "include_gl.h":
-    ctypedef float GLfloat
-    ctypedef float GLclampf
-    ctypedef unsigned int GLenum
-    ctypedef unsigned int GLbitfield
-    ctypedef int GLint
-    ctypedef unsigned int GLuint
-    ctypedef int GLsizei
-    ctypedef double GLdouble
-    ctypedef double GLclampd
-    ctypedef void GLvoid
-    ctypedef unsigned char GLubyte
-
-    cdef int GL_SMOOTH
-    cdef int GL_COLOR_BUFFER_BIT
-    cdef int GL_BLEND
-    cdef int GL_SRC_ALPHA
-    cdef int GL_ONE_MINUS_SRC_ALPHA
-    cdef int GL_TEXTURE_2D
-    cdef int GL_QUADS
-    cdef int GL_LINES
-    cdef int GL_MODELVIEW
-    cdef int GL_RGBA
-    cdef int GL_RGB
-    cdef int GL_NEAREST
-    cdef int GL_LINEAR
-    cdef int GL_TEXTURE_MAG_FILTER
-    cdef int GL_TEXTURE_MIN_FILTER
-    cdef int GL_TEXTURE_ENV
-    cdef int GL_TEXTURE_ENV_MODE
-    cdef int GL_MODULATE
-    cdef int GL_LINEAR_MIPMAP_NEAREST
-    cdef int GL_UNSIGNED_BYTE
-    cdef int GL_PROJECTION
-    cdef int GL_FLAT
-    cdef int GL_FLOAT
-    cdef int GL_POLYGON_SMOOTH
-
-    cdef int GL_VENDOR, GL_RENDERER, GL_VERSION, GL_EXTENSIONS
-
-    cdef int GL_T2F_C4UB_V3F
-
-    cdef void glTranslatef(GLfloat x, GLfloat y, GLfloat z)
-    cdef void glRotatef(GLfloat angle, GLfloat x, GLfloat y, GLfloat z)
-    cdef void glScalef(GLfloat x, GLfloat y, GLfloat z)
-    cdef void glEnable(GLenum cap)
-    cdef void glDisable(GLenum cap)
-    cdef void glClear(GLbitfield mask)
-    cdef void glShadeModel(GLenum mode)
-    cdef void glClearColor(GLclampf red, GLclampf green, GLclampf blue, GLclampf alpha)
-    cdef void glBlendFunc(GLenum sfactor, GLenum dfactor)
-    cdef void glBindTexture(GLenum target, GLuint texture)
-    cdef void glColor4f(GLfloat red, GLfloat green, GLfloat blue, GLfloat alpha)
-    cdef void glColor4fv(GLfloat *v)
-    cdef void glBegin(GLenum mode)
-    cdef void glTexCoord2f(GLfloat s, GLfloat t)
-    cdef void glVertex2f(GLfloat x, GLfloat y)
-    cdef void glEnd()
-    cdef void glViewport(GLint x, GLint y, GLsizei width, GLsizei height)
-    cdef void glOrtho(GLint bottom, GLint left, GLint top, GLint bottom, GLint front, GLint back)
-    cdef void glMatrixMode(GLenum mode)
-    cdef void glLoadIdentity()
-    cdef void glTexParameteri(GLenum target, GLenum pname, GLint param)
-    cdef void glTexImage2D(GLenum target, GLint level, GLint internalformat, GLsizei width, GLsizei height, GLint border, GLenum format, GLenum type, GLvoid *pixels)
-    cdef void glGenTextures(GLsizei n, GLuint *textures)
-    cdef void glDeleteTextures(GLsizei n, GLuint *textures)
-    cdef void glTexEnvf(GLenum target, GLenum pname, GLfloat param)
-    cdef void glPushMatrix()
-    cdef void glPopMatrix()
-
-    cdef void glLineWidth(GLfloat width)
-
-    cdef int GL_CLIENT_VERTEX_ARRAY_BIT
-    cdef void glPushClientAttrib(GLbitfield mask)
-    cdef void glPopClientAttrib()
-    cdef void glDrawArrays(GLenum mode, GLint first, GLsizei count)
-    cdef void glInterleavedArrays( GLenum format, GLsizei stride,
-                                           GLvoid *pointer )
-
-    cdef const GLubyte *glGetString(GLenum name)
+# From GL/gl.h.  This module doesn't use OpenGL itself (see the renderer
+# below), so that it can be imported where there isn't any.
+DEF GL_TEXTURE_2D = 0x0DE1
 
 from primitives cimport Quad, Point2d, float2
 
-from _anims cimport cAnimable, AnimSlot, AnimSlot_s, READ_SLOT
+from _anims cimport cAnimable, AnimSlot, AnimSlot_s, READ_SLOT, \
+        FrameStats, get_frame_stats
+
+cdef FrameStats * stats
+stats = get_frame_stats()
+
+# The renderer draws sprites for render() and render_unsorted().  It's
+# installed by the current backend (see rabbyt.backends), which is loaded the
+# first time a sprite is rendered without one.
+cdef sprite_renderer_s * renderer
+renderer = NULL
+
+cdef void set_sprite_renderer(sprite_renderer_s * new_renderer):
+    global renderer
+    renderer = new_renderer
+
+cdef sprite_renderer_s * get_sprite_renderer():
+    return renderer
+
+cdef int _check_renderer() except -1:
+    if renderer == NULL:
+        from rabbyt import backends
+        backends.get_module()
+    if renderer == NULL:
+        raise RuntimeError("no sprite renderer has been installed")
+    return 0
+
+# The renderer of the "null" backend, which only counts what would have been
+# drawn.
+
+cdef int _null_render_sprite(cSprite sprite) except -1:
+    if stats.enabled:
+        stats.sprites_rendered = stats.sprites_rendered + 1
+        stats.vertices = stats.vertices + 4
+    return 0
+
+cdef void _null_push_transform(float x, float y, float rot, float scale_x,
+        float scale_y):
+    pass
+
+cdef void _null_pop_transform():
+    pass
+
+cdef void _null_invalidate():
+    pass
+
+cdef sprite_renderer_s null_renderer
+null_renderer.render_sprite = _null_render_sprite
+null_renderer.push_transform = _null_push_transform
+null_renderer.pop_transform = _null_pop_transform
+null_renderer.invalidate = _null_invalidate
+
+def _install_null_renderer():
+    set_sprite_renderer(&null_renderer)
 
 cdef class cBaseSprite(cAnimable):
     #cdef double _bounding_radius
     #cdef AnimSlot_s     _x, _y, _rot
     #cdef AnimSlot_s _red, _green, _blue, _alpha
     #cdef AnimSlot_s _scale_x, _scale_y
+    #cdef unsigned int _collision_category, _collision_mask
+
+    def __cinit__(self, *args, **kwargs):
+        self._collision_category = 1
+        self._collision_mask = 0xFFFFFFFF
 
     cdef _modify_slots(self):
         cAnimable._modify_slots(self)
@@ -162,6 +143,9 @@ cdef class cBaseSprite(cAnimable):
             slot = self._anim_list[8]
             slot._slot = &self._scale_y
 
+    cdef double _get_bounding_radius(self):
+        return self._bounding_radius
+
     property bounding_radius:
         """
         bounding_radius
@@ -170,7 +154,7 @@ cdef class cBaseSprite(cAnimable):
         can be used for collision detection.
         """
         def __get__(self):
-            return self._bounding_radius
+            return self._get_bounding_radius()
         def __set__(self, v):
             self._bounding_radius = v
 
@@ -188,6 +172,34 @@ cdef class cBaseSprite(cAnimable):
         def __set__(self, float r2):
             self._bounding_radius = sqrtf(r2)
 
+    property collision_category:
+        """
+        collision_category
+
+        The collision layers this sprite is on, as a bit field.  It defaults
+        to ``1``.
+
+        The functions in ``rabbyt.collisions`` only report a pair of objects
+        if each one's ``collision_category`` shares a bit with the other's
+        ``collision_mask``.
+        """
+        def __get__(self):
+            return self._collision_category
+        def __set__(self, unsigned int category):
+            self._collision_category = category
+
+    property collision_mask:
+        """
+        collision_mask
+
+        The collision layers this sprite collides with, as a bit field.  It
+        defaults to ``0xFFFFFFFF`` (everything.)  See ``collision_category``.
+        """
+        def __get__(self):
+            return self._collision_mask
+        def __set__(self, unsigned int mask):
+            self._collision_mask = mask
+
     cdef Point2d _convert_offset(self, float ox, float oy):
         cdef float x, y, sx, sy, r, co, si
         cdef Point2d out
@@ -237,17 +249,17 @@ cdef class cBaseSprite(cAnimable):
         READ_SLOT(&self._scale_y, &sy)
         READ_SLOT(&self._rot, &r)
 
+        if stats.enabled:
+            stats.sprites_rendered = stats.sprites_rendered + 1
+
         if x != 0 or y != 0 or sx != 1 or sy != 1 or r != 0:
-            glPushMatrix()
+            if renderer == NULL:
+                _check_renderer()
+            renderer.push_transform(x, y, r, sx, sy)
             try:
-                glTranslatef(x, y, 0)
-                if r != 0:
-                    glRotatef(r,0,0,1)
-                if sx != 1 or sy != 1:
-                    glScalef(sx, sy, 1)
                 self.render_after_transform()
             finally:
-                glPopMatrix()
+                renderer.pop_transform()
         else:
             self.render_after_transform()
 
@@ -292,6 +304,16 @@ cdef class cSprite(cBaseSprite):
             slot = self._anim_list[10]
             slot._slot = &self._v
 
+    cdef double _get_bounding_radius(self):
+        cdef float s, sy
+        if self._bounding_radius_is_explicit:
+            return self._bounding_radius
+        READ_SLOT(&self._scale_x, &s)
+        READ_SLOT(&self._scale_y, &sy)
+        if sy > s:
+            s = sy
+        return self._shape.bounding_radius * s
+
     property bounding_radius:
         """
         bounding_radius
@@ -310,15 +332,7 @@ cdef class cSprite(cBaseSprite):
             del sprite.bounding_radius
         """
         def __get__(self):
-            cdef float s, sy
-            if self._bounding_radius_is_explicit:
-                return self._bounding_radius
-            else:
-                READ_SLOT(&self._scale_x, &s)
-                READ_SLOT(&self._scale_y, &sy)
-                if sy > s:
-                    s = sy;
-                return self._shape.bounding_radius * s
+            return self._get_bounding_radius()
         def __set__(self, v):
             self._bounding_radius = v
             self._bounding_radius_is_explicit = 1
@@ -407,61 +421,24 @@ cdef class cSprite(cBaseSprite):
             self._texture_target = value
 
     cdef int _render(self) except -1:
-        self.ensure_target()
-        if self._texture_id != 0:
-            glEnable(self._texture_target)
-            glBindTexture(self._texture_target, self._texture_id)
-        else:
-            glDisable(self._texture_target)
-
-        cdef float color[4]
-        READ_SLOT(&self._red, &color[0])
-        READ_SLOT(&self._green, &color[1])
-        READ_SLOT(&self._blue, &color[2])
-        READ_SLOT(&self._alpha, &color[3])
-        glColor4fv(color)
-
-        cdef float x, y, u, v, sx, sy, r
-        READ_SLOT(&self._x, &x)
-        READ_SLOT(&self._y, &y)
-        READ_SLOT(&self._u, &u)
-        READ_SLOT(&self._v, &v)
-        READ_SLOT(&self._scale_x, &sx)
-        READ_SLOT(&self._scale_y, &sy)
-        READ_SLOT(&self._rot, &r)
-
-        cdef int i
-        cdef float vx, vy, co, si
-
-        cdef Point2d * vert, *tex
-        vert = self._shape.v
-        tex = self._tex_shape.v
-
-        glBegin(GL_QUADS)
-        if r == 0:
-            glTexCoord2f(tex[0].x+u,tex[0].y+v)
-            glVertex2f(vert[0].x*sx+x,vert[0].y*sy+y)
-            glTexCoord2f(tex[1].x+u,tex[1].y+v)
-            glVertex2f(vert[1].x*sx+x,vert[1].y*sy+y)
-            glTexCoord2f(tex[2].x+u,tex[2].y+v)
-            glVertex2f(vert[2].x*sx+x,vert[2].y*sy+y)
-            glTexCoord2f(tex[3].x+u,tex[3].y+v)
-            glVertex2f(vert[3].x*sx+x,vert[3].y*sy+y)
-        else:
-            r = r * PI_OVER_180
-            co = cosf(r)
-            si = sinf(r)
-            for i from 0 <= i < 4:
-                glTexCoord2f(tex[i].x+u,tex[i].y+v)
-                vx = vert[i].x*sx
-                vy = vert[i].y*sy
-                glVertex2f((vx*co - vy*si)+x, (vx*si + vy*co)+y)
-        glEnd()
+        if renderer == NULL:
+            _check_renderer()
+        return renderer.render_sprite(self)
 
     def render(self):
         """
+        ``render()``
+
+        Renders the sprite.
 
+        ``render_unsorted()`` and friends skip this method and render the
+        sprite directly from C, unless a subclass overrides it.
         """
+        if renderer == NULL:
+            _check_renderer()
+        # We don't know what has happened to the OpenGL state since the last
+        # sprite was rendered.
+        renderer.invalidate()
         self._render()
 
     cdef float2 _bounds_x(self):
@@ -27,7 +27,7 @@ THE SOFTWARE.
 
 __author__ = "Matthew Marshall <matthew@matthewmarshall.org>"
 
-cdef extern from "stdlib.h":
+cdef extern from "stdlib.h" nogil:
     ctypedef unsigned int size_t
     cdef void *malloc(size_t size)
     cdef void free(void *ptr)
@@ -36,67 +36,202 @@ cdef extern from "stdlib.h":
     ctypedef int(*compar_func)(void *, void *)
     cdef void qsort(void *base, size_t nmemb, size_t size, compar_func compar)
 
-from primitives cimport float2
-from _anims cimport READ_SLOT
-from _sprites cimport cSprite
-
-def _get_object_data(obj):
-    cdef float x,y,brs
-    if hasattr(obj, 'x') and hasattr(obj, 'y'):
-        x,y = obj.x, obj.y
+cdef extern from "string.h" nogil:
+    cdef void *memset(void *s, int c, size_t n)
+    cdef void *memcpy(void *dest, void *src, size_t n)
+    cdef void *memmove(void *dest, void *src, size_t n)
+
+cdef extern from "float.h":
+    cdef float FLT_MAX
+
+cdef extern from "include_math.h" nogil:
+    cdef float floorf(float x)
+    cdef float cosf(float x)
+    cdef float sinf(float x)
+    cdef float sqrtf(float x)
+    cdef float PI_OVER_180
+
+from cpython.buffer cimport PyObject_GetBuffer, PyBuffer_Release, \
+        PyBUF_FORMAT, PyBUF_STRIDES, PyBUF_C_CONTIGUOUS, PyBUF_WRITABLE
+
+from primitives cimport float2, Point2d
+from _anims cimport READ_SLOT, FrameStats, get_frame_stats, stats_clock
+from _sprites cimport cBaseSprite, cSprite
+
+cdef FrameStats * stats
+stats = get_frame_stats()
+
+# The functions in this module call each other (``collide()`` uses ``rdc()`` and
+# ``brute_force()``), so only the outermost call is timed for rabbyt.stats.
+cdef int _timer_depth
+cdef double _timer_start
+
+cdef void _start_timing():
+    global _timer_depth, _timer_start
+    if stats.enabled:
+        if _timer_depth == 0:
+            _timer_start = stats_clock()
+        _timer_depth = _timer_depth + 1
+
+cdef void _stop_timing():
+    global _timer_depth
+    if _timer_depth > 0:
+        _timer_depth = _timer_depth - 1
+        if _timer_depth == 0:
+            stats.collision_time = (stats.collision_time + stats_clock() -
+                    _timer_start)
+
+# Collision layers.  Objects on layer category_a only collide with objects on
+# category_b if (category_a & mask_b) and (category_b & mask_a).  Without
+# filtering, both are ALL_LAYERS so that every pair passes.
+DEF ALL_LAYERS = 0xFFFFFFFF
+DEF DEFAULT_CATEGORY = 1
+
+cdef struct circle_s:
+    float x, y, r
+    unsigned int category, mask
+
+cdef int _read_circle(object obj, circle_s * circle) except -1:
+    """
+    Reads the position and bounding radius of ``obj``, which can be anything
+    accepted by ``collide_single()``.
+    """
+    cdef cBaseSprite sprite
+    if isinstance(obj, cBaseSprite):
+        sprite = obj
+        READ_SLOT(&sprite._x, &circle.x)
+        READ_SLOT(&sprite._y, &circle.y)
+        circle.r = sprite._get_bounding_radius()
+    elif hasattr(obj, 'x') and hasattr(obj, 'y'):
+        circle.x = obj.x
+        circle.y = obj.y
         if hasattr(obj, "bounding_radius"):
-            brs = obj.bounding_radius**2
+            circle.r = obj.bounding_radius
         else:
-            brs = 0
+            circle.r = 0
     else:
-        x = obj[0]
-        y = obj[1]
+        circle.x = obj[0]
+        circle.y = obj[1]
         if len(obj) > 2:
-            brs = obj[2] ** 2
+            circle.r = obj[2]
         else:
-            brs = 0
-    return (x,y,brs)
+            circle.r = 0
+    return 1
+
+cdef int _read_filter(object obj, int use_masks, unsigned int * category,
+        unsigned int * mask) except -1:
+    """
+    Reads the ``collision_category`` and ``collision_mask`` of ``obj`` if
+    ``use_masks`` is true.  Objects without them are on layer ``1`` and
+    collide with everything.
+    """
+    cdef cBaseSprite sprite
+    if not use_masks:
+        category[0] = mask[0] = ALL_LAYERS
+    elif isinstance(obj, cBaseSprite):
+        sprite = obj
+        category[0] = sprite._collision_category
+        mask[0] = sprite._collision_mask
+    else:
+        category[0] = getattr(obj, "collision_category", DEFAULT_CATEGORY)
+        mask[0] = getattr(obj, "collision_mask", ALL_LAYERS)
+    return 0
 
-def collide(objects):
+cdef inline int _layers_match(unsigned int category_a, unsigned int mask_a,
+        unsigned int category_b, unsigned int mask_b) nogil:
+    return (category_a & mask_b) != 0 and (category_b & mask_a) != 0
+
+def _get_object_data(obj):
+    cdef circle_s circle
+    _read_circle(obj, &circle)
+    return (circle.x, circle.y, circle.r*circle.r)
+
+def collide(objects, use_masks=False, threads=1):
     """
-    ``collide(objects) -> list of collisions``
+    ``collide(objects, use_masks=False, threads=1) -> list of collisions``
+
+    Collides ``objects``, first splitting them into groups like ``rdc()``
+    does and then checking each group like ``brute_force()`` does.  (This is
+    all done in one pass, with each object only being read once.)
 
-    Collides ``objects``, first using ``rdc()`` and then using
+    Each object should have the attributes ``x``, ``y`` and
+    ``bounding_radius``.  In each pair, the object that comes first in
+    ``objects`` comes first.
+
+    If ``use_masks`` is true, objects are filtered by their
+    ``collision_category`` and ``collision_mask``, as described for
     ``brute_force()``.
 
-    Each object should have the attributes ``x``, ``y``, ``bounding_radius``,
-    and ``bounding_radius_squared``.
+    The GIL is released once the objects have been read.  If ``threads`` is
+    more than ``1`` the groups are split between that many threads (``0`` or
+    ``None`` uses one per CPU), as for ``collide_arrays()``.  The result is
+    the same whatever the number of threads.
     """
-    collisions = []
-    for group in rdc(objects, min_split=10):
-        if len(group) > 1:
-            collisions.extend(brute_force(group))
-    return collisions
+    _start_timing()
+    try:
+        return _CircleGroups(objects, use_masks).collide(
+                threads=_threads_arg(threads))
+    finally:
+        _stop_timing()
+
+
+def iter_collide(objects, use_masks=False):
+    """
+    ``iter_collide(objects, use_masks=False) -> iterator of lists of collisions``
 
+    Does the same work as ``collide()``, but instead of returning all of the
+    collisions at once it yields them one ``rdc()`` group at a time.  Each
+    item is a list of pairs, like what ``brute_force()`` returns, and groups
+    without any collisions are skipped.
 
-def collide_single(single, objects):
+    Only the groups are kept in memory, not the collisions, so the pairs can
+    be handled while the rest are still being found.
     """
-    ``collide_single(single, objects)``
+    groups = _CircleGroups(objects, use_masks)
+    for i in range(len(groups)):
+        collisions = groups.collide(i, i + 1)
+        if collisions:
+            yield collisions
+
+
+def collide_single(single, objects, use_masks=False):
+    """
+    ``collide_single(single, objects, use_masks=False)``
 
     Finds collisions between a single object and a list of objects.
 
     ``single`` can either be an object with ``x``, ``y``, and
     ``bounding_radius`` attributes, or a tuple of ``(x,y, bounding_radius)``
     (In both cases, ``bounding_radius`` is optional and defaults to ``0``.)
+
+    If ``use_masks`` is true, objects are filtered by their
+    ``collision_category`` and ``collision_mask``, as described for
+    ``brute_force()``.
     """
     cdef object o
-    cdef float x,y,brs, dx,dy, ox, oy, obrs
+    cdef circle_s a, b
+    cdef float dx, dy
+    cdef int masks
 
-    x,y,brs = _get_object_data(single)
+    masks = use_masks
+    _start_timing()
+    try:
+        _read_circle(single, &a)
+        _read_filter(single, masks, &a.category, &a.mask)
 
-    collisions = []
-    for o in objects:
-        ox, oy, obrs = _get_object_data(o)
-        dx = x - ox
-        dy = y - oy
-        if dx*dx + dy*dy < obrs + brs:
-            collisions.append(o)
-    return collisions
+        collisions = []
+        for o in objects:
+            _read_filter(o, masks, &b.category, &b.mask)
+            if not _layers_match(a.category, a.mask, b.category, b.mask):
+                continue
+            _read_circle(o, &b)
+            dx = a.x - b.x
+            dy = a.y - b.y
+            if dx*dx + dy*dy < a.r*a.r + b.r*b.r:
+                collisions.append(o)
+        return collisions
+    finally:
+        _stop_timing()
 
 
 cdef enum _Side:
@@ -113,7 +248,7 @@ cdef struct side_s:
     side_s * other_side
     int index
 
-cdef int _compar_sides_x(void *p1, void *p2):
+cdef int _compar_sides_x(void *p1, void *p2) nogil:
     cdef float x1, x2
     x1 = (<side_s**>p1)[0][0].x
     x2 = (<side_s**>p2)[0][0].x
@@ -124,7 +259,7 @@ cdef int _compar_sides_x(void *p1, void *p2):
     else:
         return 0
 
-cdef int _compar_sides_y(void *p1, void *p2):
+cdef int _compar_sides_y(void *p1, void *p2) nogil:
     cdef float y1, y2
     y1 = (<side_s**>p1)[0][0].y
     y2 = (<side_s**>p2)[0][0].y
@@ -160,22 +295,27 @@ def rdc(objects, int min_split=1, int max_depth=0):
 
     Also, each object is returned at most once.  If it is in one group, it won't
     be in any other.  An object without any collisions isn't returned at all.
+
+    Groups are found from the bounds alone; ``collision_category`` and
+    ``collision_mask`` aren't looked at.
     """
 
     cdef side_s * side_list
     cdef side_s ** side_p_list
     cdef int length, i, d, group_start
     cdef float r, x, y
+    cdef circle_s circle
     length = len(objects)*2
 
     side_list = <side_s*>malloc(sizeof(side_s)*length)
     side_p_list = <side_s**>malloc(sizeof(side_s*)*length)
+    _start_timing()
     try:
         for i from 0 <= i < length/2:
-            o = objects[i]
-            r = o.bounding_radius
-            x = o.x
-            y = o.y
+            _read_circle(objects[i], &circle)
+            r = circle.r
+            x = circle.x
+            y = circle.y
             side_list[i*2].x = x-r
             side_list[i*2].y = y-r
             side_list[i*2].side = LEFT
@@ -215,9 +355,10 @@ def rdc(objects, int min_split=1, int max_depth=0):
     finally:
         free(side_list)
         free(side_p_list)
+        _stop_timing()
 
 cdef void _rdc(side_s ** side_p_list, int length, _Axis axis, int depth,
-        int min_split, int max_depth):
+        int min_split, int max_depth) nogil:
     cdef int i
     if length <= min_split*2:
         return
@@ -268,6 +409,7 @@ cdef void _rdc(side_s ** side_p_list, int length, _Axis axis, int depth,
 
 cdef struct collision_object_s:
     float x, y, brs
+    unsigned int category, mask
 
 cdef _brute_force(collision_object_s * objs, int length, objects):
     cdef float dx, dy
@@ -275,6 +417,9 @@ cdef _brute_force(collision_object_s * objs, int length, objects):
     collisions = []
     for i from 0 <= i < length-1:
         for j from i < j < length:
+            if not _layers_match(objs[i].category, objs[i].mask,
+                    objs[j].category, objs[j].mask):
+                continue
             dx = objs[i].x - objs[j].x
             dy = objs[i].y - objs[j].y
             if dx*dx + dy*dy < objs[i].brs + objs[j].brs:
@@ -282,9 +427,9 @@ cdef _brute_force(collision_object_s * objs, int length, objects):
                         objects[j]))
     return collisions
 
-def brute_force(objects):
+def brute_force(objects, use_masks=False):
     """
-    ``brute_force(objects) -> list of collisions``
+    ``brute_force(objects, use_masks=False) -> list of collisions``
 
     Finds collisions between ``objects`` using a brute force algorithm.
 
@@ -295,12 +440,24 @@ def brute_force(objects):
     For example, if ``A`` collides with ``B``, ``B`` collides with ``C``, and
     ``D`` doesn't collide with anything, the result will be:
     ``[(A, B), (B, C)]``.
+
+    If ``use_masks`` is true, each object can also have
+    ``collision_category`` and ``collision_mask`` attributes, which are
+    unsigned 32 bit fields.  ``A`` and ``B`` are only checked if
+    ``A.collision_category & B.collision_mask`` and
+    ``B.collision_category & A.collision_mask`` are both non-zero.  (Sprites
+    have these attributes; other objects default to a category of ``1`` and
+    a mask of ``0xFFFFFFFF``.)  This lets one call handle all the rules about
+    what collides with what, instead of colliding many subsets.
     """
     cdef collision_object_s * objs
-    cdef int i, length
+    cdef int i, length, masks
+    cdef circle_s circle
 
     length = len(objects)
+    masks = use_masks
     objs = <collision_object_s*>malloc(sizeof(collision_object_s)*length)
+    _start_timing()
     try:
         # First we move the data from the python objects into c structures.
         # This is especially important as most of the objects will be sprites,
@@ -308,18 +465,191 @@ def brute_force(objects):
         # calculations.  We only want to do that once.
         for i from 0 <= i < length:
             o = objects[i]
-            objs[i].x = o.x
-            objs[i].y = o.y
-            objs[i].brs = o.bounding_radius_squared
+            if isinstance(o, cBaseSprite):
+                _read_circle(o, &circle)
+                objs[i].x = circle.x
+                objs[i].y = circle.y
+                objs[i].brs = circle.r * circle.r
+            else:
+                objs[i].x = o.x
+                objs[i].y = o.y
+                objs[i].brs = o.bounding_radius_squared
+            _read_filter(o, masks, &objs[i].category, &objs[i].mask)
         # Do the actual work:
         return _brute_force(objs, length, objects)
     finally:
         free(objs)
+        _stop_timing()
+
+
+# collide_groups() and aabb_collide_groups() switch from testing every pair
+# to sweeping along one axis once len(group_a)*len(group_b) reaches this.
+# (See benchmarks/collide_groups.py.)
+_group_sweep_threshold = 32768
+
+cdef struct interval_s:
+    float lo, hi
+    int index
+
+cdef int _compar_intervals(void *p1, void *p2) nogil:
+    cdef float a, b
+    a = (<interval_s*>p1).lo
+    b = (<interval_s*>p2).lo
+    if a < b:
+        return -1
+    elif a > b:
+        return 1
+    return 0
+
+cdef int _compar_keys(void *p1, void *p2) nogil:
+    cdef unsigned long long a, b
+    a = (<unsigned long long*>p1)[0]
+    b = (<unsigned long long*>p2)[0]
+    if a < b:
+        return -1
+    elif a > b:
+        return 1
+    return 0
 
+ctypedef int (*group_pair_test)(void * a, int ia, void * b, int ib)
 
-def collide_groups(group_a, group_b):
+cdef int _test_circles(void * a, int ia, void * b, int ib):
+    cdef circle_s * ca
+    cdef circle_s * cb
+    cdef float dx, dy
+    ca = &(<circle_s*>a)[ia]
+    cb = &(<circle_s*>b)[ib]
+    if not _layers_match(ca.category, ca.mask, cb.category, cb.mask):
+        return 0
+    dx = ca.x - cb.x
+    dy = ca.y - cb.y
+    return dx*dx + dy*dy < ca.r*ca.r + cb.r*cb.r
+
+cdef int _test_rects(void * a, int ia, void * b, int ib):
+    cdef rect_s * ra
+    cdef rect_s * rb
+    ra = &(<rect_s*>a)[ia]
+    rb = &(<rect_s*>b)[ib]
+    if not _layers_match(ra.category, ra.mask, rb.category, rb.mask):
+        return 0
+    return _collide_rect(ra, rb)
+
+cdef object _sweep_groups(interval_s * int_a, int length_a, void * data_a,
+        interval_s * int_b, int length_b, void * data_b, group_pair_test test,
+        group_a, group_b):
     """
-    ``collide_groups(group_a, group_b)``
+    Finds the collisions between two groups by sorting both by where they
+    start along one axis and sweeping across.  ``int_a`` and ``int_b`` give
+    the extent of each object along that axis.
+
+    The collisions are returned in the same order as a brute force check
+    would give.
+    """
+    cdef unsigned long long * keys
+    cdef void * p
+    cdef int count, capacity, i, j, k
+    qsort(int_a, length_a, sizeof(interval_s), _compar_intervals)
+    qsort(int_b, length_b, sizeof(interval_s), _compar_intervals)
+
+    count = 0
+    capacity = 64
+    keys = <unsigned long long*>malloc(sizeof(unsigned long long)*capacity)
+    try:
+        if keys == NULL:
+            raise MemoryError()
+        i = 0
+        j = 0
+        while i < length_a and j < length_b:
+            if int_a[i].lo <= int_b[j].lo:
+                k = j
+                while k < length_b and int_b[k].lo <= int_a[i].hi:
+                    if test(data_a, int_a[i].index, data_b, int_b[k].index):
+                        if count == capacity:
+                            capacity = capacity * 2
+                            p = realloc(keys,
+                                    sizeof(unsigned long long)*capacity)
+                            if p == NULL:
+                                raise MemoryError()
+                            keys = <unsigned long long*>p
+                        keys[count] = (<unsigned long long>int_a[i].index
+                                << 32) | int_b[k].index
+                        count = count + 1
+                    k = k + 1
+                i = i + 1
+            else:
+                k = i
+                while k < length_a and int_a[k].lo <= int_b[j].hi:
+                    if test(data_a, int_a[k].index, data_b, int_b[j].index):
+                        if count == capacity:
+                            capacity = capacity * 2
+                            p = realloc(keys,
+                                    sizeof(unsigned long long)*capacity)
+                            if p == NULL:
+                                raise MemoryError()
+                            keys = <unsigned long long*>p
+                        keys[count] = (<unsigned long long>int_a[k].index
+                                << 32) | int_b[j].index
+                        count = count + 1
+                    k = k + 1
+                j = j + 1
+
+        qsort(keys, count, sizeof(unsigned long long), _compar_keys)
+        collisions = []
+        for i from 0 <= i < count:
+            collisions.append((group_a[<int>(keys[i] >> 32)],
+                    group_b[<int>(keys[i] & 0xFFFFFFFF)]))
+        return collisions
+    finally:
+        free(keys)
+
+cdef int _pick_sweep_axis(interval_s * x_a, interval_s * y_a, int length_a,
+        interval_s * x_b, interval_s * y_b, int length_b):
+    """
+    Returns 0 if the objects are spread out more along the x axis than the y
+    axis, or 1 otherwise.
+    """
+    cdef float l, r, b, t
+    cdef int i
+    l = b = FLT_MAX
+    r = t = -FLT_MAX
+    for i from 0 <= i < length_a:
+        if x_a[i].lo < l: l = x_a[i].lo
+        if x_a[i].hi > r: r = x_a[i].hi
+        if y_a[i].lo < b: b = y_a[i].lo
+        if y_a[i].hi > t: t = y_a[i].hi
+    for i from 0 <= i < length_b:
+        if x_b[i].lo < l: l = x_b[i].lo
+        if x_b[i].hi > r: r = x_b[i].hi
+        if y_b[i].lo < b: b = y_b[i].lo
+        if y_b[i].hi > t: t = y_b[i].hi
+    if r - l >= t - b:
+        return 0
+    return 1
+
+cdef object _sweep_groups_2d(interval_s * intervals, int length_a,
+        void * data_a, int length_b, void * data_b, group_pair_test test,
+        group_a, group_b):
+    """
+    ``intervals`` holds the x extents of group a, then group b, followed by
+    the y extents of both.
+    """
+    cdef interval_s * x_a
+    cdef interval_s * x_b
+    cdef interval_s * y_a
+    cdef interval_s * y_b
+    x_a = intervals
+    x_b = intervals + length_a
+    y_a = intervals + length_a + length_b
+    y_b = y_a + length_a
+    if _pick_sweep_axis(x_a, y_a, length_a, x_b, y_b, length_b) == 0:
+        return _sweep_groups(x_a, length_a, data_a, x_b, length_b, data_b,
+                test, group_a, group_b)
+    return _sweep_groups(y_a, length_a, data_a, y_b, length_b, data_b,
+            test, group_a, group_b)
+
+def collide_groups(group_a, group_b, use_masks=False):
+    """
+    ``collide_groups(group_a, group_b, use_masks=False)``
 
     Returns a list of collisions between objects in ``group_a`` with objects
     in ``group_b``.
@@ -329,39 +659,895 @@ def collide_groups(group_a, group_b):
     ``(x, y, bounding_radius)`` or ``(x, y)``.
 
     If ``bounding_radius`` is missing it will default to ``0``.
+
+    If ``use_masks`` is true, objects are filtered by their
+    ``collision_category`` and ``collision_mask``, as described for
+    ``brute_force()``.
+
+    For large groups the objects are sorted along one axis first, so that
+    only objects that are near each other get tested.
     """
-    cdef collision_object_s * c_group_b
-    cdef int i, length
-    cdef collision_object_s obj
+    cdef circle_s * c_group_a
+    cdef circle_s * c_group_b
+    cdef interval_s * intervals
+    cdef int i, length, length_a, n, masks
+    cdef circle_s circle
     cdef object o
-    cdef float dx, dy
+    cdef float dx, dy, brs
 
     group_b = list(group_b)
     length = len(group_b)
-
-    c_group_b = <collision_object_s*>malloc(sizeof(collision_object_s)*length)
+    if not isinstance(group_a, list):
+        group_a = list(group_a)
+    length_a = len(group_a)
+
+    masks = use_masks
+    c_group_a = NULL
+    intervals = NULL
+    c_group_b = <circle_s*>malloc(sizeof(circle_s)*length + 1)
+    _start_timing()
     try:
         i = 0
         for o in group_b:
-            c_group_b[i].x, c_group_b[i].y, c_group_b[i].brs = _get_object_data(o)
+            _read_circle(o, &c_group_b[i])
+            _read_filter(o, masks, &c_group_b[i].category,
+                    &c_group_b[i].mask)
             i = i + 1
 
+        if <long long>length * length_a >= _group_sweep_threshold:
+            c_group_a = <circle_s*>malloc(sizeof(circle_s)*length_a + 1)
+            n = length_a + length
+            intervals = <interval_s*>malloc(sizeof(interval_s)*n*2 + 1)
+            if c_group_a == NULL or intervals == NULL or c_group_b == NULL:
+                raise MemoryError()
+            for i from 0 <= i < length_a:
+                _read_circle(group_a[i], &c_group_a[i])
+                _read_filter(group_a[i], masks, &c_group_a[i].category,
+                        &c_group_a[i].mask)
+            for i from 0 <= i < n:
+                if i < length_a:
+                    circle = c_group_a[i]
+                    intervals[i].index = intervals[n+i].index = i
+                else:
+                    circle = c_group_b[i-length_a]
+                    intervals[i].index = intervals[n+i].index = i - length_a
+                intervals[i].lo = circle.x - circle.r
+                intervals[i].hi = circle.x + circle.r
+                intervals[n+i].lo = circle.y - circle.r
+                intervals[n+i].hi = circle.y + circle.r
+            return _sweep_groups_2d(intervals, length_a, c_group_a, length,
+                    c_group_b, _test_circles, group_a, group_b)
+
         collisions = []
         for o in group_a:
-            obj.x, obj.y, obj.brs = _get_object_data(o)
+            _read_circle(o, &circle)
+            _read_filter(o, masks, &circle.category, &circle.mask)
+            brs = circle.r * circle.r
             for i from 0 <= i < length:
-                dx = c_group_b[i].x - obj.x
-                dy = c_group_b[i].y - obj.y
-                if dx*dx + dy*dy < c_group_b[i].brs + obj.brs:
+                if not _layers_match(circle.category, circle.mask,
+                        c_group_b[i].category, c_group_b[i].mask):
+                    continue
+                dx = c_group_b[i].x - circle.x
+                dy = c_group_b[i].y - circle.y
+                if dx*dx + dy*dy < c_group_b[i].r*c_group_b[i].r + brs:
                     collisions.append((o, group_b[i]))
+        return collisions
     finally:
+        free(c_group_a)
         free(c_group_b)
+        free(intervals)
+        _stop_timing()
 
-    return collisions
+
+# Array input and index output.
+#
+# The *_arrays() functions read their objects from buffers instead of python
+# objects, and write the collisions as pairs of indexes into an int32 buffer.
+
+import array as _array
+import os as _os
+import sys as _sys
+import threading as _threading
+
+cdef object _NATIVE_ORDER
+_NATIVE_ORDER = {"little": "<", "big": ">"}[_sys.byteorder]
+
+cdef struct pair_buffer_s:
+    int * pairs             # two ints per pair
+    Py_ssize_t count        # pairs found, which can be more than capacity
+    Py_ssize_t capacity
+    int can_grow
+
+cdef int _push_pair(pair_buffer_s * buf, int a, int b) nogil:
+    """
+    Adds a pair to ``buf``, smallest index first.  Returns -1 if there isn't
+    enough memory.
+    """
+    cdef void * p
+    cdef Py_ssize_t capacity
+    if buf.count >= buf.capacity:
+        if not buf.can_grow:
+            # Keep counting, so that we can say how much room was needed.
+            buf.count = buf.count + 1
+            return 0
+        capacity = buf.capacity * 2 + 64
+        p = realloc(buf.pairs, sizeof(int) * 2 * capacity)
+        if p == NULL:
+            return -1
+        buf.pairs = <int*>p
+        buf.capacity = capacity
+    if a > b:
+        a, b = b, a
+    buf.pairs[buf.count*2] = a
+    buf.pairs[buf.count*2+1] = b
+    buf.count = buf.count + 1
+    return 0
+
+cdef int _add_pair(pair_buffer_s * buf, int a, int b) except -1:
+    if _push_pair(buf, a, b) < 0:
+        raise MemoryError()
+    return 0
+
+# The brute force part of the circle collisions is split into tasks, which
+# can be run on several threads with the GIL released.  Each task checks rows
+# [start, stop) of a group against the rest of the group.  The circles of a
+# group are copied next to each other, so that the inner loop reads memory in
+# order.
+
+cdef struct bf_task_s:
+    circle_s * circles      # the circles in the group
+    int * indexes           # their indexes, or NULL for 0..length
+    int length
+    int start, stop
+
+cdef int _run_task(bf_task_s * task, pair_buffer_s * out) nogil:
+    cdef int i, j
+    cdef float x, y, r2, dx, dy
+    cdef unsigned int category, mask
+    cdef circle_s * circles
+    circles = task.circles
+    for i from task.start <= i < task.stop:
+        x = circles[i].x
+        y = circles[i].y
+        r2 = circles[i].r * circles[i].r
+        category = circles[i].category
+        mask = circles[i].mask
+        for j from i < j < task.length:
+            if not _layers_match(category, mask, circles[j].category,
+                    circles[j].mask):
+                continue
+            dx = x - circles[j].x
+            dy = y - circles[j].y
+            if dx*dx + dy*dy < r2 + circles[j].r*circles[j].r:
+                if task.indexes != NULL:
+                    if _push_pair(out, task.indexes[i], task.indexes[j]) < 0:
+                        return -1
+                elif _push_pair(out, i, j) < 0:
+                    return -1
+    return 0
+
+cdef int _run_rows(bf_task_s * task, int start,
+        pair_buffer_s * out, Py_ssize_t limit) nogil:
+    """
+    Runs the rows of ``task`` from ``start``, stopping after the row that
+    brings ``out`` up to ``limit`` pairs.  Returns the next row to run, or -1
+    if there isn't enough memory.
+    """
+    cdef bf_task_s row
+    row = task[0]
+    row.start = start
+    while row.start < task.stop:
+        row.stop = row.start + 1
+        if _run_task(&row, out) < 0:
+            return -1
+        row.start = row.stop
+        if out.count >= limit:
+            break
+    return row.start
+
+cdef int _run_task_range(bf_task_s * tasks, int start, int stop,
+        pair_buffer_s * out) nogil:
+    cdef int i
+    for i from start <= i < stop:
+        if _run_task(&tasks[i], out) < 0:
+            return -1
+    return 0
+
+cdef inline double _task_cost(bf_task_s * task) nogil:
+    # The number of pairs checked.
+    return (task.stop - task.start) * (task.length -
+            (task.start + task.stop + 1) * 0.5)
+
+cdef class _TaskRunner:
+    """
+    Runs a range of tasks into its own buffer, for one thread.
+    """
+    cdef bf_task_s * tasks
+    cdef int start, stop
+    cdef pair_buffer_s out
+    cdef int failed
+
+    def __cinit__(self):
+        self.out.pairs = NULL
+        self.out.count = 0
+        self.out.capacity = 0
+        self.out.can_grow = 1
+
+    def __dealloc__(self):
+        free(self.out.pairs)
+
+    def run(self):
+        cdef bf_task_s * tasks
+        cdef int start, stop, result
+        tasks = self.tasks
+        start = self.start
+        stop = self.stop
+        with nogil:
+            result = _run_task_range(tasks, start, stop, &self.out)
+        self.failed = result < 0
+
+cdef int _split_tasks(bf_task_s * tasks, int count, double target,
+        bf_task_s * split) nogil:
+    """
+    Copies the tasks into ``split``, breaking any that cost more than
+    ``target`` into runs of rows that cost about ``target`` each.  Returns the
+    number of tasks in ``split``, which needs room for ``count`` plus
+    ``total / target`` more.
+    """
+    cdef bf_task_s piece
+    cdef double cost
+    cdef int i, row, n
+    n = 0
+    for i from 0 <= i < count:
+        piece = tasks[i]
+        if _task_cost(&piece) > target:
+            cost = 0
+            for row from tasks[i].start <= row < tasks[i].stop:
+                if cost >= target:
+                    piece.stop = row
+                    split[n] = piece
+                    n = n + 1
+                    piece.start = row
+                    cost = 0
+                cost = cost + (piece.length - 1 - row)
+            piece.stop = tasks[i].stop
+        split[n] = piece
+        n = n + 1
+    return n
+
+cdef int _run_tasks(bf_task_s * tasks, int count,
+        pair_buffer_s * out, int threads) except -1:
+    """
+    Runs the tasks, splitting them into ``threads`` runs of about the same
+    cost.  A task that costs more than one thread's share (a scene that is
+    all one group, say) is split into runs of rows first.  The pairs end up
+    in ``out`` in the same order as when they are run one after the other.
+    """
+    cdef _TaskRunner runner
+    cdef bf_task_s * split
+    cdef double total, target, cost
+    cdef int i, result
+    cdef Py_ssize_t j
+    if threads <= 1 or count == 0:
+        with nogil:
+            result = _run_task_range(tasks, 0, count, out)
+        if result < 0:
+            raise MemoryError()
+        return 0
+
+    total = 0
+    for i from 0 <= i < count:
+        total = total + _task_cost(&tasks[i])
+    target = total / threads
+    split = <bf_task_s*>malloc(sizeof(bf_task_s) * (count + threads + 1))
+    if split == NULL:
+        raise MemoryError()
+    try:
+        count = _split_tasks(tasks, count, target, split)
+        tasks = split
+        if threads > count:
+            threads = count
+        if threads <= 1:
+            with nogil:
+                result = _run_task_range(tasks, 0, count, out)
+            if result < 0:
+                raise MemoryError()
+            return 0
+
+        runners = []
+        cost = 0
+        runner = None
+        for i from 0 <= i < count:
+            if runner is None or (cost >= target * len(runners) and
+                    len(runners) < threads):
+                if runner is not None:
+                    runner.stop = i
+                runner = _TaskRunner()
+                runner.tasks = tasks
+                runner.start = i
+                runners.append(runner)
+            cost = cost + _task_cost(&tasks[i])
+        runner.stop = count
+
+        workers = [_threading.Thread(target=r.run) for r in runners[1:]]
+        for w in workers:
+            w.start()
+        (<_TaskRunner>runners[0]).run()
+        for w in workers:
+            w.join()
+    finally:
+        free(split)
+
+    for runner in runners:
+        if runner.failed:
+            raise MemoryError()
+        for j from 0 <= j < runner.out.count:
+            _add_pair(out, runner.out.pairs[j*2], runner.out.pairs[j*2+1])
+    return 0
+
+cdef class _PairStream:
+    """
+    Runs tasks on the calling thread, handing the pairs to ``callback`` in
+    batches of ``batch_size`` as they are found.  (The last batch can be
+    smaller.)
+    """
+    cdef object callback
+    cdef Py_ssize_t batch_size
+    cdef pair_buffer_s out
+
+    def __cinit__(self, callback, Py_ssize_t batch_size):
+        if batch_size < 1:
+            raise ValueError("batch_size must be at least 1")
+        self.callback = callback
+        self.batch_size = batch_size
+        self.out.pairs = NULL
+        self.out.count = 0
+        self.out.capacity = 0
+        self.out.can_grow = 1
+
+    def __dealloc__(self):
+        free(self.out.pairs)
+
+    cdef int run(self, bf_task_s * tasks, int count) except -1:
+        cdef int i, row
+        for i from 0 <= i < count:
+            row = tasks[i].start
+            while row < tasks[i].stop:
+                with nogil:
+                    row = _run_rows(&tasks[i], row, &self.out, self.batch_size)
+                if row < 0:
+                    raise MemoryError()
+                self._emit(0)
+        self._emit(1)
+        return 0
+
+    cdef int _emit(self, int final) except -1:
+        cdef Py_ssize_t k
+        while self.out.count >= self.batch_size or \
+                (final and self.out.count > 0):
+            k = self.out.count
+            if k > self.batch_size:
+                k = self.batch_size
+            batch = _pairs_view(self.out.pairs, k)
+            # A row can overshoot the batch size; keep the rest for the next
+            # batch.
+            memmove(self.out.pairs, self.out.pairs + k*2,
+                    (self.out.count - k) * 2 * sizeof(int))
+            self.out.count = self.out.count - k
+            self.callback(batch)
+        return 0
+
+cdef int _threads_arg(threads) except -1:
+    if threads is None or threads == 0:
+        return _os.cpu_count() or 1
+    if threads < 0:
+        raise ValueError("threads can't be negative")
+    return threads
+
+cdef int _brute_force_circles(circle_s * circles, int length,
+        pair_buffer_s * out, int threads, _PairStream stream) except -1:
+    """
+    Collides the first ``length`` circles with each other.  If ``stream``
+    isn't None the pairs go there instead of ``out``.
+    """
+    cdef bf_task_s * tasks
+    cdef int i, count
+    cdef double total, cost
+    if threads < 1 or stream is not None:
+        threads = 1
+    tasks = <bf_task_s*>malloc(sizeof(bf_task_s) * threads)
+    if tasks == NULL:
+        raise MemoryError()
+    try:
+        # Split the rows into runs with about the same number of pairs.
+        total = length * (length - 1) * 0.5
+        count = 0
+        cost = 0
+        tasks[0].start = 0
+        for i from 0 <= i < length:
+            if cost >= total * (count + 1) / threads and count + 1 < threads:
+                tasks[count].stop = i
+                count = count + 1
+                tasks[count].start = i
+            cost = cost + (length - 1 - i)
+        tasks[count].stop = length
+        count = count + 1
+        for i from 0 <= i < count:
+            tasks[i].circles = circles
+            tasks[i].indexes = NULL
+            tasks[i].length = length
+        if stream is not None:
+            stream.run(tasks, count)
+        else:
+            _run_tasks(tasks, count, out, threads)
+    finally:
+        free(tasks)
+    return 0
+
+# collide() stops splitting groups once they are down to this many objects,
+# and brute forces them instead.
+DEF RDC_MIN_SPLIT = 10
+
+cdef int _find_groups(circle_s * circles, int length, side_s * side_list,
+        side_s ** side_p_list, int * group, circle_s * grouped,
+        bf_task_s * tasks) nogil:
+    """
+    Splits the circles into groups with ``_rdc()``, and fills ``tasks`` with
+    one task for each group of more than one circle.  The indexes of the
+    circles in each group are listed one after the other in ``group``, and
+    copies of the circles in ``grouped``.  Returns the number of tasks.
+
+    ``side_list`` and ``side_p_list`` need room for ``length*2`` items,
+    ``group`` and ``grouped`` for ``length`` and ``tasks`` for
+    ``length/2 + 1``.
+    """
+    cdef int i, d, group_start, group_length, count
+    cdef float r
+    if length <= RDC_MIN_SPLIT:
+        # _rdc() doesn't even sort lists this short, so they can't be walked
+        # for groups; check everything against everything instead.
+        if length < 2:
+            return 0
+        tasks[0].circles = circles
+        tasks[0].indexes = NULL
+        tasks[0].length = length
+        tasks[0].start = 0
+        tasks[0].stop = length
+        return 1
+
+    for i from 0 <= i < length:
+        r = circles[i].r
+        side_list[i*2].x = circles[i].x - r
+        side_list[i*2].y = circles[i].y - r
+        side_list[i*2].side = LEFT
+        side_list[i*2].index = i
+        side_list[i*2+1].x = circles[i].x + r
+        side_list[i*2+1].y = circles[i].y + r
+        side_list[i*2+1].side = RIGHT
+        side_list[i*2+1].index = i
+        side_p_list[i*2] = &side_list[i*2]
+        side_p_list[i*2+1] = &side_list[i*2+1]
+
+    _rdc(side_p_list, length*2, X, 0, RDC_MIN_SPLIT, 0)
+
+    d = 0
+    count = 0
+    group_start = 0
+    group_length = 0
+    for i from 0 <= i < length*2:
+        if side_p_list[i].side == LEFT:
+            d = d + 1
+            group[group_start + group_length] = side_p_list[i].index
+            grouped[group_start + group_length] = \
+                    circles[side_p_list[i].index]
+            group_length = group_length + 1
+        else:
+            d = d - 1
+            if d == 0:
+                if group_length > 1:
+                    tasks[count].circles = &grouped[group_start]
+                    tasks[count].indexes = &group[group_start]
+                    tasks[count].length = group_length
+                    tasks[count].start = 0
+                    tasks[count].stop = group_length
+                    count = count + 1
+                    group_start = group_start + group_length
+                group_length = 0
+    return count
+
+cdef class _CircleGroups:
+    """
+    The circles read from a list of objects, and the groups found in them by
+    ``_find_groups()``.  This is what ``collide()`` and ``iter_collide()``
+    work from: each object is read once, and the groups are never turned
+    into lists.
+    """
+    cdef object objects
+    cdef circle_s * circles
+    cdef side_s * side_list
+    cdef side_s ** side_p_list
+    cdef int * group
+    cdef circle_s * grouped
+    cdef bf_task_s * tasks
+    cdef int length, count
+
+    def __cinit__(self, objects, use_masks):
+        cdef int i, masks
+        # A copy, so that the indexes still match if the caller removes
+        # objects from the list while ``iter_collide()`` is running.
+        self.objects = tuple(objects)
+        objects = self.objects
+        self.length = len(objects)
+        self.circles = <circle_s*>malloc(sizeof(circle_s)*self.length + 1)
+        self.side_list = <side_s*>malloc(sizeof(side_s)*self.length*2 + 1)
+        self.side_p_list = <side_s**>malloc(
+                sizeof(side_s*)*self.length*2 + 1)
+        self.group = <int*>malloc(sizeof(int)*self.length + 1)
+        self.grouped = <circle_s*>malloc(sizeof(circle_s)*self.length + 1)
+        self.tasks = <bf_task_s*>malloc(
+                sizeof(bf_task_s)*(self.length/2 + 1))
+        if self.circles == NULL or self.side_list == NULL or \
+                self.side_p_list == NULL or self.group == NULL or \
+                self.grouped == NULL or self.tasks == NULL:
+            raise MemoryError()
+        masks = use_masks
+        for i from 0 <= i < self.length:
+            o = objects[i]
+            _read_circle(o, &self.circles[i])
+            _read_filter(o, masks, &self.circles[i].category,
+                    &self.circles[i].mask)
+        with nogil:
+            self.count = _find_groups(self.circles, self.length,
+                    self.side_list, self.side_p_list, self.group,
+                    self.grouped, self.tasks)
+
+    def __dealloc__(self):
+        free(self.circles)
+        free(self.side_list)
+        free(self.side_p_list)
+        free(self.group)
+        free(self.grouped)
+        free(self.tasks)
+
+    def __len__(self):
+        return self.count
+
+    def collide(self, int start=0, stop=None, int threads=1):
+        """
+        Returns the collisions in groups ``start`` to ``stop``, as pairs of
+        objects, splitting the groups between ``threads`` threads.
+        """
+        cdef pair_buffer_s pairs
+        cdef int last
+        cdef Py_ssize_t i
+        last = self.count if stop is None else stop
+        pairs.pairs = NULL
+        pairs.count = 0
+        pairs.capacity = 0
+        pairs.can_grow = 1
+        try:
+            _run_tasks(self.tasks + start, last - start, &pairs, threads)
+            objects = self.objects
+            return [(objects[pairs.pairs[i*2]], objects[pairs.pairs[i*2+1]])
+                    for i in range(pairs.count)]
+        finally:
+            free(pairs.pairs)
+
+cdef int _collide_circles(circle_s * circles, int length,
+        pair_buffer_s * out, int threads, _PairStream stream) except -1:
+    """
+    Does the same as ``collide()``: splits the circles into groups with
+    ``_rdc()`` and then brute forces each group.
+    """
+    cdef side_s * side_list
+    cdef side_s ** side_p_list
+    cdef int * group
+    cdef circle_s * grouped
+    cdef bf_task_s * tasks
+    cdef int count
+    side_list = <side_s*>malloc(sizeof(side_s)*length*2 + 1)
+    side_p_list = <side_s**>malloc(sizeof(side_s*)*length*2 + 1)
+    group = <int*>malloc(sizeof(int)*length + 1)
+    grouped = <circle_s*>malloc(sizeof(circle_s)*length + 1)
+    tasks = <bf_task_s*>malloc(sizeof(bf_task_s)*(length/2 + 1))
+    try:
+        if side_list == NULL or side_p_list == NULL or group == NULL or \
+                grouped == NULL or tasks == NULL:
+            raise MemoryError()
+        with nogil:
+            count = _find_groups(circles, length, side_list, side_p_list,
+                    group, grouped, tasks)
+        if stream is not None:
+            stream.run(tasks, count)
+        else:
+            _run_tasks(tasks, count, out, threads)
+    finally:
+        free(side_list)
+        free(side_p_list)
+        free(group)
+        free(grouped)
+        free(tasks)
+    return 0
+
+cdef int _check_format(Py_buffer * view, formats) except -1:
+    """
+    Returns the (native) struct format character of ``view``, which must be
+    one of ``formats``.
+    """
+    fmt = view.format
+    if isinstance(fmt, bytes):
+        fmt = fmt.decode("ascii")
+    if fmt[:1] in ("@", "=", _NATIVE_ORDER):
+        fmt = fmt[1:]
+    if len(fmt) != 1 or fmt not in formats:
+        raise TypeError("Expected a buffer of %s, not format %r" % (
+                " or ".join(formats), view.format))
+    return ord(fmt)
+
+cdef inline float _buffer_float(char * p, int fmt):
+    if fmt == c'f':
+        return (<float*>p)[0]
+    return <float>(<double*>p)[0]
+
+cdef int _read_column(object column, circle_s * circles, Py_ssize_t length,
+        int field) except -1:
+    cdef Py_buffer view
+    cdef int fmt
+    cdef Py_ssize_t i
+    cdef char * p
+    PyObject_GetBuffer(column, &view, PyBUF_FORMAT | PyBUF_STRIDES)
+    try:
+        fmt = _check_format(&view, ("f", "d"))
+        if view.ndim != 1 or view.shape[0] != length:
+            raise ValueError("All columns must have the same length")
+        p = <char*>view.buf
+        for i from 0 <= i < length:
+            if field == 0:
+                circles[i].x = _buffer_float(p, fmt)
+            elif field == 1:
+                circles[i].y = _buffer_float(p, fmt)
+            else:
+                circles[i].r = _buffer_float(p, fmt)
+            p = p + view.strides[0]
+    finally:
+        PyBuffer_Release(&view)
+    return 0
+
+cdef int _read_layer_column(object column, circle_s * circles,
+        Py_ssize_t length, int field) except -1:
+    """
+    Reads the categories (``field`` 0) or masks (``field`` 1) of ``circles``
+    from a buffer of uint32.
+    """
+    cdef Py_buffer view
+    cdef Py_ssize_t i
+    cdef char * p
+    PyObject_GetBuffer(column, &view, PyBUF_FORMAT | PyBUF_STRIDES)
+    try:
+        _check_format(&view, ("I", "L"))
+        if view.itemsize != 4:
+            raise TypeError("Expected a buffer of uint32")
+        if view.ndim != 1 or view.shape[0] != length:
+            raise ValueError("categories and masks must have one item for "
+                    "each object")
+        p = <char*>view.buf
+        for i from 0 <= i < length:
+            if field == 0:
+                circles[i].category = (<unsigned int*>p)[0]
+            else:
+                circles[i].mask = (<unsigned int*>p)[0]
+            p = p + view.strides[0]
+    finally:
+        PyBuffer_Release(&view)
+    return 0
+
+cdef int _read_layer_buffers(object categories, object masks,
+        circle_s * circles, Py_ssize_t length) except -1:
+    cdef Py_ssize_t i
+    cdef unsigned int category
+    if categories is None and masks is None:
+        category = ALL_LAYERS
+    else:
+        category = DEFAULT_CATEGORY
+    for i from 0 <= i < length:
+        circles[i].category = category
+        circles[i].mask = ALL_LAYERS
+    if categories is not None:
+        _read_layer_column(categories, circles, length, 0)
+    if masks is not None:
+        _read_layer_column(masks, circles, length, 1)
+    return 0
+
+cdef circle_s * _read_circle_buffers(object data, Py_ssize_t * length) \
+        except NULL:
+    """
+    Reads circles from ``data``, as described for ``collide_arrays()``.  The
+    returned array must be freed.
+    """
+    cdef Py_buffer view
+    cdef circle_s * circles
+    cdef Py_ssize_t i, n
+    cdef int fmt, columns
+    cdef char * row
+
+    if isinstance(data, (tuple, list)):
+        if not 2 <= len(data) <= 3:
+            raise ValueError("Expected two or three columns")
+        n = len(memoryview(data[0]))
+        circles = <circle_s*>malloc(sizeof(circle_s)*n + 1)
+        if circles == NULL:
+            raise MemoryError()
+        try:
+            for i from 0 <= i < len(data):
+                _read_column(data[i], circles, n, i)
+            if len(data) == 2:
+                for i from 0 <= i < n:
+                    circles[i].r = 0
+        except:
+            free(circles)
+            raise
+        length[0] = n
+        return circles
+
+    PyObject_GetBuffer(data, &view, PyBUF_FORMAT | PyBUF_STRIDES)
+    try:
+        fmt = _check_format(&view, ("f", "d"))
+        if view.ndim != 2 or not 2 <= view.shape[1] <= 3:
+            raise ValueError("Expected an array with a shape of (N,2) or "
+                    "(N,3)")
+        n = view.shape[0]
+        columns = view.shape[1]
+        circles = <circle_s*>malloc(sizeof(circle_s)*n + 1)
+        if circles == NULL:
+            raise MemoryError()
+        row = <char*>view.buf
+        for i from 0 <= i < n:
+            circles[i].x = _buffer_float(row, fmt)
+            circles[i].y = _buffer_float(row + view.strides[1], fmt)
+            if columns == 3:
+                circles[i].r = _buffer_float(row + view.strides[1]*2, fmt)
+            else:
+                circles[i].r = 0
+            row = row + view.strides[0]
+    finally:
+        PyBuffer_Release(&view)
+    length[0] = n
+    return circles
+
+ctypedef int (*circle_collider)(circle_s * circles, int length,
+        pair_buffer_s * out, int threads, _PairStream stream) except -1
+
+cdef object _pairs_view(int * pairs, Py_ssize_t count):
+    """
+    Copies ``count`` pairs into a new ``memoryview`` with a shape of
+    ``(count,2)``.
+    """
+    # memoryview can't cast to a shape of (0,2), so there is always an
+    # extra row that gets sliced off.
+    result = _array.array("i", bytes((count+1) * 2 * sizeof(int)))
+    if count:
+        memcpy(<void*><Py_ssize_t>result.buffer_info()[0], pairs,
+                count * 2 * sizeof(int))
+    return memoryview(result).cast("B").cast("i", (count+1, 2))[:count]
+
+cdef object _collide_arrays(object data, object out, object categories,
+        object masks, circle_collider collider, object threads,
+        object callback, Py_ssize_t batch_size):
+    cdef circle_s * circles
+    cdef Py_ssize_t length
+    cdef pair_buffer_s pairs
+    cdef Py_buffer view
+    cdef int have_view
+    have_view = 0
+    pairs.pairs = NULL
+    pairs.count = 0
+    pairs.capacity = 0
+    pairs.can_grow = 1
+    circles = NULL
+    stream = None
+    if callback is not None:
+        if out is not None:
+            raise ValueError("out can't be used with a callback")
+        stream = _PairStream(callback, batch_size)
+    _start_timing()
+    try:
+        circles = _read_circle_buffers(data, &length)
+        _read_layer_buffers(categories, masks, circles, length)
+        if out is not None:
+            PyObject_GetBuffer(out, &view,
+                    PyBUF_FORMAT | PyBUF_C_CONTIGUOUS | PyBUF_WRITABLE)
+            have_view = 1
+            _check_format(&view, ("i", "l"))
+            if view.itemsize != 4 or (view.ndim == 2 and view.shape[1] != 2) \
+                    or view.ndim > 2:
+                raise ValueError("out must be an int32 array with a shape "
+                        "of (M,2)")
+            pairs.pairs = <int*>view.buf
+            pairs.capacity = view.len / 8
+            pairs.can_grow = 0
+
+        collider(circles, length, &pairs, _threads_arg(threads), stream)
+        if stream is not None:
+            return None
+
+        if out is not None:
+            if pairs.count > pairs.capacity:
+                raise ValueError("out has room for %d collisions, but %d "
+                        "were found" % (pairs.capacity, pairs.count))
+            if view.ndim == 1:
+                return out[:pairs.count*2]
+            return out[:pairs.count]
+
+        return _pairs_view(pairs.pairs, pairs.count)
+    finally:
+        if have_view:
+            PyBuffer_Release(&view)
+        else:
+            free(pairs.pairs)
+        free(circles)
+        _stop_timing()
+
+def collide_arrays(data, out=None, categories=None, masks=None, threads=1,
+        callback=None, Py_ssize_t batch_size=65536):
+    """
+    ``collide_arrays(data, [out,] [categories,] [masks,] threads=1, callback=None, batch_size=65536) -> (M,2) array of indexes``
+
+    Works like ``collide()``, but reads the objects from arrays and returns
+    the collisions as pairs of indexes.
+
+    ``data`` can be an array with a shape of ``(N,3)`` holding ``x``, ``y``
+    and ``bounding_radius`` for each object, or ``(N,2)`` if the radii are
+    all ``0``.  It can also be a tuple of two or three one dimensional arrays
+    (the columns.)  Anything that supports the buffer protocol with ``float``
+    or ``double`` items will do, such as numpy arrays.
+
+    Each collision is a pair of indexes into ``data``, smallest first.
+
+    If ``out`` is given it should be a C-contiguous int32 array with a shape of
+    ``(K,2)`` (or ``(2*K,)``), such as ``numpy.empty((K,2), numpy.int32)``.
+    The collisions are written into it, and ``out[:M]`` is returned.  This
+    lets you keep reusing the same memory, frame after frame.  If there are
+    more than ``K`` collisions ``ValueError`` is raised.
+
+    Without ``out``, a new ``memoryview`` with a shape of ``(M,2)`` is
+    returned.  (``numpy.asarray()`` can wrap it without copying.)
+
+    ``categories`` and ``masks`` are optional uint32 arrays with one item for
+    each object, filtering the pairs as described for ``brute_force()``.  If
+    only one of them is given, the other defaults to ``1`` for categories and
+    ``0xFFFFFFFF`` for masks.
+
+    The GIL is released once the data has been read.  If ``threads`` is
+    more than ``1`` the groups found by ``rdc()`` are split between that
+    many threads (``0`` or ``None`` uses one per CPU.)  The result is
+    exactly the same, in the same order, whatever the number of threads.
+
+    If ``callback`` is given, nothing is returned.  Instead the collisions
+    are passed to ``callback`` as they are found, in ``(K,2)`` memoryviews
+    of at most ``batch_size`` pairs, so only about one batch is held in
+    memory at a time.  The batches come in the same order as the result
+    would have, and are all found on the calling thread (``threads`` is
+    ignored.)  ``out`` can't be used with a callback.
+    """
+    return _collide_arrays(data, out, categories, masks, _collide_circles,
+            threads, callback, batch_size)
+
+def brute_force_arrays(data, out=None, categories=None, masks=None,
+        threads=1, callback=None, Py_ssize_t batch_size=65536):
+    """
+    ``brute_force_arrays(data, [out,] [categories,] [masks,] threads=1, callback=None, batch_size=65536) -> (M,2) array of indexes``
+
+    Like ``collide_arrays()``, but checks every object against every other
+    object, like ``brute_force()`` does.  With ``threads``, the objects are
+    split into runs with about the same number of pairs to check.
+    """
+    return _collide_arrays(data, out, categories, masks,
+            _brute_force_circles, threads, callback, batch_size)
 
 
 cdef struct rect_s:
     float l, r, t, b
+    unsigned int category, mask
 
 cdef int _read_rect(object obj, rect_s * rect) except -1:
     cdef float x, y
@@ -394,20 +1580,25 @@ cdef int _collide_rect(rect_s * a, rect_s * b):
         return 1
     return 0
 
-def aabb_collide(objects):
+def aabb_collide(objects, use_masks=False):
     """
-    ``aabb_collide(objects)``
+    ``aabb_collide(objects, use_masks=False)``
 
     ``aabb_collide`` works similar to ``collide``,  but instead of using
     bounding radius it uses axis aligned bounding boxes [AABB].
 
     All objects must have ``left``, ``top``, ``right``, and ``bottom``
     attributes.
+
+    If ``use_masks`` is true, objects are filtered by their
+    ``collision_category`` and ``collision_mask``, as described for
+    ``brute_force()``.
     """
     cdef side_s * side_list
     cdef side_s ** side_p_list
     cdef side_s * temp_side
-    cdef int length, i, j, d, group_start, index
+    cdef unsigned int * layers
+    cdef int length, i, j, d, group_start, index, other
     cdef float2 temp_float2
     cdef float l,t,r,b
     cdef rect_s rect
@@ -417,10 +1608,19 @@ def aabb_collide(objects):
 
     side_list = <side_s*>malloc(sizeof(side_s)*length)
     side_p_list = <side_s**>malloc(sizeof(side_s*)*length)
+    # The category and mask of each object, one after the other.
+    layers = NULL
+    _start_timing()
     try:
+        if use_masks:
+            layers = <unsigned int*>malloc(sizeof(unsigned int)*length + 1)
+            if layers == NULL:
+                raise MemoryError()
         i = 0
         for o in objects:
             _read_rect(o, &rect)
+            if layers != NULL:
+                _read_filter(o, 1, &layers[i], &layers[i+1])
             side_list[i].x = rect.l
             side_list[i].y = rect.b
             side_list[i].side = LEFT
@@ -451,12 +1651,16 @@ def aabb_collide(objects):
                 temp_side = side_p_list[j]
                 while temp_side.index != index:
                     if temp_side.side == LEFT:
+                        other = temp_side.index
                         if l <= temp_side.other_side[0].x and \
                                 r >= temp_side.x and\
                                 b <= temp_side.other_side[0].y and \
-                                t >= temp_side.y:
+                                t >= temp_side.y and (layers == NULL or
+                                    _layers_match(layers[index*2],
+                                        layers[index*2+1], layers[other*2],
+                                        layers[other*2+1])):
                             collisions.append((objects[index],
-                                    objects[side_p_list[j][0].index]))
+                                    objects[other]))
                     j = j + 1
                     temp_side = side_p_list[j]
 
@@ -466,10 +1670,12 @@ def aabb_collide(objects):
     finally:
         free(side_list)
         free(side_p_list)
+        free(layers)
+        _stop_timing()
 
-def aabb_collide_single(single, objects):
+def aabb_collide_single(single, objects, use_masks=False):
     """
-    ``aabb_collide_single(single, objects)``
+    ``aabb_collide_single(single, objects, use_masks=False)``
 
     Finds all objects in ``objects`` that collide with ``single``, (using
     bounding boxes.)
@@ -479,55 +1685,2406 @@ def aabb_collide_single(single, objects):
 
     A list of all objects from ``objects`` that collide with ``single`` is
     returned.
+
+    If ``use_masks`` is true, objects are filtered by their
+    ``collision_category`` and ``collision_mask``, as described for
+    ``brute_force()``.
     """
     cdef rect_s r_a, r_b
     cdef object o, collisions
+    cdef int masks
 
-    _read_rect(single, &r_a)
+    masks = use_masks
+    _start_timing()
+    try:
+        _read_rect(single, &r_a)
+        _read_filter(single, masks, &r_a.category, &r_a.mask)
 
-    collisions = []
-    for o in objects:
-        _read_rect(o, &r_b)
-        if _collide_rect(&r_a, &r_b):
-            collisions.append(o)
-    return collisions
+        collisions = []
+        for o in objects:
+            _read_filter(o, masks, &r_b.category, &r_b.mask)
+            if not _layers_match(r_a.category, r_a.mask, r_b.category,
+                    r_b.mask):
+                continue
+            _read_rect(o, &r_b)
+            if _collide_rect(&r_a, &r_b):
+                collisions.append(o)
+        return collisions
+    finally:
+        _stop_timing()
 
-def aabb_collide_groups(group_a, group_b):
+def aabb_collide_groups(group_a, group_b, use_masks=False):
     """
-    ``aabb_collide_groups(group_a, group_b)``
+    ``aabb_collide_groups(group_a, group_b, use_masks=False)``
 
     Returns a list of collisions between objects in ``group_a`` with objects
     in ``group_b``.
 
     All objects must have ``left``, ``top``, ``right``, and ``bottom``
     attributes.
+
+    If ``use_masks`` is true, objects are filtered by their
+    ``collision_category`` and ``collision_mask``, as described for
+    ``brute_force()``.
+
+    For large groups the objects are sorted along one axis first, so that
+    only objects that are near each other get tested.
     """
+    cdef rect_s * c_group_a
     cdef rect_s * c_group_b
+    cdef interval_s * intervals
     cdef rect_s a
-    cdef int i, length
+    cdef rect_s * rect
+    cdef int i, length, length_a, n, masks
     cdef object o
+    masks = use_masks
     if not isinstance(group_b, list):
         group_b = list(group_b)
+    if not isinstance(group_a, list):
+        group_a = list(group_a)
+    length_a = len(group_a)
 
     length = len(group_b)
-    c_group_b = <rect_s*>malloc(sizeof(rect_s)*length)
+    c_group_a = NULL
+    intervals = NULL
+    c_group_b = <rect_s*>malloc(sizeof(rect_s)*length + 1)
 
+    _start_timing()
     try:
         i = 0
         for o in group_b:
             _read_rect(o, &c_group_b[i])
+            _read_filter(o, masks, &c_group_b[i].category,
+                    &c_group_b[i].mask)
             i = i + 1
 
+        if <long long>length * length_a >= _group_sweep_threshold:
+            c_group_a = <rect_s*>malloc(sizeof(rect_s)*length_a + 1)
+            n = length_a + length
+            intervals = <interval_s*>malloc(sizeof(interval_s)*n*2 + 1)
+            if c_group_a == NULL or intervals == NULL or c_group_b == NULL:
+                raise MemoryError()
+            for i from 0 <= i < length_a:
+                _read_rect(group_a[i], &c_group_a[i])
+                _read_filter(group_a[i], masks, &c_group_a[i].category,
+                        &c_group_a[i].mask)
+            for i from 0 <= i < n:
+                if i < length_a:
+                    rect = &c_group_a[i]
+                    intervals[i].index = intervals[n+i].index = i
+                else:
+                    rect = &c_group_b[i-length_a]
+                    intervals[i].index = intervals[n+i].index = i - length_a
+                intervals[i].lo = rect.l
+                intervals[i].hi = rect.r
+                intervals[n+i].lo = rect.b
+                intervals[n+i].hi = rect.t
+            return _sweep_groups_2d(intervals, length_a, c_group_a, length,
+                    c_group_b, _test_rects, group_a, group_b)
+
         collisions = []
         for o in group_a:
             _read_rect(o, &a)
+            _read_filter(o, masks, &a.category, &a.mask)
             for i from 0 <= i < length:
-                if _collide_rect(&a, &c_group_b[i]):
+                if _layers_match(a.category, a.mask, c_group_b[i].category,
+                        c_group_b[i].mask) and \
+                        _collide_rect(&a, &c_group_b[i]):
                     collisions.append((o, group_b[i]))
+        return collisions
     finally:
+        free(c_group_a)
         free(c_group_b)
+        free(intervals)
+        _stop_timing()
+
+
+# Oriented boxes
+#
+# A sprite's shape is a Quad that is rotated and scaled along with the
+# sprite.  These functions test the actual transformed quads against each
+# other with the separating axis test, so long rotated sprites don't collide
+# just because their bounding boxes do.
+
+cdef struct quad_s:
+    Point2d v[4]
+
+cdef int _read_quad(object obj, quad_s * quad) except -1:
+    """
+    Reads the four corners of ``obj``.  Sprites give their transformed shape;
+    anything else is read as an axis aligned rect, as in ``aabb_collide()``.
+    """
+    cdef cSprite sprite
+    cdef rect_s rect
+    cdef float x, y, sx, sy, r, co, si
+    cdef int i
+    if isinstance(obj, cSprite):
+        sprite = obj
+        READ_SLOT(&sprite._x, &x)
+        READ_SLOT(&sprite._y, &y)
+        READ_SLOT(&sprite._scale_x, &sx)
+        READ_SLOT(&sprite._scale_y, &sy)
+        READ_SLOT(&sprite._rot, &r)
+        co = cosf(r*PI_OVER_180)
+        si = sinf(r*PI_OVER_180)
+        for i from 0 <= i < 4:
+            quad.v[i].x = (sprite._shape.v[i].x*sx*co -
+                    sprite._shape.v[i].y*sy*si) + x
+            quad.v[i].y = (sprite._shape.v[i].x*sx*si +
+                    sprite._shape.v[i].y*sy*co) + y
+    else:
+        _read_rect(obj, &rect)
+        quad.v[0].x = rect.l
+        quad.v[0].y = rect.t
+        quad.v[1].x = rect.r
+        quad.v[1].y = rect.t
+        quad.v[2].x = rect.r
+        quad.v[2].y = rect.b
+        quad.v[3].x = rect.l
+        quad.v[3].y = rect.b
+    return 1
+
+cdef int _quad_separated_by_edges(quad_s * a, quad_s * b):
+    """
+    Returns 1 if one of the edge normals of ``a`` separates the two quads.
+    """
+    cdef int i, j
+    cdef float nx, ny, d, a_min, a_max, b_min, b_max
+    for i from 0 <= i < 4:
+        j = (i + 1) & 3
+        # The edge normal doesn't need to be normalized; we only compare
+        # projections onto the same axis.
+        nx = a.v[i].y - a.v[j].y
+        ny = a.v[j].x - a.v[i].x
+        a_min = a_max = a.v[0].x*nx + a.v[0].y*ny
+        b_min = b_max = b.v[0].x*nx + b.v[0].y*ny
+        for j from 1 <= j < 4:
+            d = a.v[j].x*nx + a.v[j].y*ny
+            if d < a_min: a_min = d
+            elif d > a_max: a_max = d
+            d = b.v[j].x*nx + b.v[j].y*ny
+            if d < b_min: b_min = d
+            elif d > b_max: b_max = d
+        if a_max < b_min or b_max < a_min:
+            return 1
+    return 0
+
+cdef int _collide_quads(quad_s * a, quad_s * b):
+    if _quad_separated_by_edges(a, b) or _quad_separated_by_edges(b, a):
+        return 0
+    return 1
+
+def obb_filter(collisions):
+    """
+    ``obb_filter(collisions) -> list of collisions``
+
+    Returns the pairs from ``collisions`` whose oriented boxes really overlap.
+
+    This is meant to be used after a cheaper test, such as ``collide()``,
+    ``aabb_collide()`` or ``collide_groups()``, to throw out the pairs that
+    only collide because of their bounding circles or boxes.  For example:
+
+        .. sourcecode:: python
+
+            collisions = obb_filter(aabb_collide(sprites))
+
+    Sprites are tested using their ``shape``, rotated and scaled as it is
+    when rendering.  Other objects are treated as axis aligned boxes, and
+    need ``left``, ``top``, ``right`` and ``bottom`` attributes.
+
+    Shapes should be convex.  (The default rectangular shapes always are.)
+    """
+    cdef quad_s * quads
+    cdef int count, a, b
+    _start_timing()
+    try:
+        if not isinstance(collisions, list):
+            collisions = list(collisions)
+        # Each object tends to show up in several pairs, so its quad is only
+        # worked out once.
+        indexes = {}
+        objects = []
+        for pair in collisions:
+            for o in pair:
+                if id(o) not in indexes:
+                    indexes[id(o)] = len(objects)
+                    objects.append(o)
+        count = len(objects)
+        quads = <quad_s*>malloc(sizeof(quad_s)*count + 1)
+        if quads == NULL:
+            raise MemoryError()
+        try:
+            for a from 0 <= a < count:
+                _read_quad(objects[a], &quads[a])
+            result = []
+            for pair in collisions:
+                a = indexes[id(pair[0])]
+                b = indexes[id(pair[1])]
+                if _collide_quads(&quads[a], &quads[b]):
+                    result.append(pair)
+            return result
+        finally:
+            free(quads)
+    finally:
+        _stop_timing()
+
+def obb_collide(objects, use_masks=False):
+    """
+    ``obb_collide(objects, use_masks=False) -> list of collisions``
+
+    Collides ``objects`` using their oriented boxes.  This is the same as
+    ``obb_filter(aabb_collide(objects, use_masks))``.
+    """
+    _start_timing()
+    try:
+        return obb_filter(aabb_collide(objects, use_masks))
+    finally:
+        _stop_timing()
+
+def obb_collide_single(single, objects, use_masks=False):
+    """
+    ``obb_collide_single(single, objects, use_masks=False) -> list of objects``
+
+    Returns the objects in ``objects`` whose oriented box overlaps that of
+    ``single``.  ``use_masks`` is as for ``aabb_collide_single()``.
+    """
+    cdef quad_s a, b
+    cdef rect_s r_a, r_b
+    cdef int masks
+    masks = use_masks
+    _start_timing()
+    try:
+        _read_quad(single, &a)
+        _read_rect(single, &r_a)
+        _read_filter(single, masks, &r_a.category, &r_a.mask)
+        collisions = []
+        for o in objects:
+            _read_filter(o, masks, &r_b.category, &r_b.mask)
+            if not _layers_match(r_a.category, r_a.mask, r_b.category,
+                    r_b.mask):
+                continue
+            _read_rect(o, &r_b)
+            if not _collide_rect(&r_a, &r_b):
+                continue
+            _read_quad(o, &b)
+            if _collide_quads(&a, &b):
+                collisions.append(o)
+        return collisions
+    finally:
+        _stop_timing()
+
+
+# Pixel masks
+#
+# An AlphaMask packs the alpha channel of a texture into one bit per pixel,
+# 64 pixels to a word.  Two objects are tested by walking the rows of the
+# finer of the two masks where the other object's quad covers it, sampling
+# the other mask at the same points, and ANDing the words together.  Objects
+# without a mask are solid all over their quad.
+
+ctypedef unsigned long long mask_word
+
+cdef class AlphaMask:
+    """
+    ``AlphaMask(data, size, threshold=128)``
+
+    A bit for each pixel of an image, set where the alpha is at least
+    ``threshold``.
+
+    ``data`` is a string of RGBA bytes with the bottom row first, as given
+    to ``load_texture()``, and ``size`` is ``(width, height)``.
+    """
+    cdef mask_word * bits
+    cdef int _width, _height, words, _threshold
+
+    def __cinit__(self, data, size, int threshold=128):
+        cdef unsigned char * pixels
+        cdef int x, y
+        cdef mask_word * row
+        self._threshold = threshold
+        self._width, self._height = size
+        if self._width < 0 or self._height < 0:
+            raise ValueError("size can't be negative")
+        if not isinstance(data, bytes):
+            data = bytes(data)
+        if len(data) != self._width * self._height * 4:
+            raise ValueError("data is an unexpected size")
+        self.words = (self._width + 63) / 64
+        self.bits = <mask_word*>malloc(
+                sizeof(mask_word)*self.words*self._height + 1)
+        if self.bits == NULL:
+            raise MemoryError()
+        memset(self.bits, 0, sizeof(mask_word)*self.words*self._height)
+        pixels = data
+        for y from 0 <= y < self._height:
+            row = &self.bits[y*self.words]
+            for x from 0 <= x < self._width:
+                if pixels[(y*self._width + x)*4 + 3] >= threshold:
+                    row[x >> 6] = row[x >> 6] | (<mask_word>1 << (x & 63))
+
+    def __dealloc__(self):
+        free(self.bits)
+
+    property width:
+        def __get__(self):
+            return self._width
+
+    property height:
+        def __get__(self):
+            return self._height
+
+    property threshold:
+        def __get__(self):
+            return self._threshold
+
+    def get(self, int x, int y):
+        """
+        ``get(x, y) -> bool``
+
+        Returns whether the pixel at ``x``, ``y`` (counting from the bottom
+        left) is set.
+        """
+        if x < 0 or y < 0 or x >= self._width or y >= self._height:
+            raise IndexError("pixel out of range")
+        return bool(self.bits[y*self.words + (x >> 6)] >> (x & 63) & 1)
+
+_alpha_masks = {}
+
+def set_alpha_mask(texture_id, data, size, threshold=128):
+    """
+    ``set_alpha_mask(texture_id, data, size, threshold=128) -> AlphaMask``
+
+    Builds an ``AlphaMask`` from ``data`` and keeps it for the texture
+    ``texture_id``, for ``pixel_filter()`` to use with the sprites showing
+    that texture.  The arguments are as for ``AlphaMask``.
+
+    ``pygame_load_texture()`` calls this for each texture it loads; textures
+    loaded any other way need it to be called by hand.
+    """
+    mask = AlphaMask(data, size, threshold)
+    _alpha_masks[texture_id] = mask
+    return mask
+
+def get_alpha_mask(texture_id):
+    """
+    ``get_alpha_mask(texture_id) -> AlphaMask or None``
+
+    Returns the mask kept for ``texture_id``.
+    """
+    return _alpha_masks.get(texture_id)
+
+def remove_alpha_mask(texture_id):
+    """
+    ``remove_alpha_mask(texture_id)``
+
+    Forgets the mask kept for ``texture_id``, if there is one.
+    """
+    _alpha_masks.pop(texture_id, None)
+
+def _update_alpha_mask(texture_id, data, size, type_):
+    # Called by the backends when a texture's data is replaced.  A texture
+    # that had a mask gets a new one, unless it no longer has an alpha channel.
+    mask = _alpha_masks.get(texture_id)
+    if mask is None:
+        return
+    if type_ == 'RGBA':
+        set_alpha_mask(texture_id, data, size, mask.threshold)
+    else:
+        remove_alpha_mask(texture_id)
+
+cdef mask_word _solid_bits
+_solid_bits = 1
+
+cdef struct pixel_shape_s:
+    quad_s quad
+    float m[6]          # world to pixel: px = m0*x + m1*y + m2, and so on
+    mask_word * bits    # a single set bit for objects without a mask
+    int width, height, words
+    int has_mask
+    int rect[4]         # the pixels the quad shows: x0, y0, x1, y1 (exclusive)
+
+cdef inline int _clamp_pixel(float x, int size):
+    if x < 0:
+        return 0
+    if x > size:
+        return size
+    return <int>x
+
+cdef int _read_pixel_shape(object obj, pixel_shape_s * shape) except -1:
+    """
+    Reads the quad of ``obj`` and works out how to get from the world to its
+    mask.  Returns 0 if the quad has no area.
+    """
+    cdef cSprite sprite
+    cdef AlphaMask mask
+    cdef Point2d t[4]
+    cdef float u, v, ax, ay, bx, by, det, ia, ib, ic, id_, ox, oy
+    cdef float w, h, lo, hi, p
+    cdef int i, j, size
+    _read_quad(obj, &shape.quad)
+    mask = None
+    if isinstance(obj, cSprite):
+        sprite = obj
+        mask = _alpha_masks.get(sprite._texture_id)
+    if mask is not None:
+        READ_SLOT(&sprite._u, &u)
+        READ_SLOT(&sprite._v, &v)
+        for i from 0 <= i < 4:
+            t[i].x = sprite._tex_shape.v[i].x + u
+            t[i].y = sprite._tex_shape.v[i].y + v
+        shape.bits = mask.bits
+        shape.width = mask._width
+        shape.height = mask._height
+        shape.words = mask.words
+        shape.has_mask = 1
+    else:
+        t[0].x = 0
+        t[0].y = 0
+        t[1].x = 1
+        t[1].y = 0
+        t[3].x = 0
+        t[3].y = 1
+        shape.bits = &_solid_bits
+        shape.width = shape.height = shape.words = 1
+        shape.has_mask = 0
+
+    # A point on the quad is v0 + s*(v1-v0) + t*(v3-v0), and the same s and t
+    # give its texture coordinates from t0, t1 and t3.
+    ax = shape.quad.v[1].x - shape.quad.v[0].x
+    ay = shape.quad.v[1].y - shape.quad.v[0].y
+    bx = shape.quad.v[3].x - shape.quad.v[0].x
+    by = shape.quad.v[3].y - shape.quad.v[0].y
+    det = ax*by - ay*bx
+    if det == 0:
+        return 0
+    # Inverse of [[ax, bx], [ay, by]], from world offsets to (s, t):
+    ia = by/det
+    ib = -bx/det
+    ic = -ay/det
+    id_ = ax/det
+    ox = shape.quad.v[0].x
+    oy = shape.quad.v[0].y
+    w = shape.width
+    h = shape.height
+    # pixel = (t0 + s*(t1-t0) + t*(t3-t0)) * size
+    ax = (t[1].x - t[0].x)*w
+    bx = (t[3].x - t[0].x)*w
+    ay = (t[1].y - t[0].y)*h
+    by = (t[3].y - t[0].y)*h
+    shape.m[0] = ax*ia + bx*ic
+    shape.m[1] = ax*ib + bx*id_
+    shape.m[2] = t[0].x*w - shape.m[0]*ox - shape.m[1]*oy
+    shape.m[3] = ay*ia + by*ic
+    shape.m[4] = ay*ib + by*id_
+    shape.m[5] = t[0].y*h - shape.m[3]*ox - shape.m[4]*oy
+
+    # Only the pixels whose centers are inside the texture coordinates count,
+    # so that a sprite showing one cell of an atlas doesn't collide with the
+    # pixels of the cells around it.  (The fourth corner is worked out the same
+    # way as for the mapping above.)
+    t[2].x = t[1].x + t[3].x - t[0].x
+    t[2].y = t[1].y + t[3].y - t[0].y
+    for j from 0 <= j < 2:
+        lo = hi = t[0].x if j == 0 else t[0].y
+        for i from 1 <= i < 4:
+            p = t[i].x if j == 0 else t[i].y
+            if p < lo: lo = p
+            if p > hi: hi = p
+        size = shape.width if j == 0 else shape.height
+        shape.rect[j] = _clamp_pixel(floorf(lo*size + 0.5), size)
+        shape.rect[j+2] = _clamp_pixel(floorf(hi*size + 0.5), size)
+    return 1
+
+cdef inline int _pixel_set(pixel_shape_s * shape, float px, float py) nogil:
+    cdef int x, y
+    if px < 0 or py < 0:
+        return 0
+    x = <int>px
+    y = <int>py
+    if x < shape.rect[0] or y < shape.rect[1] or \
+            x >= shape.rect[2] or y >= shape.rect[3]:
+        return 0
+    return <int>(shape.bits[y*shape.words + (x >> 6)] >> (x & 63) & 1)
+
+cdef mask_word _row_window(pixel_shape_s * shape, int y, int x) nogil:
+    """
+    Returns the 64 bits of row ``y`` starting at ``x``.  Bits outside of the
+    pixels the quad shows are clear.
+    """
+    cdef mask_word * row
+    cdef mask_word lo, hi, window
+    cdef int q, r, first, last
+    if y < shape.rect[1] or y >= shape.rect[3]:
+        return 0
+    first = shape.rect[0] - x
+    last = shape.rect[2] - x
+    if first >= 64 or last <= 0 or first >= last:
+        return 0
+    row = &shape.bits[y*shape.words]
+    q = x / 64
+    if x < q*64:
+        q = q - 1
+    r = x - q*64
+    lo = row[q] if 0 <= q < shape.words else 0
+    hi = row[q+1] if 0 <= q+1 < shape.words else 0
+    if r == 0:
+        window = lo
+    else:
+        window = (lo >> r) | (hi << (64 - r))
+    if first > 0:
+        window = window & (~<mask_word>0 << first)
+    if last < 64:
+        window = window & ~(~<mask_word>0 << last)
+    return window
+
+cdef inline int _is_near(float a, float b) nogil:
+    return -1e-4 < a - b < 1e-4
+
+cdef inline int _samples(float x, float y) nogil:
+    # How many samples along a step of (x, y) keep them at most 1 apart.
+    cdef float length
+    cdef int n
+    length = sqrtf(x*x + y*y)
+    if length > 65536:
+        return 65536
+    n = <int>length
+    if n < length:
+        n = n + 1
+    return n if n > 0 else 1
+
+cdef inline void _sample_range(float lo, float hi, int x, int n, int * first,
+        int * last) nogil:
+    # The samples x + (i+0.5)/n that are between lo and hi, give or take one.
+    cdef float f
+    f = (lo - x)*n - 1.5
+    first[0] = 0 if f <= 0 else (n - 1 if f >= n - 1 else <int>f)
+    f = (hi - x)*n + 0.5
+    last[0] = 0 if f <= 0 else (n - 1 if f >= n - 1 else <int>f)
+
+cdef int _sample_pixel(pixel_shape_s * b, float * c, int x, int y, int sx,
+        int sy, float x_lo, float x_hi, float y_lo, float y_hi) nogil:
+    """
+    Returns 1 if ``b`` is set at any of ``sx`` by ``sy`` samples spread evenly
+    over pixel ``(x, y)`` of a mask whose pixel space ``c`` maps to ``b``'s.
+    Only the samples within ``x_lo``, ``y_lo``, ``x_hi``, ``y_hi`` (the
+    bounds of ``b`` in the same pixel space) are checked.
+    """
+    cdef float fx, fy
+    cdef int i, j, i0, i1, j0, j1
+    _sample_range(x_lo, x_hi, x, sx, &i0, &i1)
+    _sample_range(y_lo, y_hi, y, sy, &j0, &j1)
+    for j from j0 <= j <= j1:
+        fy = y + (j + 0.5)/sy
+        for i from i0 <= i <= i1:
+            fx = x + (i + 0.5)/sx
+            if _pixel_set(b, c[0]*fx + c[1]*fy + c[2],
+                    c[3]*fx + c[4]*fy + c[5]):
+                return 1
+    return 0
+
+cdef int _pixels_overlap(pixel_shape_s * a, pixel_shape_s * b) nogil:
+    """
+    Walks the pixels of ``a`` that are under the quad of ``b``, and returns 1
+    if any of them are set in both masks.
+    """
+    cdef float det, n[6], c[6], px, py, x_lo, x_hi, y_lo, y_hi
+    cdef int i, x, y, x0, x1, y0, y1, k, k0, k1, bit, first, last
+    cdef int aligned, dx, dy, sx, sy
+    cdef mask_word a_word, b_word
+    # n is a's pixel space back to the world.
+    det = a.m[0]*a.m[4] - a.m[1]*a.m[3]
+    if det == 0:
+        return 0
+    n[0] = a.m[4]/det
+    n[1] = -a.m[1]/det
+    n[3] = -a.m[3]/det
+    n[4] = a.m[0]/det
+    n[2] = -(n[0]*a.m[2] + n[1]*a.m[5])
+    n[5] = -(n[3]*a.m[2] + n[4]*a.m[5])
+    # c is a's pixel space to b's.
+    c[0] = b.m[0]*n[0] + b.m[1]*n[3]
+    c[1] = b.m[0]*n[1] + b.m[1]*n[4]
+    c[2] = b.m[0]*n[2] + b.m[1]*n[5] + b.m[2]
+    c[3] = b.m[3]*n[0] + b.m[4]*n[3]
+    c[4] = b.m[3]*n[1] + b.m[4]*n[4]
+    c[5] = b.m[3]*n[2] + b.m[4]*n[5] + b.m[5]
+
+    # The pixels of a under b's quad.
+    x_lo = y_lo = FLT_MAX
+    x_hi = y_hi = -FLT_MAX
+    for i from 0 <= i < 4:
+        px = a.m[0]*b.quad.v[i].x + a.m[1]*b.quad.v[i].y + a.m[2]
+        py = a.m[3]*b.quad.v[i].x + a.m[4]*b.quad.v[i].y + a.m[5]
+        if px < x_lo: x_lo = px
+        if px > x_hi: x_hi = px
+        if py < y_lo: y_lo = py
+        if py > y_hi: y_hi = py
+    if x_hi < a.rect[0] or y_hi < a.rect[1] or x_lo >= a.rect[2] or \
+            y_lo >= a.rect[3]:
+        return 0
+    x0 = a.rect[0] if x_lo < a.rect[0] else <int>x_lo
+    y0 = a.rect[1] if y_lo < a.rect[1] else <int>y_lo
+    x1 = a.rect[2] - 1 if x_hi >= a.rect[2] else <int>x_hi
+    y1 = a.rect[3] - 1 if y_hi >= a.rect[3] else <int>y_hi
+    if x0 > x1 or y0 > y1:
+        return 0
+
+    # When the pixels of b line up with those of a (no rotation or scaling
+    # between them), its rows can be read a word at a time.
+    aligned = _is_near(c[0], 1) and _is_near(c[1], 0) and \
+            _is_near(c[3], 0) and _is_near(c[4], 1) and b.has_mask
+    dx = <int>floorf(c[2] + 0.5)
+    dy = <int>floorf(c[5] + 0.5)
+    # Otherwise b is sampled across each pixel of a.  a's pixels can be
+    # longer than b's along one axis even when they have a smaller area (a
+    # texture stretched to a different aspect ratio), so they're split so
+    # that no row or column of b is stepped over.
+    sx = _samples(c[0], c[3])
+    sy = _samples(c[1], c[4])
+
+    k0 = x0 >> 6
+    k1 = x1 >> 6
+    for y from y0 <= y <= y1:
+        for k from k0 <= k <= k1:
+            a_word = a.bits[y*a.words + k]
+            first = x0 - k*64 if k == k0 else 0
+            last = x1 - k*64 if k == k1 else 63
+            if first > 0:
+                a_word = a_word & (~<mask_word>0 << first)
+            if last < 63:
+                a_word = a_word & ~(~<mask_word>0 << (last + 1))
+            if a_word == 0:
+                continue
+            if aligned:
+                if a_word & _row_window(b, y + dy, k*64 + dx):
+                    return 1
+                continue
+            # Sample b across the pixels set in this word.
+            b_word = 0
+            for bit from first <= bit <= last:
+                if not (a_word >> bit & 1):
+                    continue
+                x = k*64 + bit
+                if _sample_pixel(b, c, x, y, sx, sy, x_lo, x_hi, y_lo,
+                        y_hi):
+                    b_word = b_word | (<mask_word>1 << bit)
+            if a_word & b_word:
+                return 1
+    return 0
+
+cdef float _pixel_area(pixel_shape_s * shape):
+    # The area of one pixel, in world units.
+    cdef float det
+    det = shape.m[0]*shape.m[4] - shape.m[1]*shape.m[3]
+    if det == 0:
+        return FLT_MAX
+    if det < 0:
+        det = -det
+    return 1 / det
+
+cdef int _collide_pixels(pixel_shape_s * a, pixel_shape_s * b):
+    if not _collide_quads(&a.quad, &b.quad):
+        return 0
+    if not a.has_mask and not b.has_mask:
+        return 1
+    # Walk the finer mask, so that no pixels are skipped.
+    if b.has_mask and (not a.has_mask or
+            _pixel_area(b) < _pixel_area(a)):
+        a, b = b, a
+    return _pixels_overlap(a, b)
+
+def pixel_filter(collisions):
+    """
+    ``pixel_filter(collisions) -> list of collisions``
+
+    Returns the pairs from ``collisions`` that overlap pixel for pixel.  Like
+    ``obb_filter()``, this is meant to be run on the results of a cheaper
+    test, such as ``aabb_collide()``.
+
+    Sprites whose texture has an ``AlphaMask`` (see ``set_alpha_mask()``)
+    only collide where their opaque pixels overlap, rotated and scaled as
+    they are when rendering, and taking ``tex_shape``, ``u`` and ``v`` into
+    account.  Anything else is solid across its oriented box, as in
+    ``obb_filter()``.
+    """
+    cdef pixel_shape_s * shapes
+    cdef int count, a, b
+    _start_timing()
+    try:
+        if not isinstance(collisions, list):
+            collisions = list(collisions)
+        indexes = {}
+        objects = []
+        for pair in collisions:
+            for o in pair:
+                if id(o) not in indexes:
+                    indexes[id(o)] = len(objects)
+                    objects.append(o)
+        count = len(objects)
+        shapes = <pixel_shape_s*>malloc(sizeof(pixel_shape_s)*count + 1)
+        if shapes == NULL:
+            raise MemoryError()
+        try:
+            valid = []
+            for a from 0 <= a < count:
+                valid.append(_read_pixel_shape(objects[a], &shapes[a]))
+            result = []
+            for pair in collisions:
+                a = indexes[id(pair[0])]
+                b = indexes[id(pair[1])]
+                if valid[a] and valid[b] and \
+                        _collide_pixels(&shapes[a], &shapes[b]):
+                    result.append(pair)
+            return result
+        finally:
+            free(shapes)
+    finally:
+        _stop_timing()
+
+def pixel_collide(objects, use_masks=False):
+    """
+    ``pixel_collide(objects, use_masks=False) -> list of collisions``
+
+    Collides ``objects`` pixel for pixel.  This is the same as
+    ``pixel_filter(aabb_collide(objects, use_masks))``.
+    """
+    _start_timing()
+    try:
+        return pixel_filter(aabb_collide(objects, use_masks))
+    finally:
+        _stop_timing()
+
+
+# Rays
+#
+# A ray starts at (ox, oy) and goes along the unit vector (dx, dy).  Hits are
+# measured as the distance along the ray to where it enters an object.
+
+cdef struct ray_s:
+    float ox, oy, dx, dy
+    float max_dist          # shrinks to the nearest hit unless all_hits
+    unsigned int mask
+    int use_shapes
+    int all_hits
+    int best                # index of the nearest hit, or -1
+    float best_dist
+
+cdef int _ray_circle(ray_s * ray, circle_s * c, float * t):
+    """
+    Finds where ``ray`` enters ``c``.  Returns 0 if it doesn't (or only did
+    behind the origin.)
+    """
+    cdef float mx, my, b, k, disc
+    mx = ray.ox - c.x
+    my = ray.oy - c.y
+    k = mx*mx + my*my - c.r*c.r
+    if k < 0:
+        # The origin is inside the circle.
+        t[0] = 0
+        return 1
+    b = mx*ray.dx + my*ray.dy
+    if b > 0:
+        return 0
+    disc = b*b - k
+    # Just grazing the circle doesn't count, like in collide_single().
+    if disc <= 0:
+        return 0
+    t[0] = -b - sqrtf(disc)
+    return 1
+
+cdef int _ray_quad(ray_s * ray, quad_s * q, float * t):
+    """
+    Clips ``ray`` against each edge of the (convex) quad ``q``.
+    """
+    cdef float t_enter, t_leave, s, nx, ny, num, den, area
+    cdef int i, j
+    # Work out the winding, so that the edge normals point outwards.
+    area = 0
+    for i from 0 <= i < 4:
+        j = (i + 1) & 3
+        area = area + q.v[i].x*q.v[j].y - q.v[j].x*q.v[i].y
+    if area > 0:
+        s = 1
+    else:
+        s = -1
+    t_enter = 0
+    t_leave = ray.max_dist
+    for i from 0 <= i < 4:
+        j = (i + 1) & 3
+        nx = s*(q.v[j].y - q.v[i].y)
+        ny = -s*(q.v[j].x - q.v[i].x)
+        num = nx*(q.v[i].x - ray.ox) + ny*(q.v[i].y - ray.oy)
+        den = nx*ray.dx + ny*ray.dy
+        if den == 0:
+            if num < 0:
+                return 0
+        elif den < 0:
+            if num / den > t_enter:
+                t_enter = num / den
+        elif num / den < t_leave:
+            t_leave = num / den
+        if t_enter > t_leave:
+            return 0
+    t[0] = t_enter
+    return 1
+
+cdef int _ray_visit(ray_s * ray, object obj, circle_s * circle, int index,
+        object hits) except -1:
+    """
+    Tests ``obj`` (whose bounding circle is ``circle``) against ``ray``.  A
+    hit is added to ``hits`` as ``(distance, index)`` if ``ray.all_hits`` is
+    set; otherwise the nearest hit so far is kept in ``ray``.
+    """
+    cdef float t
+    cdef quad_s quad
+    if not _ray_circle(ray, circle, &t) or t > ray.max_dist:
+        return 0
+    if ray.use_shapes and isinstance(obj, cSprite):
+        _read_quad(obj, &quad)
+        if not _ray_quad(ray, &quad, &t):
+            return 0
+    if ray.all_hits:
+        hits.append((t, index))
+    elif ray.best == -1 or t < ray.best_dist:
+        ray.best = index
+        ray.best_dist = t
+        ray.max_dist = t
+    return 0
+
+cdef int _clip_ray(ray_s * ray, float l, float b, float r, float t,
+        float * t0, float * t1):
+    """
+    Narrows ``[t0, t1]`` to the part of ``ray`` inside the given rect.
+    Returns 0 if none of it is.
+    """
+    cdef float near, far
+    if ray.dx == 0:
+        if ray.ox < l or ray.ox > r:
+            return 0
+    else:
+        near = (l - ray.ox) / ray.dx
+        far = (r - ray.ox) / ray.dx
+        if near > far:
+            near, far = far, near
+        if near > t0[0]: t0[0] = near
+        if far < t1[0]: t1[0] = far
+    if ray.dy == 0:
+        if ray.oy < b or ray.oy > t:
+            return 0
+    else:
+        near = (b - ray.oy) / ray.dy
+        far = (t - ray.oy) / ray.dy
+        if near > far:
+            near, far = far, near
+        if near > t0[0]: t0[0] = near
+        if far < t1[0]: t1[0] = far
+    return t0[0] <= t1[0]
+
+cdef int _init_ray(ray_s * ray, origin, direction, float max_dist,
+        all_hits, use_shapes, unsigned int mask) except -1:
+    cdef float length
+    ray.ox, ray.oy = origin
+    ray.dx, ray.dy = direction
+    length = sqrtf(ray.dx*ray.dx + ray.dy*ray.dy)
+    if length == 0:
+        raise ValueError("direction can't be (0, 0)")
+    ray.dx = ray.dx / length
+    ray.dy = ray.dy / length
+    if max_dist < 0:
+        raise ValueError("max_dist can't be negative")
+    ray.max_dist = max_dist
+    ray.mask = mask
+    ray.use_shapes = use_shapes
+    ray.all_hits = all_hits
+    ray.best = -1
+    ray.best_dist = 0
+    return 0
+
+
+# A set of pairs of object ids, stored in an open addressing hash table.
+# Each pair is packed into one key, smaller id first.
+
+DEF EMPTY_KEY = 0xFFFFFFFFFFFFFFFF
+
+cdef struct pair_set_s:
+    unsigned long long * keys
+    unsigned int mask       # capacity - 1; the capacity is a power of two.
+    int count
+
+cdef inline unsigned long long _pair_key(int a, int b):
+    if a < b:
+        return (<unsigned long long>a << 32) | <unsigned int>b
+    return (<unsigned long long>b << 32) | <unsigned int>a
+
+cdef inline unsigned int _pair_hash(pair_set_s * s, unsigned long long key):
+    return <unsigned int>((key * 0x9E3779B97F4A7C15ULL) >> 32) & s.mask
+
+cdef int _pair_set_init(pair_set_s * s, unsigned int capacity) except -1:
+    cdef unsigned int i
+    s.keys = <unsigned long long *>malloc(
+            sizeof(unsigned long long) * capacity)
+    if s.keys == NULL:
+        raise MemoryError()
+    for i from 0 <= i < capacity:
+        s.keys[i] = EMPTY_KEY
+    s.mask = capacity - 1
+    s.count = 0
+    return 0
+
+cdef void _pair_set_free(pair_set_s * s):
+    if s.keys != NULL:
+        free(s.keys)
+        s.keys = NULL
+    s.count = 0
+
+cdef void _pair_set_clear(pair_set_s * s):
+    cdef unsigned int i
+    for i from 0 <= i <= s.mask:
+        s.keys[i] = EMPTY_KEY
+    s.count = 0
+
+cdef int _pair_set_contains(pair_set_s * s, unsigned long long key):
+    cdef unsigned int i
+    i = _pair_hash(s, key)
+    while s.keys[i] != EMPTY_KEY:
+        if s.keys[i] == key:
+            return 1
+        i = (i + 1) & s.mask
+    return 0
+
+cdef int _pair_set_add(pair_set_s * s, unsigned long long key) except -1:
+    """
+    Adds ``key`` to the set.  Returns 1 if it was added, 0 if it was already
+    there.
+    """
+    cdef unsigned int i
+    cdef pair_set_s grown
+    if (s.count + 1) * 2 > s.mask + 1:
+        # The new table is only swapped in once it has been allocated, so a
+        # MemoryError leaves s as it was.
+        _pair_set_init(&grown, (s.mask + 1) * 2)
+        for i from 0 <= i <= s.mask:
+            if s.keys[i] != EMPTY_KEY:
+                _pair_set_add(&grown, s.keys[i])
+        free(s.keys)
+        s[0] = grown
+    i = _pair_hash(s, key)
+    while s.keys[i] != EMPTY_KEY:
+        if s.keys[i] == key:
+            return 0
+        i = (i + 1) & s.mask
+    s.keys[i] = key
+    s.count = s.count + 1
+    return 1
+
+cdef int _pair_set_remove(pair_set_s * s, unsigned long long key):
+    """
+    Removes ``key`` from the set.  Returns 1 if it was there.
+    """
+    cdef unsigned int i, j, home
+    i = _pair_hash(s, key)
+    while s.keys[i] != key:
+        if s.keys[i] == EMPTY_KEY:
+            return 0
+        i = (i + 1) & s.mask
+    # Shift back any following keys that would no longer be found.
+    j = i
+    while 1:
+        j = (j + 1) & s.mask
+        if s.keys[j] == EMPTY_KEY:
+            break
+        home = _pair_hash(s, s.keys[j])
+        if (j > i and (home <= i or home > j)) or \
+                (j < i and home <= i and home > j):
+            s.keys[i] = s.keys[j]
+            i = j
+    s.keys[i] = EMPTY_KEY
+    s.count = s.count - 1
+    return 1
+
+
+# Contact events
+#
+# The worlds remember which pairs were colliding at the last call to
+# contacts(), so that they can report just the pairs that started or stopped
+# colliding since then.
+
+cdef inline object _pair_objects(objects, unsigned long long key):
+    return (objects[<int>(key >> 32)], objects[<int>(key & 0xFFFFFFFF)])
+
+cdef object _buffer_objects(pair_buffer_s * pairs, objects):
+    cdef Py_ssize_t i
+    collisions = []
+    for i from 0 <= i < pairs.count:
+        collisions.append((objects[pairs.pairs[i*2]],
+                objects[pairs.pairs[i*2+1]]))
     return collisions
 
-__docs_all__ = ('collide', 'collide_single', 'collide_groups',
-        'aabb_collide', 'aabb_collide_single', 'aabb_collide_groups',
-        'rdc', 'brute_force')
+cdef object _update_contacts(pair_set_s * previous, pair_buffer_s * current,
+        objects, ended, int persisting):
+    """
+    Compares the colliding pairs in ``current`` with the ones in
+    ``previous``, and then replaces ``previous`` with them.
+
+    Returns ``(began, persisting, ended)``.  ``ended`` is appended to, and
+    ``persisting`` is ``None`` unless it was asked for.
+    """
+    cdef pair_set_s now
+    cdef Py_ssize_t i
+    cdef unsigned int j
+    cdef unsigned long long key
+    began = []
+    if persisting:
+        persist = []
+    else:
+        persist = None
+    _pair_set_init(&now, 64)
+    try:
+        for i from 0 <= i < current.count:
+            key = _pair_key(current.pairs[i*2], current.pairs[i*2+1])
+            _pair_set_add(&now, key)
+            if not _pair_set_contains(previous, key):
+                began.append(_pair_objects(objects, key))
+            elif persisting:
+                persist.append(_pair_objects(objects, key))
+        for j from 0 <= j <= previous.mask:
+            key = previous.keys[j]
+            if key != EMPTY_KEY and not _pair_set_contains(&now, key):
+                ended.append(_pair_objects(objects, key))
+    except:
+        _pair_set_free(&now)
+        raise
+    _pair_set_free(previous)
+    previous[0] = now
+    return began, persist, ended
+
+cdef int _drop_contacts(pair_set_s * contacts, int id, objects, ended) \
+        except -1:
+    """
+    Removes the pairs involving ``id`` from ``contacts``, adding them to
+    ``ended``.  This has to be done before the id is reused.
+    """
+    cdef unsigned int i
+    cdef unsigned long long key
+    keys = []
+    for i from 0 <= i <= contacts.mask:
+        key = contacts.keys[i]
+        if key != EMPTY_KEY and (<int>(key >> 32) == id or
+                <int>(key & 0xFFFFFFFF) == id):
+            keys.append(key)
+    for key in keys:
+        ended.append(_pair_objects(objects, key))
+        _pair_set_remove(contacts, key)
+    return 0
+
+cdef int _report_contacts(began, persist, ended, on_begin, on_persist,
+        on_end) except -1:
+    if on_begin is not None:
+        for a, b in began:
+            on_begin(a, b)
+    if on_persist is not None:
+        for a, b in persist:
+            on_persist(a, b)
+    if on_end is not None:
+        for a, b in ended:
+            on_end(a, b)
+    return 0
+
+
+cdef int _read_world_filter(object obj, object category, object mask,
+        unsigned int * c_category, unsigned int * c_mask) except -1:
+    """
+    Works out the layers of an object being added to a world: ``category``
+    and ``mask`` if they aren't ``None``, otherwise the object's own.
+    """
+    _read_filter(obj, 1, c_category, c_mask)
+    if category is not None:
+        c_category[0] = category
+    if mask is not None:
+        c_mask[0] = mask
+    return 0
+
+cdef struct sap_proxy_s:
+    float lo[2]
+    float hi[2]
+    float x, y, r
+    unsigned int category, mask
+    int in_use
+
+cdef struct sap_endpoint_s:
+    float value
+    int id
+    int is_max
+
+cdef inline int _endpoint_lt(sap_endpoint_s * a, sap_endpoint_s * b):
+    # At equal values, minimums go before maximums so that touching boxes
+    # count as overlapping (like in aabb_collide().)
+    return a.value < b.value or (a.value == b.value and b.is_max and
+            not a.is_max)
+
+cdef inline int _proxies_overlap(sap_proxy_s * a, sap_proxy_s * b):
+    return a.lo[0] <= b.hi[0] and a.hi[0] >= b.lo[0] and \
+            a.lo[1] <= b.hi[1] and a.hi[1] >= b.lo[1]
+
+cdef class SweepAndPrune:
+    """
+    ``SweepAndPrune([objects], aabb=False)``
+
+    A persistent broadphase that keeps track of which objects overlap from
+    one frame to the next.
+
+    Instead of sorting all the objects from scratch, like ``rdc()`` and
+    ``aabb_collide()`` do, the bounds of each object are kept sorted along
+    both axes.  Because objects don't move far between frames, ``update()``
+    only has to shuffle a few of them, and the set of overlapping pairs is
+    changed to match as it goes.  This makes each update close to O(n).
+
+    By default objects are treated like they are for ``collide()``: they
+    should have ``x``, ``y`` and ``bounding_radius`` attributes, (or be a
+    tuple of ``(x, y, bounding_radius)``.)  If ``aabb`` is ``True`` they are
+    treated like they are for ``aabb_collide()`` and need ``left``,
+    ``top``, ``right`` and ``bottom`` attributes.
+
+    Each object has a ``category`` and ``mask``, as described for
+    ``brute_force()``.  Pairs whose layers don't match are never added, so
+    they don't cost anything after the sort.
+
+    Typical use looks like this:
+
+        .. sourcecode:: python
+
+            world = rabbyt.collisions.SweepAndPrune(sprites)
+            while running:
+                # ... move the sprites ...
+                for a, b in world.collide():
+                    a.hit(b)
+    """
+    cdef sap_proxy_s * proxies
+    cdef int proxy_capacity
+    cdef sap_endpoint_s * endpoints[2]
+    cdef int endpoint_count
+    cdef pair_set_s pairs
+    cdef pair_set_s _contacts       # colliding pairs at the last contacts()
+    cdef object _ended              # contacts ended by remove()
+    cdef object _objects        # list of objects, indexed by id
+    cdef object _ids            # id(object) -> object id
+    cdef object _free_ids
+    cdef readonly int aabb
+
+    def __cinit__(self, *args, **kwargs):
+        self.proxy_capacity = 16
+        self.proxies = <sap_proxy_s*>malloc(
+                sizeof(sap_proxy_s) * self.proxy_capacity)
+        self.endpoints[0] = <sap_endpoint_s*>malloc(
+                sizeof(sap_endpoint_s) * self.proxy_capacity * 2)
+        self.endpoints[1] = <sap_endpoint_s*>malloc(
+                sizeof(sap_endpoint_s) * self.proxy_capacity * 2)
+        if self.proxies == NULL or self.endpoints[0] == NULL or \
+                self.endpoints[1] == NULL:
+            raise MemoryError()
+        self.endpoint_count = 0
+        _pair_set_init(&self.pairs, 64)
+        _pair_set_init(&self._contacts, 64)
+
+    def __init__(self, objects=(), aabb=False):
+        self._objects = []
+        self._ids = {}
+        self._free_ids = []
+        self._ended = []
+        self.aabb = bool(aabb)
+        for o in objects:
+            self.add(o)
+
+    def __dealloc__(self):
+        free(self.proxies)
+        free(self.endpoints[0])
+        free(self.endpoints[1])
+        _pair_set_free(&self.pairs)
+        _pair_set_free(&self._contacts)
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, obj):
+        return id(obj) in self._ids
+
+    property objects:
+        """
+        A list of the objects in the world.
+        """
+        def __get__(self):
+            return [o for o in self._objects if o is not None]
+
+    cdef int _read_proxy(self, int i) except -1:
+        cdef sap_proxy_s * p
+        cdef rect_s rect
+        cdef circle_s circle
+        p = &self.proxies[i]
+        if self.aabb:
+            _read_rect(self._objects[i], &rect)
+            p.lo[0] = rect.l
+            p.hi[0] = rect.r
+            p.lo[1] = rect.b
+            p.hi[1] = rect.t
+        else:
+            _read_circle(self._objects[i], &circle)
+            p.x = circle.x
+            p.y = circle.y
+            p.r = circle.r
+            p.lo[0] = circle.x - circle.r
+            p.hi[0] = circle.x + circle.r
+            p.lo[1] = circle.y - circle.r
+            p.hi[1] = circle.y + circle.r
+        return 0
+
+    cdef int _sort_axis(self, int axis) except -1:
+        """
+        Brings the endpoints for ``axis`` up to date and insertion sorts them,
+        adding and removing pairs as the endpoints pass each other.
+        """
+        cdef sap_endpoint_s * e
+        cdef sap_endpoint_s moving
+        cdef int i, j
+        e = self.endpoints[axis]
+        for i from 0 <= i < self.endpoint_count:
+            if e[i].is_max:
+                e[i].value = self.proxies[e[i].id].hi[axis]
+            else:
+                e[i].value = self.proxies[e[i].id].lo[axis]
+
+        for i from 1 <= i < self.endpoint_count:
+            if not _endpoint_lt(&e[i], &e[i-1]):
+                continue
+            moving = e[i]
+            j = i - 1
+            while j >= 0 and _endpoint_lt(&moving, &e[j]):
+                if moving.id != e[j].id:
+                    if e[j].is_max and not moving.is_max:
+                        # A minimum moved below a maximum; they might have
+                        # started overlapping.
+                        if _proxies_overlap(&self.proxies[moving.id],
+                                &self.proxies[e[j].id]) and \
+                                self._pair_layers_match(moving.id, e[j].id):
+                            _pair_set_add(&self.pairs,
+                                    _pair_key(moving.id, e[j].id))
+                    elif moving.is_max and not e[j].is_max:
+                        # A maximum moved below a minimum; they no longer
+                        # overlap on this axis.
+                        _pair_set_remove(&self.pairs,
+                                _pair_key(moving.id, e[j].id))
+                e[j+1] = e[j]
+                j = j - 1
+            e[j+1] = moving
+        return 0
+
+    cdef inline int _pair_layers_match(self, int a, int b):
+        return _layers_match(self.proxies[a].category, self.proxies[a].mask,
+                self.proxies[b].category, self.proxies[b].mask)
+
+    def add(self, obj, category=None, mask=None):
+        """
+        ``add(obj, [category,] [mask])``
+
+        Adds ``obj`` to the world.  Its pairs are found right away.
+
+        ``category`` and ``mask`` default to the object's
+        ``collision_category`` and ``collision_mask`` (or ``1`` and
+        ``0xFFFFFFFF`` if it doesn't have them.)  They are read once, here;
+        use ``set_filter()`` to change them later.
+        """
+        cdef int i, axis, n
+        cdef unsigned int c_category, c_mask
+        if id(obj) in self._ids:
+            raise ValueError("%r is already in the SweepAndPrune" % (obj,))
+        _read_world_filter(obj, category, mask, &c_category, &c_mask)
+        if self._free_ids:
+            i = self._free_ids.pop()
+            self._objects[i] = obj
+        else:
+            i = len(self._objects)
+            if i == self.proxy_capacity:
+                self._grow()
+            self._objects.append(obj)
+        self._ids[id(obj)] = i
+        self.proxies[i].in_use = 1
+        self.proxies[i].category = c_category
+        self.proxies[i].mask = c_mask
+        self._read_proxy(i)
+
+        # The new endpoints go on the end, and get sorted into place.
+        n = self.endpoint_count
+        for axis from 0 <= axis < 2:
+            self.endpoints[axis][n].id = i
+            self.endpoints[axis][n].is_max = 0
+            self.endpoints[axis][n+1].id = i
+            self.endpoints[axis][n+1].is_max = 1
+        self.endpoint_count = n + 2
+        self._sort_axis(0)
+        self._sort_axis(1)
+
+    cdef int _grow(self) except -1:
+        cdef int capacity, axis
+        cdef void * p
+        capacity = self.proxy_capacity * 2
+        p = realloc(self.proxies, sizeof(sap_proxy_s) * capacity)
+        if p == NULL:
+            raise MemoryError()
+        self.proxies = <sap_proxy_s*>p
+        for axis from 0 <= axis < 2:
+            p = realloc(self.endpoints[axis],
+                    sizeof(sap_endpoint_s) * capacity * 2)
+            if p == NULL:
+                raise MemoryError()
+            self.endpoints[axis] = <sap_endpoint_s*>p
+        self.proxy_capacity = capacity
+        return 0
+
+    def remove(self, obj):
+        """
+        ``remove(obj)``
+
+        Removes ``obj`` from the world, along with any pairs it is part of.
+        """
+        cdef int i, j, k, axis
+        cdef sap_endpoint_s * e
+        try:
+            i = self._ids.pop(id(obj))
+        except KeyError:
+            raise ValueError("%r is not in the SweepAndPrune" % (obj,))
+        # Move it out past everything else; that drops its pairs.
+        self.proxies[i].lo[0] = self.proxies[i].lo[1] = FLT_MAX
+        self.proxies[i].hi[0] = self.proxies[i].hi[1] = FLT_MAX
+        for axis from 0 <= axis < 2:
+            self._sort_axis(axis)
+            e = self.endpoints[axis]
+            k = 0
+            for j from 0 <= j < self.endpoint_count:
+                if e[j].id != i:
+                    e[k] = e[j]
+                    k = k + 1
+        self.endpoint_count = self.endpoint_count - 2
+        _drop_contacts(&self._contacts, i, self._objects, self._ended)
+        self.proxies[i].in_use = 0
+        self._objects[i] = None
+        self._free_ids.append(i)
+
+    def set_filter(self, obj, category=None, mask=None):
+        """
+        ``set_filter(obj, [category,] [mask])``
+
+        Changes the layers of ``obj``, which must already be in the world.
+        Arguments that are ``None`` are read from the object again, as in
+        ``add()``.
+        """
+        cdef int i, j
+        cdef unsigned long long key
+        try:
+            i = self._ids[id(obj)]
+        except KeyError:
+            raise ValueError("%r is not in the SweepAndPrune" % (obj,))
+        _read_world_filter(obj, category, mask, &self.proxies[i].category,
+                &self.proxies[i].mask)
+        # Positions haven't changed since the last update, so the bounds
+        # tell us which pairs there should be.
+        for j from 0 <= j < len(self._objects):
+            if j == i or not self.proxies[j].in_use:
+                continue
+            key = _pair_key(i, j)
+            if _proxies_overlap(&self.proxies[i], &self.proxies[j]) and \
+                    self._pair_layers_match(i, j):
+                _pair_set_add(&self.pairs, key)
+            else:
+                _pair_set_remove(&self.pairs, key)
+
+    def update(self):
+        """
+        ``update()``
+
+        Reads the current position of every object and updates the set of
+        overlapping pairs.
+        """
+        cdef int i
+        _start_timing()
+        try:
+            for i from 0 <= i < len(self._objects):
+                if self.proxies[i].in_use:
+                    self._read_proxy(i)
+            self._sort_axis(0)
+            self._sort_axis(1)
+        finally:
+            _stop_timing()
+
+    def get_pairs(self):
+        """
+        ``get_pairs() -> list of pairs``
+
+        Returns the pairs of objects whose bounds overlapped at the last
+        ``update()``.  (For circles, the bounds are the square around the
+        circle, so they might not really be colliding.)
+        """
+        cdef unsigned int i
+        cdef unsigned long long key
+        objects = self._objects
+        pairs = []
+        for i from 0 <= i <= self.pairs.mask:
+            key = self.pairs.keys[i]
+            if key != EMPTY_KEY:
+                pairs.append((objects[<int>(key >> 32)],
+                        objects[<int>(key & 0xFFFFFFFF)]))
+        return pairs
+
+    cdef int _colliding(self, pair_buffer_s * out) except -1:
+        """
+        Adds the ids of each colliding pair to ``out``, as of the last
+        ``update()``.
+        """
+        cdef unsigned int i
+        cdef unsigned long long key
+        cdef int a, b
+        cdef float dx, dy
+        for i from 0 <= i <= self.pairs.mask:
+            key = self.pairs.keys[i]
+            if key == EMPTY_KEY:
+                continue
+            a = <int>(key >> 32)
+            b = <int>(key & 0xFFFFFFFF)
+            if not self.aabb:
+                dx = self.proxies[a].x - self.proxies[b].x
+                dy = self.proxies[a].y - self.proxies[b].y
+                if dx*dx + dy*dy >= self.proxies[a].r*self.proxies[a].r + \
+                        self.proxies[b].r*self.proxies[b].r:
+                    continue
+            _add_pair(out, a, b)
+        return 0
+
+    def collide(self):
+        """
+        ``collide() -> list of collisions``
+
+        Calls ``update()`` and returns the colliding pairs.  Circles are
+        tested the same way as in ``collide()``.
+        """
+        cdef pair_buffer_s pairs
+        self.update()
+        _start_timing()
+        pairs.pairs = NULL
+        pairs.count = 0
+        pairs.capacity = 0
+        pairs.can_grow = 1
+        try:
+            self._colliding(&pairs)
+            return _buffer_objects(&pairs, self._objects)
+        finally:
+            free(pairs.pairs)
+            _stop_timing()
+
+    def contacts(self, persisting=False, on_begin=None, on_persist=None,
+            on_end=None):
+        """
+        ``contacts(persisting=False, [on_begin,] [on_persist,] [on_end]) -> (began, ended)``
+
+        Calls ``update()`` and returns the changes since the last call to
+        ``contacts()``: ``began`` is a list of the pairs that started
+        colliding, and ``ended`` a list of the pairs that stopped (including
+        the pairs of objects that were removed.)
+
+        If ``persisting`` is true, ``(began, persisting, ended)`` is returned
+        instead, where ``persisting`` holds the pairs that were colliding
+        both times.
+
+        The callbacks, if given, are called as ``callback(a, b)`` for each
+        pair, after the lists have been built.
+
+        The previous pairs are kept in a C hash table, so only the changes
+        cost anything in python.
+        """
+        cdef pair_buffer_s pairs
+        self.update()
+        _start_timing()
+        pairs.pairs = NULL
+        pairs.count = 0
+        pairs.capacity = 0
+        pairs.can_grow = 1
+        try:
+            self._colliding(&pairs)
+            # The contacts ended by remove() are only let go of once the
+            # update has worked.
+            began, persist, ended = _update_contacts(&self._contacts,
+                    &pairs, self._objects, list(self._ended),
+                    persisting or on_persist is not None)
+            self._ended = []
+            _report_contacts(began, persist, ended, on_begin, on_persist,
+                    on_end)
+            if persisting:
+                return began, persist, ended
+            return began, ended
+        finally:
+            free(pairs.pairs)
+            _stop_timing()
+
+
+# Objects covering more than this many cells aren't put in the cells of a
+# SpatialHash; they are kept in a separate list and checked against
+# everything.
+DEF MAX_OBJECT_CELLS = 64
+# Cell coordinates are clamped to this, so that far away objects don't
+# overflow.
+DEF MAX_CELL_COORD = 0x3FFFFFFF
+
+cdef struct hash_cell_s:
+    int cx, cy
+    int used
+    int count, capacity
+    int * ids
+
+cdef struct hash_proxy_s:
+    float x, y, r
+    unsigned int category, mask
+    int cx0, cy0, cx1, cy1
+    int in_use
+    int large
+    unsigned int stamp
+
+cdef int _bucket_add(hash_cell_s * cell, int id) except -1:
+    cdef void * p
+    if cell.count == cell.capacity:
+        if cell.capacity == 0:
+            cell.capacity = 4
+        else:
+            cell.capacity = cell.capacity * 2
+        p = realloc(cell.ids, sizeof(int) * cell.capacity)
+        if p == NULL:
+            raise MemoryError()
+        cell.ids = <int*>p
+    cell.ids[cell.count] = id
+    cell.count = cell.count + 1
+    return 0
+
+cdef void _bucket_remove(hash_cell_s * cell, int id):
+    cdef int i
+    for i from 0 <= i < cell.count:
+        if cell.ids[i] == id:
+            cell.count = cell.count - 1
+            cell.ids[i] = cell.ids[cell.count]
+            return
+
+cdef inline unsigned int _cell_hash(int cx, int cy):
+    cdef unsigned int h
+    h = (<unsigned int>cx * 0x9E3779B1U) ^ (<unsigned int>cy * 0x85EBCA77U)
+    return h ^ (h >> 16)
+
+cdef inline int _cell_coord(float v, float inv_cell_size):
+    v = floorf(v * inv_cell_size)
+    if v > MAX_CELL_COORD:
+        return MAX_CELL_COORD
+    if v < -MAX_CELL_COORD:
+        return -MAX_CELL_COORD
+    return <int>v
+
+cdef class SpatialHash:
+    """
+    ``SpatialHash(cell_size, [objects])``
+
+    A uniform grid for finding collisions between lots of objects of about the
+    same size.
+
+    Space is divided into square cells of ``cell_size``, and each object is
+    stored in the cells its bounding circle touches.  Only the cells that are
+    occupied use any memory.  ``update()`` re-reads the position of every
+    object, but only moves an object between cells if it has crossed a cell
+    boundary.
+
+    Objects are treated like they are for ``collide()``: they should have
+    ``x``, ``y`` and ``bounding_radius`` attributes, or be a tuple of
+    ``(x, y, bounding_radius)``.  Sprites are read directly, without going
+    through their python attributes.
+
+    Each object has a ``category`` and ``mask``, as described for
+    ``brute_force()``, and pairs whose layers don't match aren't reported.
+
+    A good ``cell_size`` is around the diameter of a typical object.  Much
+    bigger objects still work, but are checked against every other object.
+
+    It also works as an index for ``query_radius()``, ``query_rect()``,
+    ``nearest()`` and ``raycast()``.  Calling ``update()`` once a frame
+    keeps it current.
+    """
+    cdef readonly float cell_size
+    cdef float inv_cell_size
+    cdef hash_cell_s * cells
+    cdef unsigned int cell_mask
+    cdef int cells_used
+    cdef hash_cell_s large          # objects that cover too many cells
+    cdef hash_proxy_s * proxies
+    cdef int proxy_capacity
+    cdef unsigned int stamp
+    cdef float bounds[4]            # l, b, r, t around all objects
+    cdef pair_set_s _contacts       # colliding pairs at the last contacts()
+    cdef object _ended              # contacts ended by remove()
+    cdef object _objects
+    cdef object _ids
+    cdef object _free_ids
+
+    def __cinit__(self, *args, **kwargs):
+        self.proxy_capacity = 16
+        self.proxies = <hash_proxy_s*>malloc(
+                sizeof(hash_proxy_s) * self.proxy_capacity)
+        if self.proxies == NULL:
+            raise MemoryError()
+        self._init_cells(64)
+        _pair_set_init(&self._contacts, 64)
+        self._reset_bounds()
+
+    def __init__(self, float cell_size, objects=()):
+        if cell_size <= 0:
+            raise ValueError("cell_size must be greater than 0")
+        self.cell_size = cell_size
+        self.inv_cell_size = 1 / cell_size
+        self._objects = []
+        self._ids = {}
+        self._free_ids = []
+        self._ended = []
+        for o in objects:
+            self.add(o)
+
+    def __dealloc__(self):
+        self._free_cells(self.cells, self.cell_mask + 1)
+        free(self.large.ids)
+        free(self.proxies)
+        _pair_set_free(&self._contacts)
+
+    cdef int _init_cells(self, unsigned int capacity) except -1:
+        self.cells = <hash_cell_s*>malloc(sizeof(hash_cell_s) * capacity)
+        if self.cells == NULL:
+            raise MemoryError()
+        memset(self.cells, 0, sizeof(hash_cell_s) * capacity)
+        self.cell_mask = capacity - 1
+        self.cells_used = 0
+        return 0
+
+    cdef void _free_cells(self, hash_cell_s * cells, unsigned int capacity):
+        cdef unsigned int i
+        if cells == NULL:
+            return
+        for i from 0 <= i < capacity:
+            if cells[i].ids != NULL:
+                free(cells[i].ids)
+        free(cells)
+
+    cdef int _rehash(self, int extra) except -1:
+        """
+        Rebuilds the cell table, dropping cells that are empty and making
+        room for at least ``extra`` more.
+        """
+        cdef hash_cell_s * old_cells
+        cdef unsigned int old_capacity, capacity, i, j
+        cdef int occupied
+        old_cells = self.cells
+        old_capacity = self.cell_mask + 1
+        occupied = 0
+        for i from 0 <= i < old_capacity:
+            if old_cells[i].count > 0:
+                occupied = occupied + 1
+        capacity = 64
+        while capacity < (occupied + extra) * 4:
+            capacity = capacity * 2
+        self._init_cells(capacity)
+        for i from 0 <= i < old_capacity:
+            if old_cells[i].count > 0:
+                j = _cell_hash(old_cells[i].cx, old_cells[i].cy) & \
+                        self.cell_mask
+                while self.cells[j].used:
+                    j = (j + 1) & self.cell_mask
+                self.cells[j] = old_cells[i]
+                self.cells_used = self.cells_used + 1
+                old_cells[i].ids = NULL
+        self._free_cells(old_cells, old_capacity)
+        return 0
+
+    cdef hash_cell_s * _find_cell(self, int cx, int cy, int create) except? NULL:
+        """
+        Returns the cell at ``(cx, cy)``, or ``NULL`` if there isn't one and
+        ``create`` is false.
+        """
+        cdef unsigned int i
+        i = _cell_hash(cx, cy) & self.cell_mask
+        while self.cells[i].used:
+            if self.cells[i].cx == cx and self.cells[i].cy == cy:
+                return &self.cells[i]
+            i = (i + 1) & self.cell_mask
+        if not create:
+            return NULL
+        if (self.cells_used + 1) * 2 > self.cell_mask + 1:
+            self._rehash(1)
+            i = _cell_hash(cx, cy) & self.cell_mask
+            while self.cells[i].used:
+                i = (i + 1) & self.cell_mask
+        self.cells[i].used = 1
+        self.cells[i].cx = cx
+        self.cells[i].cy = cy
+        self.cells_used = self.cells_used + 1
+        return &self.cells[i]
+
+    cdef int _insert(self, int id) except -1:
+        cdef hash_proxy_s * p
+        cdef int cx, cy
+        p = &self.proxies[id]
+        p.cx0 = _cell_coord(p.x - p.r, self.inv_cell_size)
+        p.cx1 = _cell_coord(p.x + p.r, self.inv_cell_size)
+        p.cy0 = _cell_coord(p.y - p.r, self.inv_cell_size)
+        p.cy1 = _cell_coord(p.y + p.r, self.inv_cell_size)
+        p.large = ((<long long>p.cx1 - p.cx0 + 1) *
+                (<long long>p.cy1 - p.cy0 + 1) > MAX_OBJECT_CELLS)
+        if p.large:
+            _bucket_add(&self.large, id)
+            return 0
+        for cx from p.cx0 <= cx <= p.cx1:
+            for cy from p.cy0 <= cy <= p.cy1:
+                _bucket_add(self._find_cell(cx, cy, 1), id)
+        return 0
+
+    cdef int _unlink(self, int id) except -1:
+        cdef hash_proxy_s * p
+        cdef hash_cell_s * cell
+        cdef int cx, cy
+        p = &self.proxies[id]
+        if p.large:
+            _bucket_remove(&self.large, id)
+            return 0
+        for cx from p.cx0 <= cx <= p.cx1:
+            for cy from p.cy0 <= cy <= p.cy1:
+                cell = self._find_cell(cx, cy, 0)
+                if cell != NULL:
+                    _bucket_remove(cell, id)
+        return 0
+
+    cdef void _reset_bounds(self):
+        self.bounds[0] = self.bounds[1] = FLT_MAX
+        self.bounds[2] = self.bounds[3] = -FLT_MAX
+
+    cdef int _read(self, int id) except -1:
+        cdef circle_s circle
+        _read_circle(self._objects[id], &circle)
+        self.proxies[id].x = circle.x
+        self.proxies[id].y = circle.y
+        if circle.r < 0:
+            circle.r = -circle.r
+        self.proxies[id].r = circle.r
+        if circle.x - circle.r < self.bounds[0]:
+            self.bounds[0] = circle.x - circle.r
+        if circle.y - circle.r < self.bounds[1]:
+            self.bounds[1] = circle.y - circle.r
+        if circle.x + circle.r > self.bounds[2]:
+            self.bounds[2] = circle.x + circle.r
+        if circle.y + circle.r > self.bounds[3]:
+            self.bounds[3] = circle.y + circle.r
+        return 0
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __contains__(self, obj):
+        return id(obj) in self._ids
+
+    property objects:
+        """
+        A list of the objects in the hash.
+        """
+        def __get__(self):
+            return [o for o in self._objects if o is not None]
+
+    def add(self, obj, category=None, mask=None):
+        """
+        ``add(obj, [category,] [mask])``
+
+        Adds ``obj`` to the hash.
+
+        ``category`` and ``mask`` default to the object's
+        ``collision_category`` and ``collision_mask`` (or ``1`` and
+        ``0xFFFFFFFF`` if it doesn't have them.)  They are read once, here;
+        use ``set_filter()`` to change them later.
+        """
+        cdef int i
+        cdef void * p
+        cdef unsigned int c_category, c_mask
+        if id(obj) in self._ids:
+            raise ValueError("%r is already in the SpatialHash" % (obj,))
+        _read_world_filter(obj, category, mask, &c_category, &c_mask)
+        if self._free_ids:
+            i = self._free_ids.pop()
+            self._objects[i] = obj
+        else:
+            i = len(self._objects)
+            if i == self.proxy_capacity:
+                p = realloc(self.proxies,
+                        sizeof(hash_proxy_s) * self.proxy_capacity * 2)
+                if p == NULL:
+                    raise MemoryError()
+                self.proxies = <hash_proxy_s*>p
+                self.proxy_capacity = self.proxy_capacity * 2
+            self._objects.append(obj)
+        self._ids[id(obj)] = i
+        self.proxies[i].in_use = 1
+        self.proxies[i].stamp = 0
+        self.proxies[i].category = c_category
+        self.proxies[i].mask = c_mask
+        self._read(i)
+        self._insert(i)
+
+    def remove(self, obj):
+        """
+        ``remove(obj)``
+
+        Removes ``obj`` from the hash.
+        """
+        cdef int i
+        try:
+            i = self._ids.pop(id(obj))
+        except KeyError:
+            raise ValueError("%r is not in the SpatialHash" % (obj,))
+        self._unlink(i)
+        _drop_contacts(&self._contacts, i, self._objects, self._ended)
+        self.proxies[i].in_use = 0
+        self._objects[i] = None
+        self._free_ids.append(i)
+
+    def set_filter(self, obj, category=None, mask=None):
+        """
+        ``set_filter(obj, [category,] [mask])``
+
+        Changes the layers of ``obj``, which must already be in the hash.
+        Arguments that are ``None`` are read from the object again, as in
+        ``add()``.
+        """
+        cdef int i
+        try:
+            i = self._ids[id(obj)]
+        except KeyError:
+            raise ValueError("%r is not in the SpatialHash" % (obj,))
+        _read_world_filter(obj, category, mask, &self.proxies[i].category,
+                &self.proxies[i].mask)
+
+    def update(self):
+        """
+        ``update()``
+
+        Reads the current position of every object, moving the ones that
+        crossed into different cells.
+        """
+        cdef int i, cx0, cx1, cy0, cy1
+        cdef hash_proxy_s * p
+        _start_timing()
+        try:
+            self._reset_bounds()
+            for i from 0 <= i < len(self._objects):
+                p = &self.proxies[i]
+                if not p.in_use:
+                    continue
+                self._read(i)
+                cx0 = _cell_coord(p.x - p.r, self.inv_cell_size)
+                cx1 = _cell_coord(p.x + p.r, self.inv_cell_size)
+                cy0 = _cell_coord(p.y - p.r, self.inv_cell_size)
+                cy1 = _cell_coord(p.y + p.r, self.inv_cell_size)
+                if cx0 != p.cx0 or cx1 != p.cx1 or cy0 != p.cy0 or \
+                        cy1 != p.cy1:
+                    self._unlink(i)
+                    self._insert(i)
+        finally:
+            _stop_timing()
+
+    cdef inline int _circles_collide(self, int a, int b):
+        cdef float dx, dy
+        if not _layers_match(self.proxies[a].category, self.proxies[a].mask,
+                self.proxies[b].category, self.proxies[b].mask):
+            return 0
+        dx = self.proxies[a].x - self.proxies[b].x
+        dy = self.proxies[a].y - self.proxies[b].y
+        return dx*dx + dy*dy < self.proxies[a].r*self.proxies[a].r + \
+                self.proxies[b].r*self.proxies[b].r
+
+    cdef int _colliding(self, pair_buffer_s * out) except -1:
+        """
+        Adds the ids of each colliding pair to ``out``, as of the last
+        ``update()``.
+        """
+        cdef unsigned int c
+        cdef int i, j, a, b, n
+        cdef hash_cell_s * cell
+        cdef hash_proxy_s * pa
+        cdef hash_proxy_s * pb
+        for c from 0 <= c <= self.cell_mask:
+            cell = &self.cells[c]
+            for i from 0 <= i < cell.count:
+                a = cell.ids[i]
+                pa = &self.proxies[a]
+                for j from i < j < cell.count:
+                    b = cell.ids[j]
+                    pb = &self.proxies[b]
+                    # A pair can share several cells; only report it from
+                    # the first one.
+                    if cell.cx != (pa.cx0 if pa.cx0 > pb.cx0 else pb.cx0) \
+                            or cell.cy != (pa.cy0 if pa.cy0 > pb.cy0
+                                    else pb.cy0):
+                        continue
+                    if self._circles_collide(a, b):
+                        _add_pair(out, a, b)
+        n = len(self._objects)
+        for i from 0 <= i < self.large.count:
+            a = self.large.ids[i]
+            for b from 0 <= b < n:
+                if b == a or not self.proxies[b].in_use or \
+                        (self.proxies[b].large and b < a):
+                    continue
+                if self._circles_collide(a, b):
+                    _add_pair(out, a, b)
+        return 0
+
+    def collide(self):
+        """
+        ``collide() -> list of collisions``
+
+        Calls ``update()`` and returns all pairs of colliding objects.  Circles
+        are tested the same way as in ``collide()``.
+        """
+        cdef pair_buffer_s pairs
+        self.update()
+        _start_timing()
+        pairs.pairs = NULL
+        pairs.count = 0
+        pairs.capacity = 0
+        pairs.can_grow = 1
+        try:
+            self._colliding(&pairs)
+            return _buffer_objects(&pairs, self._objects)
+        finally:
+            free(pairs.pairs)
+            _stop_timing()
+
+    def contacts(self, persisting=False, on_begin=None, on_persist=None,
+            on_end=None):
+        """
+        ``contacts(persisting=False, [on_begin,] [on_persist,] [on_end]) -> (began, ended)``
+
+        Calls ``update()`` and returns the pairs that started and stopped
+        colliding since the last call, as described for
+        ``SweepAndPrune.contacts()``.
+        """
+        cdef pair_buffer_s pairs
+        self.update()
+        _start_timing()
+        pairs.pairs = NULL
+        pairs.count = 0
+        pairs.capacity = 0
+        pairs.can_grow = 1
+        try:
+            self._colliding(&pairs)
+            # The contacts ended by remove() are only let go of once the
+            # update has worked.
+            began, persist, ended = _update_contacts(&self._contacts,
+                    &pairs, self._objects, list(self._ended),
+                    persisting or on_persist is not None)
+            self._ended = []
+            _report_contacts(began, persist, ended, on_begin, on_persist,
+                    on_end)
+            if persisting:
+                return began, persist, ended
+            return began, ended
+        finally:
+            free(pairs.pairs)
+            _stop_timing()
+
+    cdef void _next_stamp(self):
+        """
+        Starts a new query.  Objects are marked with the stamp once they have
+        been looked at, so that objects in several cells are only looked at
+        once.
+        """
+        cdef int i
+        self.stamp = self.stamp + 1
+        if self.stamp == 0:
+            for i from 0 <= i < len(self._objects):
+                self.proxies[i].stamp = 0
+            self.stamp = 1
+
+    cdef int _ray_visit_id(self, ray_s * ray, int id, hits) except -1:
+        cdef circle_s circle
+        cdef hash_proxy_s * p
+        p = &self.proxies[id]
+        if (p.category & ray.mask) == 0:
+            return 0
+        circle.x = p.x
+        circle.y = p.y
+        circle.r = p.r
+        return _ray_visit(ray, self._objects[id], &circle, id, hits)
+
+    cdef object _raycast(self, ray_s * ray):
+        """
+        Returns a list of ``(distance, id)`` for the objects hit by ``ray``,
+        or just sets ``ray.best`` unless ``ray.all_hits`` is set.
+
+        The cells are visited in order along the ray, so looking for the
+        nearest hit stops at the first cell past it.
+        """
+        cdef float t0, t1, cell_t, next_x, next_y, delta_x, delta_y
+        cdef int cx, cy, end_cx, end_cy, step_x, step_y, i, id, n
+        cdef long long steps
+        cdef hash_cell_s * cell
+        hits = []
+        for i from 0 <= i < self.large.count:
+            self._ray_visit_id(ray, self.large.ids[i], hits)
+        t0 = 0
+        t1 = ray.max_dist
+        if not _clip_ray(ray, self.bounds[0], self.bounds[1], self.bounds[2],
+                self.bounds[3], &t0, &t1):
+            return hits
+        cx = _cell_coord(ray.ox + ray.dx*t0, self.inv_cell_size)
+        cy = _cell_coord(ray.oy + ray.dy*t0, self.inv_cell_size)
+        end_cx = _cell_coord(ray.ox + ray.dx*t1, self.inv_cell_size)
+        end_cy = _cell_coord(ray.oy + ray.dy*t1, self.inv_cell_size)
+        steps = (<long long>end_cx - cx if end_cx > cx else
+                <long long>cx - end_cx) + (<long long>end_cy - cy if
+                end_cy > cy else <long long>cy - end_cy) + 1
+
+        n = len(self._objects)
+        if steps > n:
+            # Cheaper to look at everything.
+            for id from 0 <= id < n:
+                if self.proxies[id].in_use and not self.proxies[id].large:
+                    self._ray_visit_id(ray, id, hits)
+            return hits
+
+        if ray.dx > 0:
+            step_x = 1
+            next_x = ((cx + 1) * self.cell_size - ray.ox) / ray.dx
+            delta_x = self.cell_size / ray.dx
+        elif ray.dx < 0:
+            step_x = -1
+            next_x = (cx * self.cell_size - ray.ox) / ray.dx
+            delta_x = -self.cell_size / ray.dx
+        else:
+            step_x = 0
+            next_x = FLT_MAX
+            delta_x = 0
+        if ray.dy > 0:
+            step_y = 1
+            next_y = ((cy + 1) * self.cell_size - ray.oy) / ray.dy
+            delta_y = self.cell_size / ray.dy
+        elif ray.dy < 0:
+            step_y = -1
+            next_y = (cy * self.cell_size - ray.oy) / ray.dy
+            delta_y = -self.cell_size / ray.dy
+        else:
+            step_y = 0
+            next_y = FLT_MAX
+            delta_y = 0
+
+        self._next_stamp()
+        cell_t = t0
+        while steps > 0:
+            # Anything in the cells from here on is further away.
+            if ray.best != -1 and cell_t > ray.max_dist:
+                break
+            cell = self._find_cell(cx, cy, 0)
+            if cell != NULL:
+                for i from 0 <= i < cell.count:
+                    id = cell.ids[i]
+                    if self.proxies[id].stamp != self.stamp:
+                        self.proxies[id].stamp = self.stamp
+                        self._ray_visit_id(ray, id, hits)
+            steps = steps - 1
+            if next_x < next_y:
+                cell_t = next_x
+                next_x = next_x + delta_x
+                cx = cx + step_x
+            else:
+                cell_t = next_y
+                next_y = next_y + delta_y
+                cy = cy + step_y
+        return hits
+
+    cdef object _query(self, float l, float b, float r, float t,
+            circle_s * circle, unsigned int mask):
+        """
+        Returns the objects touching the rect ``(l, b, r, t)``.  If ``circle``
+        isn't ``NULL`` they are tested against it instead of the rect.  Only
+        objects with a category in ``mask`` are returned.
+        """
+        cdef int cx0, cx1, cy0, cy1, cx, cy, i, id, n
+        cdef hash_cell_s * cell
+        cdef hash_proxy_s * p
+        cdef float dx, dy
+        self._next_stamp()
+        cx0 = _cell_coord(l, self.inv_cell_size)
+        cx1 = _cell_coord(r, self.inv_cell_size)
+        cy0 = _cell_coord(b, self.inv_cell_size)
+        cy1 = _cell_coord(t, self.inv_cell_size)
+
+        # Collect candidate ids, marking each with the stamp.
+        candidates = []
+        n = len(self._objects)
+        if (<long long>cx1 - cx0 + 1) * (<long long>cy1 - cy0 + 1) > n:
+            # Cheaper to look at everything.
+            for id from 0 <= id < n:
+                if self.proxies[id].in_use:
+                    candidates.append(id)
+        else:
+            for cx from cx0 <= cx <= cx1:
+                for cy from cy0 <= cy <= cy1:
+                    cell = self._find_cell(cx, cy, 0)
+                    if cell == NULL:
+                        continue
+                    for i from 0 <= i < cell.count:
+                        id = cell.ids[i]
+                        if self.proxies[id].stamp != self.stamp:
+                            self.proxies[id].stamp = self.stamp
+                            candidates.append(id)
+            for i from 0 <= i < self.large.count:
+                candidates.append(self.large.ids[i])
+
+        found = []
+        for id in candidates:
+            p = &self.proxies[id]
+            if (p.category & mask) == 0:
+                continue
+            if circle != NULL:
+                dx = p.x - circle.x
+                dy = p.y - circle.y
+                if dx*dx + dy*dy < p.r*p.r + circle.r*circle.r:
+                    found.append(self._objects[id])
+            elif p.x - p.r <= r and p.x + p.r >= l and \
+                    p.y - p.r <= t and p.y + p.r >= b:
+                found.append(self._objects[id])
+        return found
+
+    def query_radius(self, float x, float y, float radius=0,
+            unsigned int mask=ALL_LAYERS):
+        """
+        ``query_radius(x, y, radius=0, mask=0xFFFFFFFF) -> list of objects``
+
+        Returns the objects colliding with a circle at ``(x, y)``, as in
+        ``collide_single()``.  Only objects whose category shares a bit with
+        ``mask`` are returned.
+
+        Positions are as of the last ``update()`` (or ``add()``.)
+        """
+        cdef circle_s circle
+        _start_timing()
+        try:
+            circle.x = x
+            circle.y = y
+            circle.r = radius
+            return self._query(x-radius, y-radius, x+radius, y+radius,
+                    &circle, mask)
+        finally:
+            _stop_timing()
+
+    cdef int _nearest_visit(self, int id, float x, float y, float limit,
+            unsigned int mask, found) except -1:
+        cdef hash_proxy_s * p
+        cdef float dx, dy, d2
+        p = &self.proxies[id]
+        if p.stamp == self.stamp:
+            return 0
+        p.stamp = self.stamp
+        if (p.category & mask) == 0:
+            return 0
+        dx = p.x - x
+        dy = p.y - y
+        d2 = dx*dx + dy*dy
+        if d2 <= limit*limit:
+            found.append((d2, id))
+        return 0
+
+    def nearest(self, float x, float y, int k=1, max_dist=None,
+            unsigned int mask=ALL_LAYERS):
+        """
+        ``nearest(x, y, k=1, [max_dist,] mask=0xFFFFFFFF) -> list of (object, distance)``
+
+        Returns the ``k`` objects whose centers are nearest to ``(x, y)``,
+        nearest first, along with their distance.  Fewer are returned if
+        there aren't that many objects (within ``max_dist``, if it is given.)
+
+        Only objects whose category shares a bit with ``mask`` are returned.
+
+        The cells are searched in rings around ``(x, y)``, stopping once no
+        unsearched cell could hold anything nearer.  Positions are as of the
+        last ``update()`` (or ``add()``.)
+        """
+        cdef float limit, reach
+        cdef int n, i, qx, qy, ring, max_ring, cx, cy, step
+        cdef hash_cell_s * cell
+        if k <= 0 or not self._ids:
+            return []
+        if max_dist is None:
+            limit = FLT_MAX
+        else:
+            limit = max_dist
+        _start_timing()
+        try:
+            found = []              # (distance squared, id)
+            n = len(self._objects)
+            self._next_stamp()
+            for i from 0 <= i < self.large.count:
+                self._nearest_visit(self.large.ids[i], x, y, limit, mask,
+                        found)
+            qx = _cell_coord(x, self.inv_cell_size)
+            qy = _cell_coord(y, self.inv_cell_size)
+            # Rings past this one don't touch any objects.
+            max_ring = 0
+            for i in (qx - _cell_coord(self.bounds[0], self.inv_cell_size),
+                    _cell_coord(self.bounds[2], self.inv_cell_size) - qx,
+                    qy - _cell_coord(self.bounds[1], self.inv_cell_size),
+                    _cell_coord(self.bounds[3], self.inv_cell_size) - qy):
+                if i > max_ring:
+                    max_ring = i
+            ring = 0
+            while ring <= max_ring:
+                if (2*ring + 1) * (2*ring + 1) > n:
+                    # Cheaper to look at everything that is left.
+                    for i from 0 <= i < n:
+                        if self.proxies[i].in_use:
+                            self._nearest_visit(i, x, y, limit, mask, found)
+                    break
+                for cx from qx - ring <= cx <= qx + ring:
+                    # Only the top and bottom of the middle columns are on
+                    # the ring.
+                    if cx == qx - ring or cx == qx + ring:
+                        step = 1
+                    else:
+                        step = 2 * ring
+                    cy = qy - ring
+                    while cy <= qy + ring:
+                        cell = self._find_cell(cx, cy, 0)
+                        if cell != NULL:
+                            for i from 0 <= i < cell.count:
+                                self._nearest_visit(cell.ids[i], x, y,
+                                        limit, mask, found)
+                        cy = cy + step
+                # Everything within this distance of (x, y) has been seen.
+                reach = ring * self.cell_size
+                if reach >= limit:
+                    break
+                if len(found) >= k:
+                    found.sort()
+                    del found[k:]
+                    if found[k-1][0] <= reach*reach:
+                        break
+                ring = ring + 1
+            found.sort()
+            return [(self._objects[i], sqrtf(d2)) for d2, i in found[:k]]
+        finally:
+            _stop_timing()
+
+    def query_rect(self, float left, float top, float right, float bottom,
+            unsigned int mask=ALL_LAYERS):
+        """
+        ``query_rect(left, top, right, bottom, mask=0xFFFFFFFF) -> list of objects``
+
+        Returns the objects whose bounds overlap the given rectangle.  Only
+        objects whose category shares a bit with ``mask`` are returned.
+
+        Positions are as of the last ``update()`` (or ``add()``.)
+        """
+        if right < left:
+            left, right = right, left
+        if top < bottom:
+            top, bottom = bottom, top
+        _start_timing()
+        try:
+            return self._query(left, bottom, right, top, NULL, mask)
+        finally:
+            _stop_timing()
+
+
+cdef object _cast(ray_s * ray, objects):
+    cdef SpatialHash world
+    cdef circle_s circle
+    cdef unsigned int category, mask
+    cdef int i
+    if isinstance(objects, SpatialHash):
+        world = objects
+        hits = world._raycast(ray)
+        objects = world._objects
+    else:
+        if not isinstance(objects, (list, tuple)):
+            objects = list(objects)
+        hits = []
+        for i from 0 <= i < len(objects):
+            o = objects[i]
+            if ray.mask != ALL_LAYERS:
+                _read_filter(o, 1, &category, &mask)
+                if (category & ray.mask) == 0:
+                    continue
+            _read_circle(o, &circle)
+            if circle.r < 0:
+                circle.r = -circle.r
+            _ray_visit(ray, o, &circle, i, hits)
+    if not ray.all_hits:
+        if ray.best == -1:
+            return None
+        return (objects[ray.best], ray.best_dist)
+    hits.sort()
+    return [(objects[i], t) for t, i in hits]
+
+def raycast(origin, direction, float max_dist, objects, all_hits=False,
+        use_shapes=False, unsigned int mask=ALL_LAYERS):
+    """
+    ``raycast(origin, direction, max_dist, objects, all_hits=False, use_shapes=False, mask=0xFFFFFFFF)``
+
+    Casts a ray from the point ``origin`` along ``direction`` (which doesn't
+    need to be normalized) for ``max_dist``, and returns the nearest object
+    it hits as ``(object, distance)``, or ``None`` if it doesn't hit
+    anything.  ``max_dist`` can be ``float("inf")``.
+
+    If ``all_hits`` is true, a list of ``(object, distance)`` for every
+    object hit is returned instead, nearest first.
+
+    The distance is to where the ray enters the object, or ``0`` if
+    ``origin`` is inside it.
+
+    ``objects`` can be a list of objects, as for ``collide_single()``, or a
+    ``SpatialHash``.  With a ``SpatialHash`` only the cells along the ray are
+    looked at, (and when looking for the nearest hit, only until it is
+    found.)  Positions are as of its last ``update()``.
+
+    Objects are hit using their bounding circles.  If ``use_shapes`` is
+    true, sprites are also tested against their rotated and scaled shape,
+    as in ``obb_filter()``.
+
+    Only objects whose ``collision_category`` (or the category given to
+    ``SpatialHash.add()``) shares a bit with ``mask`` can be hit.
+    """
+    cdef ray_s ray
+    _start_timing()
+    try:
+        _init_ray(&ray, origin, direction, max_dist, all_hits, use_shapes,
+                mask)
+        return _cast(&ray, objects)
+    finally:
+        _stop_timing()
+
+def segment_query(start, end, objects, all_hits=False, use_shapes=False,
+        unsigned int mask=ALL_LAYERS):
+    """
+    ``segment_query(start, end, objects, all_hits=False, use_shapes=False, mask=0xFFFFFFFF)``
+
+    Like ``raycast()``, but for the line segment from ``start`` to ``end``.
+    Distances are measured from ``start``.
+    """
+    cdef float dx, dy, length
+    dx = end[0] - start[0]
+    dy = end[1] - start[1]
+    length = sqrtf(dx*dx + dy*dy)
+    if length == 0:
+        # Any direction will do; only objects around start can be hit.
+        dx = 1
+    return raycast(start, (dx, dy), length, objects, all_hits, use_shapes,
+            mask)
+
+__docs_all__ = ('collide', 'iter_collide', 'collide_single',
+        'collide_groups', 'aabb_collide', 'aabb_collide_single', 'aabb_collide_groups',
+        'rdc', 'brute_force', 'collide_arrays', 'brute_force_arrays',
+        'obb_filter', 'obb_collide', 'obb_collide_single',
+        'AlphaMask', 'set_alpha_mask', 'get_alpha_mask', 'remove_alpha_mask',
+        'pixel_filter', 'pixel_collide',
+        'raycast', 'segment_query', 'SweepAndPrune', 'SpatialHash')
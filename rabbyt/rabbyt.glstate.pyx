@@ -0,0 +1,275 @@
+"""
+This module keeps a shadow copy of the bits of OpenGL state that rabbyt
+touches while rendering: enabled texture targets (and ``GL_BLEND``), bound
+textures, the current color and the blend function.
+
+Calls that wouldn't change anything are skipped.  For example, a list of
+sprites sharing one texture only binds it once.
+
+All of rabbyt's render paths go through here.  If you override
+``render()`` or ``render_after_transform()`` in your own sprites you can use
+the functions in this module instead of calling OpenGL directly, which
+keeps the shadow state correct.  If you do call OpenGL directly (or use
+another library that does), call ``invalidate()`` afterwards.
+``render_unsorted()`` invalidates the state at the start of each call, and
+after each sprite that doesn't use the C render path, so you only need to
+worry about this when rendering sprites yourself.
+"""
+
+__credits__ = (
+"""
+Copyright (C) 2007  Matthew Marshall
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+""")
+
+__author__ = "Matthew Marshall <matthew@matthewmarshall.org>"
+
+cdef extern from "include_gl.h":
+    ctypedef float GLfloat
+    ctypedef unsigned int GLenum
+    ctypedef unsigned int GLuint
+
+    cdef void glEnable(GLenum cap)
+    cdef void glDisable(GLenum cap)
+    cdef void glBindTexture(GLenum target, GLuint texture)
+    cdef void glColor4fv(GLfloat *v)
+    cdef void glBlendFunc(GLenum sfactor, GLenum dfactor)
+
+from _anims cimport FrameStats, get_frame_stats
+
+cdef FrameStats * stats
+stats = get_frame_stats()
+
+# The number of different caps and texture targets we keep track of.  Rabbyt
+# only uses a couple of each; anything past these limits is passed straight
+# through to OpenGL.
+DEF MAX_CAPS = 8
+DEF MAX_TARGETS = 4
+
+DEF CALL_ENABLE = 0
+DEF CALL_BIND_TEXTURE = 1
+DEF CALL_COLOR = 2
+DEF CALL_BLEND_FUNC = 3
+DEF CALL_COUNT = 4
+
+cdef struct cap_s:
+    unsigned int cap
+    int enabled         # -1 if unknown
+
+cdef struct binding_s:
+    unsigned int target
+    unsigned int texture
+    int known
+
+cdef struct shadow_state_s:
+    int cap_count
+    cap_s caps[MAX_CAPS]
+    int binding_count
+    binding_s bindings[MAX_TARGETS]
+    int color_known
+    float color[4]
+    int blend_known
+    unsigned int sfactor, dfactor
+    unsigned long issued[CALL_COUNT]
+    unsigned long skipped[CALL_COUNT]
+
+cdef shadow_state_s state
+
+
+cdef int _set_cap(unsigned int cap, int enabled):
+    """
+    Updates the shadow state for ``cap``.  Returns 1 if the call has to be
+    made.
+    """
+    cdef int i
+    for i from 0 <= i < state.cap_count:
+        if state.caps[i].cap == cap:
+            if state.caps[i].enabled == enabled:
+                state.skipped[CALL_ENABLE] = state.skipped[CALL_ENABLE] + 1
+                return 0
+            state.caps[i].enabled = enabled
+            break
+    else:
+        if state.cap_count < MAX_CAPS:
+            state.caps[state.cap_count].cap = cap
+            state.caps[state.cap_count].enabled = enabled
+            state.cap_count = state.cap_count + 1
+    state.issued[CALL_ENABLE] = state.issued[CALL_ENABLE] + 1
+    return 1
+
+cdef void gl_enable(unsigned int cap):
+    if _set_cap(cap, 1):
+        glEnable(cap)
+
+cdef void gl_disable(unsigned int cap):
+    if _set_cap(cap, 0):
+        glDisable(cap)
+
+cdef void gl_bind_texture(unsigned int target, unsigned int texture):
+    cdef int i
+    for i from 0 <= i < state.binding_count:
+        if state.bindings[i].target == target:
+            if state.bindings[i].known and \
+                    state.bindings[i].texture == texture:
+                state.skipped[CALL_BIND_TEXTURE] = \
+                        state.skipped[CALL_BIND_TEXTURE] + 1
+                return
+            state.bindings[i].texture = texture
+            state.bindings[i].known = 1
+            break
+    else:
+        if state.binding_count < MAX_TARGETS:
+            state.bindings[state.binding_count].target = target
+            state.bindings[state.binding_count].texture = texture
+            state.bindings[state.binding_count].known = 1
+            state.binding_count = state.binding_count + 1
+    state.issued[CALL_BIND_TEXTURE] = state.issued[CALL_BIND_TEXTURE] + 1
+    if stats.enabled:
+        stats.texture_binds = stats.texture_binds + 1
+    glBindTexture(target, texture)
+
+cdef void gl_color4fv(float * color):
+    if state.color_known and state.color[0] == color[0] and \
+            state.color[1] == color[1] and state.color[2] == color[2] and \
+            state.color[3] == color[3]:
+        state.skipped[CALL_COLOR] = state.skipped[CALL_COLOR] + 1
+        return
+    state.color[0] = color[0]
+    state.color[1] = color[1]
+    state.color[2] = color[2]
+    state.color[3] = color[3]
+    state.color_known = 1
+    state.issued[CALL_COLOR] = state.issued[CALL_COLOR] + 1
+    glColor4fv(color)
+
+cdef void gl_blend_func(unsigned int sfactor, unsigned int dfactor):
+    if state.blend_known and state.sfactor == sfactor and \
+            state.dfactor == dfactor:
+        state.skipped[CALL_BLEND_FUNC] = state.skipped[CALL_BLEND_FUNC] + 1
+        return
+    state.sfactor = sfactor
+    state.dfactor = dfactor
+    state.blend_known = 1
+    state.issued[CALL_BLEND_FUNC] = state.issued[CALL_BLEND_FUNC] + 1
+    glBlendFunc(sfactor, dfactor)
+
+cdef void gl_forget_texture(unsigned int texture):
+    cdef int i
+    for i from 0 <= i < state.binding_count:
+        if state.bindings[i].texture == texture:
+            state.bindings[i].known = 0
+
+cdef void gl_invalidate():
+    cdef int i
+    for i from 0 <= i < state.cap_count:
+        state.caps[i].enabled = -1
+    for i from 0 <= i < state.binding_count:
+        state.bindings[i].known = 0
+    state.color_known = 0
+    state.blend_known = 0
+
+
+def enable(unsigned int cap):
+    """
+    ``enable(cap)``
+
+    ``glEnable(cap)``, unless ``cap`` is already enabled.
+    """
+    gl_enable(cap)
+
+def disable(unsigned int cap):
+    """
+    ``disable(cap)``
+
+    ``glDisable(cap)``, unless ``cap`` is already disabled.
+    """
+    gl_disable(cap)
+
+def bind_texture(unsigned int target, unsigned int texture):
+    """
+    ``bind_texture(target, texture)``
+
+    ``glBindTexture(target, texture)``, unless ``texture`` is already bound.
+    """
+    gl_bind_texture(target, texture)
+
+def color(rgba):
+    """
+    ``color(rgba)``
+
+    ``glColor4f(*rgba)``, unless that is already the current color.
+    """
+    cdef float c[4]
+    c[0], c[1], c[2], c[3] = rgba
+    gl_color4fv(c)
+
+def blend_func(unsigned int sfactor, unsigned int dfactor):
+    """
+    ``blend_func(sfactor, dfactor)``
+
+    ``glBlendFunc(sfactor, dfactor)``, unless it is already set.
+    """
+    gl_blend_func(sfactor, dfactor)
+
+def invalidate():
+    """
+    ``invalidate()``
+
+    Forgets everything known about the current OpenGL state, so that the
+    next call of each kind is always made.
+
+    Call this after anything other than rabbyt changes the state.
+    """
+    gl_invalidate()
+
+def get_counters():
+    """
+    ``get_counters() -> dict``
+
+    Returns how many calls have been issued and skipped since the last call
+    to ``reset_counters()``.
+
+    The result maps the names ``"enable"`` (which includes ``disable``),
+    ``"bind_texture"``, ``"color"`` and ``"blend_func"`` to
+    ``(issued, skipped)`` tuples.
+    """
+    return {
+        "enable": (state.issued[CALL_ENABLE], state.skipped[CALL_ENABLE]),
+        "bind_texture": (state.issued[CALL_BIND_TEXTURE],
+                state.skipped[CALL_BIND_TEXTURE]),
+        "color": (state.issued[CALL_COLOR], state.skipped[CALL_COLOR]),
+        "blend_func": (state.issued[CALL_BLEND_FUNC],
+                state.skipped[CALL_BLEND_FUNC]),
+    }
+
+def reset_counters():
+    """
+    ``reset_counters()``
+
+    Sets all counters back to zero.  Call this at the start of each frame to
+    get per-frame numbers from ``get_counters()``.
+    """
+    cdef int i
+    for i from 0 <= i < CALL_COUNT:
+        state.issued[i] = 0
+        state.skipped[i] = 0
+
+__docs_all__ = ('enable disable bind_texture color blend_func invalidate '
+        'get_counters reset_counters').split()
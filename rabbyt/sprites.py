@@ -1,5 +1,5 @@
 from rabbyt._sprites import cBaseSprite, cSprite
-from rabbyt._rabbyt import pick_texture_target
+from rabbyt import backends
 from rabbyt.anims import anim_slot, swizzle, Animable
 from rabbyt.primitives import Quad
 
@@ -116,7 +116,7 @@ class Sprite(cSprite, BaseSprite):
 
     def ensure_target(self):
         if not self.texture_target:
-            target = pick_texture_target()
+            target = backends.get_module().pick_texture_target()
             self.texture_target = target
 
     def _get_texture(self):
@@ -126,8 +126,7 @@ class Sprite(cSprite, BaseSprite):
         self._tex_obj = texture
         tex_size = None
         if isinstance(texture, str):
-            from rabbyt._rabbyt import load_texture_file_hook
-            res = load_texture_file_hook(texture)
+            res = backends.get_module().load_texture_file_hook(texture)
             if isinstance(res, tuple) and len(res) == 2:
                 self.texture_id, tex_size = res
             else:
@@ -153,6 +152,11 @@ class Sprite(cSprite, BaseSprite):
         if tex_size:
             w, h = tex_size
             self.shape = [-w/2, h/2, w/2, -h/2]
+
+        if self.texture_id:
+            # Pick the target now so that it doesn't have to be checked every
+            # time the sprite is rendered.
+            self.ensure_target()
     texture = property(_get_texture, _set_texture, doc=
         """
         ``Sprite.texture``
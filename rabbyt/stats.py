@@ -0,0 +1,186 @@
+"""
+This module collects per-frame statistics about what rabbyt is doing.
+
+Statistics are off by default, and cost nothing until they are turned on.
+To use them, call ``enable()`` once, and then wrap each frame in
+``begin_frame()`` and ``end_frame()``:
+
+    .. sourcecode:: python
+
+        rabbyt.stats.enable()
+
+        while running:
+            rabbyt.stats.begin_frame()
+            rabbyt.scheduler.pump()
+            collisions = rabbyt.collisions.collide(sprites)
+            rabbyt.render_unsorted(sprites)
+            frame = rabbyt.stats.end_frame()
+            print(frame.sprites_rendered, frame.render_time)
+
+``end_frame()`` returns a ``FrameStats`` record with the following fields:
+
+    ``sprites_rendered``, ``sprites_culled``
+        Sprites drawn, and sprites skipped because they were outside of a
+        ``Camera``'s view.
+
+    ``draw_calls``, ``texture_binds``, ``vertices``
+        OpenGL work submitted while rendering.  (Only texture binds that
+        weren't skipped by ``rabbyt.glstate`` are counted.)
+
+    ``anim_evaluations``
+        How many times an anim was evaluated to get the value of a slot.
+
+    ``render_time``, ``collision_time``, ``pump_time``
+        Wall time, in seconds, spent in the render functions, the functions
+        in ``rabbyt.collisions`` and ``Scheduler.pump()``.
+
+    ``frame_time``
+        Wall time between ``begin_frame()`` and ``end_frame()``.
+
+The records for the last few frames are kept in a ring buffer, which can be
+read with ``history()`` or written to a file with ``export()``.
+"""
+
+__credits__ = (
+"""
+Copyright (C) 2007  Matthew Marshall
+
+Permission is hereby granted, free of charge, to any person obtaining a copy
+of this software and associated documentation files (the "Software"), to deal
+in the Software without restriction, including without limitation the rights
+to use, copy, modify, merge, publish, distribute, sublicense, and/or sell
+copies of the Software, and to permit persons to whom the Software is
+furnished to do so, subject to the following conditions:
+
+The above copyright notice and this permission notice shall be included in
+all copies or substantial portions of the Software.
+
+THE SOFTWARE IS PROVIDED "AS IS", WITHOUT WARRANTY OF ANY KIND, EXPRESS OR
+IMPLIED, INCLUDING BUT NOT LIMITED TO THE WARRANTIES OF MERCHANTABILITY,
+FITNESS FOR A PARTICULAR PURPOSE AND NONINFRINGEMENT. IN NO EVENT SHALL THE
+AUTHORS OR COPYRIGHT HOLDERS BE LIABLE FOR ANY CLAIM, DAMAGES OR OTHER
+LIABILITY, WHETHER IN AN ACTION OF CONTRACT, TORT OR OTHERWISE, ARISING FROM,
+OUT OF OR IN CONNECTION WITH THE SOFTWARE OR THE USE OR OTHER DEALINGS IN
+THE SOFTWARE.
+""")
+
+__author__ = "Matthew Marshall <matthew@matthewmarshall.org>"
+
+from collections import deque, namedtuple
+from time import perf_counter as clock
+
+from rabbyt._anims import _set_frame_stats_enabled, _reset_frame_stats, \
+        _get_frame_stats
+
+FrameStats = namedtuple("FrameStats", [
+        "sprites_rendered", "sprites_culled", "draw_calls", "texture_binds",
+        "vertices", "anim_evaluations", "render_time", "collision_time",
+        "pump_time", "frame_time"])
+
+# Read by Scheduler.pump() (and anything else timed from python.)
+enabled = False
+pump_time = 0.0
+
+_history = deque(maxlen=120)
+_frame_start = None
+
+def enable(history_length=None):
+    """
+    ``enable([history_length])``
+
+    Starts collecting statistics.
+
+    ``history_length`` is the number of frames kept by ``history()``.  It
+    defaults to ``120``, (or whatever it was set to last.)
+    """
+    global enabled, _history
+    if history_length is not None:
+        _history = deque(_history, maxlen=history_length)
+    enabled = True
+    _set_frame_stats_enabled(True)
+
+def disable():
+    """
+    ``disable()``
+
+    Stops collecting statistics.  The history is kept.
+    """
+    global enabled
+    enabled = False
+    _set_frame_stats_enabled(False)
+
+def begin_frame():
+    """
+    ``begin_frame()``
+
+    Resets the counters for a new frame.
+    """
+    global pump_time, _frame_start
+    _reset_frame_stats()
+    pump_time = 0.0
+    _frame_start = clock()
+
+def end_frame():
+    """
+    ``end_frame() -> FrameStats``
+
+    Finishes the frame started by ``begin_frame()``, adds it to the history
+    and returns it.
+    """
+    if _frame_start is None:
+        raise RuntimeError("end_frame() called before begin_frame()")
+    frame = current(clock() - _frame_start)
+    _history.append(frame)
+    return frame
+
+def current(frame_time=0.0):
+    """
+    ``current() -> FrameStats``
+
+    Returns the statistics collected so far in this frame, without ending it.
+    """
+    return FrameStats(pump_time=pump_time, frame_time=frame_time,
+            **_get_frame_stats())
+
+def history():
+    """
+    ``history() -> list of FrameStats``
+
+    Returns the recorded frames, oldest first.
+    """
+    return list(_history)
+
+def clear_history():
+    """
+    ``clear_history()``
+
+    Forgets all recorded frames.
+    """
+    _history.clear()
+
+def export(file, format="csv"):
+    """
+    ``export(file, format="csv")``
+
+    Writes ``history()`` to ``file``, which can be a filename or a file
+    object open for writing text.
+
+    ``format`` can be ``"csv"`` (with a header row) or ``"json"`` (a list of
+    objects.)
+    """
+    if isinstance(file, str):
+        with open(file, "w") as f:
+            return export(f, format)
+    if format == "csv":
+        import csv
+        writer = csv.writer(file)
+        writer.writerow(FrameStats._fields)
+        writer.writerows(_history)
+    elif format == "json":
+        import json
+        json.dump([frame._asdict() for frame in _history], file)
+    else:
+        raise ValueError("format must be 'csv' or 'json'")
+
+__docs_all__ = ('enable disable begin_frame end_frame current history '
+        'clear_history export FrameStats').split()
@@ -84,13 +84,15 @@ setup(
             libraries=['GL', 'GLU', 'm']),
         Extension("rabbyt._anims", ["rabbyt/rabbyt._anims.pyx",
                 "rabbyt/anim_sys.c"],
-            libraries=['GL', 'GLU', 'm']),
+            libraries=['m']),
         Extension("rabbyt._sprites", ["rabbyt/rabbyt._sprites.pyx"],
-            libraries=['GL', 'm']),
+            libraries=['m']),
+        Extension("rabbyt.glstate", ["rabbyt/rabbyt.glstate.pyx"],
+            libraries=['GL']),
         Extension("rabbyt.collisions", ["rabbyt/rabbyt.collisions.pyx"],
             libraries=['m']),
         Extension("rabbyt.primitives", ["rabbyt/rabbyt.primitives.pyx"],
-            libraries=['GL', 'm']),
+            libraries=['m']),
     ],
     use_2to3=False,
 
@@ -1,4 +1,5 @@
 import unittest
+import rabbyt
 import rabbyt.anims
 from rabbyt.anims import *
 import weakref
@@ -213,6 +214,63 @@ class TestAnimable(unittest.TestCase):
         #self.assertRaises(RuntimeError, lambda:self.sprite.x)
         self.assertEqual(0, self.sprite.x)
 
+class TestAnimComplete(unittest.TestCase):
+    def setUp(self):
+        class Sprite(Animable):
+            x = anim_slot()
+        self.sprite = Sprite()
+        self.calls = []
+
+    def make_anim(self):
+        # The anim is freed along with its dependencies, so watch one of
+        # those.
+        class Start(object):
+            def __call__(self):
+                return 0
+        start = Start()
+        self.start_ref = weakref.ref(start)
+        return lerp(AnimPyFunc(start), 1, startt=0, endt=1)
+
+    def test_release(self):
+        set_time(0)
+        self.sprite.x = self.make_anim()
+        self.assertNotEqual(self.start_ref(), None)
+        set_time(2)
+        self.assertEqual(self.sprite.x, 1)
+        self.assertEqual(self.start_ref(), None)
+        self.assertEqual(type(self.sprite).x.get_slot(self.sprite).anim,
+                None)
+        set_time(3)
+        self.assertEqual(self.sprite.x, 1)
+
+    def test_release_on_set(self):
+        set_time(0)
+        self.sprite.x = self.make_anim()
+        self.sprite.x = 5
+        self.assertEqual(self.start_ref(), None)
+        self.assertEqual(self.sprite.x, 5)
+
+    def test_on_complete(self):
+        scheduler = rabbyt.Scheduler()
+        a = lerp(0, 1, startt=0, endt=10)
+        a.on_complete(lambda: self.calls.append("a"), scheduler)
+        scheduler.pump(9)
+        self.assertEqual(self.calls, [])
+        scheduler.pump(10)
+        self.assertEqual(self.calls, ["a"])
+
+    def test_on_complete_chain(self):
+        scheduler = rabbyt.Scheduler()
+        c = chain(lerp(0, 1, startt=0, endt=5), lerp(1, 2, startt=5, endt=20))
+        self.assertEqual(c.end_time, 20)
+        timer = c.on_complete(lambda: self.calls.append("c"), scheduler)
+        self.assertEqual(timer.time, 20)
+        scheduler.pump(20)
+        self.assertEqual(self.calls, ["c"])
+
+    def test_on_complete_no_end(self):
+        self.assertRaises(TypeError, AnimConst(1).on_complete, lambda: None)
+
 class TestAnimConst(unittest.TestCase):
     def test(self):
         a = AnimConst(6)
@@ -416,6 +474,55 @@ class Test_extend(unittest.TestCase):
             self.assertAlmostEqual(l.get(), v,
                     msg="Expected %f not %f (time %f)" % (v, l.get(), t))
 
+class TestProfiling(unittest.TestCase):
+    def setUp(self):
+        set_time(0)
+        reset_anim_profile()
+        enable_anim_profiling()
+
+    def tearDown(self):
+        disable_anim_profiling()
+        reset_anim_profile()
+
+    def test_counts(self):
+        l = lerp(0, 1, startt=0, endt=1)
+        a = l + 1
+        a.get()
+        add_time(.5)
+        a.get()
+        profile = dict((p.anim, p) for p in get_anim_profile())
+        self.assertEqual(profile[a].evaluations, 2)
+        self.assertEqual(profile[l].evaluations, 2)
+        self.assertTrue(profile[a].total_time >= profile[a].self_time)
+        self.assertEqual(profile[a].max_per_step, 1)
+
+    def test_repeated(self):
+        l = lerp(0, 1, startt=0, endt=1)
+        l.get()
+        l.get()
+        l.get()
+        p, = get_anim_profile()
+        self.assertEqual(p.max_per_step, 3)
+        self.assertEqual(p.repeated, 2)
+
+    def test_by_type(self):
+        a = lerp(0, 1, startt=0, endt=1) + lerp(1, 2, startt=0, endt=1)
+        a.get()
+        types = dict((p.type, p) for p in get_anim_profile(by_type=True))
+        self.assertEqual(types[rabbyt.anims.InterpolateAnim].anims, 2)
+        self.assertEqual(types[rabbyt.anims.ArithmeticAnim].evaluations, 1)
+
+    def test_top(self):
+        for i in range(5):
+            AnimPyFunc(lambda: 1).get()
+        self.assertEqual(len(get_anim_profile(top=2, sort="evaluations")), 2)
+        self.assertRaises(ValueError, get_anim_profile, sort="anim")
+
+    def test_disabled(self):
+        disable_anim_profiling()
+        lerp(0, 1, startt=0, endt=1).get()
+        self.assertEqual(get_anim_profile(), [])
+
 
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,91 @@
+import unittest
+import subprocess
+import sys
+
+import rabbyt
+import rabbyt.nullbackend
+from rabbyt import stats
+from rabbyt.sprites import Sprite
+
+
+class TestNullBackend(unittest.TestCase):
+    def setUp(self):
+        rabbyt.set_backend("null")
+        stats.clear_history()
+        stats.enable()
+        stats.begin_frame()
+
+    def tearDown(self):
+        stats.disable()
+        rabbyt.set_backend("gl")
+
+    def test_names(self):
+        self.assertEqual(rabbyt.get_backend(), "null")
+        self.assertIs(rabbyt.backends.get_module(), rabbyt.nullbackend)
+        self.assertIsInstance(rabbyt.Camera((10, 10)),
+                rabbyt.nullbackend.Camera)
+        rabbyt.set_backend("gl")
+        self.assertIsNot(rabbyt.backends.get_module(), rabbyt.nullbackend)
+        self.assertNotIsInstance(rabbyt.Camera((10, 10)),
+                rabbyt.nullbackend.Camera)
+
+    def test_unknown(self):
+        self.assertRaises(ValueError, rabbyt.set_backend, "directx")
+        self.assertEqual(rabbyt.get_backend(), "null")
+
+    def test_render(self):
+        sprites = [Sprite(x=0), Sprite(x=500)]
+        rabbyt.render_unsorted(sprites, rabbyt.Camera((100, 100)))
+        sprites[0].render()
+        frame = stats.end_frame()
+        self.assertEqual(frame.sprites_rendered, 2)
+        self.assertEqual(frame.sprites_culled, 1)
+        self.assertEqual(frame.vertices, 8)
+        self.assertEqual(frame.draw_calls, 0)
+
+    def test_camera(self):
+        camera = rabbyt.Camera((100, 50), x=10, zoom=2)
+        self.assertEqual(camera.bounds, (-15, 12.5, 35, -12.5))
+        visible = Sprite(x=0)
+        self.assertEqual(camera.cull([visible, Sprite(x=60)]), [visible])
+        self.assertTrue(camera.is_visible(Sprite(x=40)))
+        self.assertFalse(camera.is_visible(Sprite(x=60)))
+
+    def test_textures(self):
+        a = rabbyt.load_texture(b"\0" * 16, (2, 2))
+        b = rabbyt.load_texture(b"\0" * 16, (2, 2))
+        self.assertNotEqual(a, b)
+        sprite = Sprite(a, shape=(-1, 1, 1, -1))
+        self.assertEqual(sprite.texture_id, a)
+        self.assertEqual(sprite.right, 1)
+
+    def test_texture_masks(self):
+        opaque = b"\xff" * 16
+        clear = b"\xff\xff\xff\x00" * 4
+        texture_id = rabbyt.load_texture(opaque, (2, 2))
+        rabbyt.collisions.set_alpha_mask(texture_id, opaque, (2, 2), 64)
+        rabbyt.update_texture(texture_id, clear, (2, 2))
+        mask = rabbyt.collisions.get_alpha_mask(texture_id)
+        self.assertFalse(mask.get(0, 0))
+        self.assertEqual(mask.threshold, 64)
+        rabbyt.unload_texture(texture_id)
+        self.assertIsNone(rabbyt.collisions.get_alpha_mask(texture_id))
+
+    def test_headless(self):
+        # A fresh interpreter, so that nothing has been imported yet.
+        output = subprocess.check_output([sys.executable, "-c",
+                "import sys, rabbyt\n"
+                "rabbyt.set_backend('null')\n"
+                "s = rabbyt.Sprite(x=rabbyt.lerp(0, 10, dt=100))\n"
+                "rabbyt.collisions.collide([s, rabbyt.Sprite()])\n"
+                "rabbyt.render_unsorted([s])\n"
+                "s.render()\n"
+                "print(' '.join(sys.modules))"])
+        modules = output.decode().split()
+        self.assertIn("rabbyt.sprites", modules)
+        self.assertNotIn("rabbyt._rabbyt", modules)
+        self.assertNotIn("rabbyt.glstate", modules)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,60 @@
+from __future__ import division
+
+import unittest
+
+import rabbyt
+from rabbyt.sprites import Sprite
+
+
+class TestCameraBounds(unittest.TestCase):
+    def test_viewport_size(self):
+        c = rabbyt.Camera((640, 480))
+        self.assertEqual(c.viewport, (0, 0, 640, 480))
+        self.assertEqual(c.bounds, (-320, 240, 320, -240))
+
+    def test_viewport_rect(self):
+        c = rabbyt.Camera((320, 0, 640, 480))
+        self.assertEqual(c.bounds, (-160, 240, 160, -240))
+
+    def test_negative_viewport(self):
+        self.assertRaises(ValueError, rabbyt.Camera, (-1, 0, 10, 10))
+
+    def test_position(self):
+        c = rabbyt.Camera((100, 100), x=50, y=-50)
+        self.assertEqual(c.bounds, (0, 0, 100, -100))
+
+    def test_zoom(self):
+        c = rabbyt.Camera((100, 100), zoom=2)
+        self.assertEqual(c.bounds, (-25, 25, 25, -25))
+
+    def test_rot(self):
+        c = rabbyt.Camera((100, 100), rot=45)
+        l, t, r, b = c.bounds
+        self.assertAlmostEqual(r, 50 * 2**.5, 4)
+        self.assertAlmostEqual(t, 50 * 2**.5, 4)
+
+
+class TestCameraCull(unittest.TestCase):
+    def setUp(self):
+        self.camera = rabbyt.Camera((100, 100))
+        self.inside = Sprite(x=0, y=0)
+        self.edge = Sprite(x=55, y=0)
+        self.outside = Sprite(x=200, y=200)
+
+    def test_is_visible(self):
+        self.assertTrue(self.camera.is_visible(self.inside))
+        self.assertTrue(self.camera.is_visible(self.edge))
+        self.assertFalse(self.camera.is_visible(self.outside))
+
+    def test_cull(self):
+        sprites = [self.inside, self.edge, self.outside]
+        self.assertEqual(self.camera.cull(sprites), [self.inside, self.edge])
+        self.camera.xy = (200, 200)
+        self.assertEqual(self.camera.cull(sprites), [self.outside])
+
+    def test_non_sprites_are_visible(self):
+        self.assertTrue(self.camera.is_visible(object()))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,5 +1,8 @@
 import unittest
+import random
+import array
 
+import rabbyt
 import rabbyt.collisions
 
 class Rect(object):
@@ -54,5 +57,784 @@ class Test_aabb_collide_groups(unittest.TestCase):
         self.assertTrue((a[1], b[0]) in collisions)
         self.assertTrue((a[1], b[1]) in collisions)
 
+class Circle(object):
+    def __init__(self, x, y, r):
+        self.x = x
+        self.y = y
+        self.bounding_radius = r
+
+    @property
+    def bounding_radius_squared(self):
+        return self.bounding_radius ** 2
+
+    @property
+    def left(self):
+        return self.x - self.bounding_radius
+    @property
+    def right(self):
+        return self.x + self.bounding_radius
+    @property
+    def bottom(self):
+        return self.y - self.bounding_radius
+    @property
+    def top(self):
+        return self.y + self.bounding_radius
+
+def pair_set(pairs):
+    return set(frozenset((id(a), id(b))) for a, b in pairs)
+
+class Test_SweepAndPrune(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(1)
+        self.random = r
+        self.objects = [Circle(r.uniform(0, 200), r.uniform(0, 200),
+                r.uniform(1, 10)) for i in range(100)]
+
+    def move(self):
+        for o in self.objects:
+            o.x += self.random.uniform(-5, 5)
+            o.y += self.random.uniform(-5, 5)
+
+    def test_matches_collide(self):
+        world = rabbyt.collisions.SweepAndPrune(self.objects)
+        for frame in range(10):
+            self.assertEqual(pair_set(world.collide()),
+                    pair_set(rabbyt.collisions.collide(self.objects)))
+            self.move()
+
+    def test_aabb_matches_aabb_collide(self):
+        world = rabbyt.collisions.SweepAndPrune(self.objects, aabb=True)
+        for frame in range(10):
+            self.assertEqual(pair_set(world.collide()),
+                    pair_set(rabbyt.collisions.aabb_collide(self.objects)))
+            self.move()
+
+    def test_add_remove(self):
+        world = rabbyt.collisions.SweepAndPrune(self.objects[:50])
+        for o in self.objects[50:]:
+            world.add(o)
+        for o in self.objects[::3]:
+            world.remove(o)
+        remaining = [o for o in self.objects if o in world]
+        self.assertEqual(len(remaining), len(world))
+        self.move()
+        self.assertEqual(pair_set(world.collide()),
+                pair_set(rabbyt.collisions.collide(remaining)))
+        self.assertRaises(ValueError, world.remove, self.objects[0])
+        self.assertRaises(ValueError, world.add, self.objects[1])
+
+    def test_touching(self):
+        a = Circle(0, 0, 5)
+        b = Circle(20, 0, 5)
+        world = rabbyt.collisions.SweepAndPrune([a, b], aabb=True)
+        self.assertEqual(world.collide(), [])
+        b.x = 10
+        self.assertEqual(len(world.collide()), 1)
+
+class Test_SpatialHash(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(2)
+        self.random = r
+        self.objects = [Circle(r.uniform(0, 200), r.uniform(0, 200),
+                r.uniform(1, 10)) for i in range(100)]
+        # One big object, which doesn't go in the cells.
+        self.objects.append(Circle(100, 100, 80))
+
+    def test_matches_collide(self):
+        grid = rabbyt.collisions.SpatialHash(15, self.objects)
+        for frame in range(10):
+            self.assertEqual(pair_set(grid.collide()),
+                    pair_set(rabbyt.collisions.collide(self.objects)))
+            for o in self.objects:
+                o.x += self.random.uniform(-10, 10)
+                o.y += self.random.uniform(-10, 10)
+
+    def test_query_radius(self):
+        grid = rabbyt.collisions.SpatialHash(15, self.objects)
+        for x, y, r in [(50, 50, 20), (0, 0, 0), (100, 150, 200)]:
+            expected = rabbyt.collisions.collide_single((x, y, r),
+                    self.objects)
+            self.assertEqual(set(map(id, grid.query_radius(x, y, r))),
+                    set(map(id, expected)))
+
+    def test_query_rect(self):
+        grid = rabbyt.collisions.SpatialHash(15, self.objects)
+        rect = Rect(20, 80, 60, 40)
+        expected = rabbyt.collisions.aabb_collide_single(rect, self.objects)
+        self.assertEqual(set(map(id, grid.query_rect(20, 80, 60, 40))),
+                set(map(id, expected)))
+
+    def test_remove(self):
+        grid = rabbyt.collisions.SpatialHash(15, self.objects)
+        for o in self.objects[::2]:
+            grid.remove(o)
+        remaining = self.objects[1::2]
+        self.assertEqual(len(grid), len(remaining))
+        self.assertEqual(pair_set(grid.collide()),
+                pair_set(rabbyt.collisions.collide(remaining)))
+
+    def test_sprites(self):
+        from rabbyt.sprites import Sprite
+        sprites = [Sprite(x=0), Sprite(x=5), Sprite(x=100)]
+        grid = rabbyt.collisions.SpatialHash(20, sprites)
+        self.assertEqual(pair_set(grid.collide()),
+                pair_set([(sprites[0], sprites[1])]))
+        sprites[2].x = 10
+        self.assertEqual(len(grid.collide()), 3)
+
+    def test_bad_cell_size(self):
+        self.assertRaises(ValueError, rabbyt.collisions.SpatialHash, 0)
+
+class Test_sprite_fast_path(unittest.TestCase):
+    def setUp(self):
+        from rabbyt.sprites import Sprite
+        r = random.Random(3)
+        self.sprites = [Sprite(x=r.uniform(0, 300), y=r.uniform(0, 300),
+                scale=r.uniform(.5, 2)) for i in range(60)]
+        self.sprites[0].bounding_radius = 40
+        self.sprites[1].x = rabbyt.lerp(0, 100, startt=0, endt=1)
+        # The same objects, read through python attributes.
+        self.circles = [Circle(s.x, s.y, s.bounding_radius)
+                for s in self.sprites]
+
+    def indexes(self, pairs, objects):
+        index = dict((id(o), i) for i, o in enumerate(objects))
+        return set(frozenset((index[id(a)], index[id(b)]))
+                for a, b in pairs)
+
+    def test_collide(self):
+        self.assertEqual(
+                self.indexes(rabbyt.collisions.collide(self.sprites),
+                        self.sprites),
+                self.indexes(rabbyt.collisions.collide(self.circles),
+                        self.circles))
+
+    def test_brute_force(self):
+        self.assertEqual(
+                self.indexes(rabbyt.collisions.brute_force(self.sprites),
+                        self.sprites),
+                self.indexes(rabbyt.collisions.brute_force(self.circles),
+                        self.circles))
+
+    def test_collide_groups(self):
+        self.assertEqual(
+                self.indexes(rabbyt.collisions.collide_groups(
+                        self.sprites[:30], self.sprites[30:]), self.sprites),
+                self.indexes(rabbyt.collisions.collide_groups(
+                        self.circles[:30], self.circles[30:]), self.circles))
+
+    def test_collide_single(self):
+        found = rabbyt.collisions.collide_single(self.sprites[0],
+                self.sprites)
+        expected = rabbyt.collisions.collide_single(self.circles[0],
+                self.circles)
+        self.assertEqual([self.sprites.index(s) for s in found],
+                [self.circles.index(c) for c in expected])
+
+
+class Test_sweep_groups(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(5)
+        def make(n):
+            return [Circle(r.uniform(0, 500), r.uniform(0, 200),
+                    r.uniform(1, 10)) for i in range(n)]
+        self.a = make(80)
+        self.b = make(60)
+        self.threshold = rabbyt.collisions._group_sweep_threshold
+
+    def tearDown(self):
+        rabbyt.collisions._group_sweep_threshold = self.threshold
+
+    def both(self, function):
+        rabbyt.collisions._group_sweep_threshold = 1 << 30
+        brute = function(self.a, self.b)
+        rabbyt.collisions._group_sweep_threshold = 0
+        sweep = function(self.a, self.b)
+        self.assertTrue(len(brute) > 0)
+        self.assertEqual(sweep, brute)
+
+    def test_collide_groups(self):
+        self.both(rabbyt.collisions.collide_groups)
+
+    def test_aabb_collide_groups(self):
+        self.both(rabbyt.collisions.aabb_collide_groups)
+
+    def test_tall(self):
+        for o in self.a + self.b:
+            o.x, o.y = o.y, o.x
+        self.both(rabbyt.collisions.collide_groups)
+
+    def test_empty(self):
+        rabbyt.collisions._group_sweep_threshold = 0
+        self.assertEqual(rabbyt.collisions.collide_groups([], self.b), [])
+        self.assertEqual(rabbyt.collisions.aabb_collide_groups(self.a, []),
+                [])
+
+class Test_obb(unittest.TestCase):
+    def setUp(self):
+        from rabbyt.sprites import Sprite
+        # Two long, thin, parallel sprites at 45 degrees.  Their bounding
+        # boxes overlap, but they don't touch.
+        self.a = Sprite(shape=(-50, 2, 50, -2), rot=45)
+        self.b = Sprite(shape=(-50, 2, 50, -2), rot=45, x=20, y=-20)
+        # And one that crosses the first.
+        self.c = Sprite(shape=(-50, 2, 50, -2), rot=-45, x=10, y=10)
+
+    def test_filter(self):
+        pairs = rabbyt.collisions.aabb_collide([self.a, self.b, self.c])
+        self.assertEqual(len(pairs), 3)
+        self.assertEqual(pair_set(rabbyt.collisions.obb_filter(pairs)),
+                pair_set([(self.a, self.c), (self.b, self.c)]))
+
+    def test_obb_collide(self):
+        self.assertEqual(pair_set(rabbyt.collisions.obb_collide(
+                [self.a, self.b, self.c])),
+                pair_set([(self.a, self.c), (self.b, self.c)]))
+
+    def test_single(self):
+        self.assertEqual(rabbyt.collisions.obb_collide_single(self.a,
+                [self.b, self.c]), [self.c])
+
+    def test_rects(self):
+        rects = [Rect(0, 10, 10, 0), Rect(10, 20, 20, 10),
+                Rect(11, 20, 20, 11)]
+        self.assertEqual(pair_set(rabbyt.collisions.obb_collide(rects)),
+                pair_set(rabbyt.collisions.aabb_collide(rects)))
+
+    def test_scaled(self):
+        self.b.scale = 0.1
+        self.assertEqual(rabbyt.collisions.obb_collide_single(self.a,
+                [self.b]), [])
+        self.b.xy = (1, 1)
+        self.assertEqual(rabbyt.collisions.obb_collide_single(self.a,
+                [self.b]), [self.b])
+
+
+class Test_pixel(unittest.TestCase):
+    def setUp(self):
+        from rabbyt.sprites import Sprite
+        self.Sprite = Sprite
+        # An 8x8 texture whose left half is opaque.
+        data = b"".join(b"\xff\xff\xff" + (b"\xff" if x < 4 else b"\x00")
+                for y in range(8) for x in range(8))
+        self.mask = rabbyt.collisions.set_alpha_mask(1000, data, (8, 8))
+        self.a = self.sprite()
+
+    def tearDown(self):
+        rabbyt.collisions.remove_alpha_mask(1000)
+
+    def sprite(self, **kwargs):
+        return self.Sprite(texture=1000, shape=(-4, 4, 4, -4), **kwargs)
+
+    def collides(self, b):
+        return bool(rabbyt.collisions.pixel_filter([(self.a, b)]))
+
+    def test_mask(self):
+        self.assertEqual((self.mask.width, self.mask.height), (8, 8))
+        self.assertTrue(self.mask.get(3, 5))
+        self.assertFalse(self.mask.get(4, 5))
+        self.assertTrue(rabbyt.collisions.get_alpha_mask(1000) is self.mask)
+        self.assertRaises(ValueError, rabbyt.collisions.AlphaMask, b"", (2, 2))
+
+    def test_aligned(self):
+        # The opaque halves are at x = -4..0 and 2..6.
+        self.assertFalse(self.collides(self.sprite(x=6)))
+        self.assertTrue(rabbyt.collisions.obb_filter([(self.a,
+                self.sprite(x=6))]))
+        self.assertTrue(self.collides(self.sprite(x=3)))
+        self.assertFalse(self.collides(self.sprite(x=3, y=8)))
+
+    def test_rotated(self):
+        # Turned around, the opaque half is on the right.
+        self.assertFalse(self.collides(self.sprite(x=-6)))
+        self.assertTrue(self.collides(self.sprite(x=-6, rot=180)))
+        self.assertFalse(self.collides(self.sprite(x=6, rot=180)))
+        self.assertTrue(self.collides(self.sprite(x=3, rot=90)))
+
+    def test_scaled(self):
+        self.assertFalse(self.collides(self.sprite(x=4, scale=0.5)))
+        self.assertTrue(self.collides(self.sprite(x=1, scale=0.5)))
+
+    def test_stretched(self):
+        # A 2x64 texture with one opaque row and a 64x2 texture with one
+        # opaque column, both stretched over the same square, cross.
+        def pixel(opaque):
+            return b"\xff\xff\xff" + (b"\xff" if opaque else b"\x00")
+        rows = b"".join(pixel(y == 31) for y in range(64) for x in range(2))
+        columns = b"".join(pixel(x == 31) for y in range(2) for x in range(64))
+        rabbyt.collisions.set_alpha_mask(1001, rows, (2, 64))
+        rabbyt.collisions.set_alpha_mask(1002, columns, (64, 2))
+        try:
+            a = self.Sprite(texture=1001, shape=(-32, 32, 32, -32))
+            b = self.Sprite(texture=1002, shape=(-32, 32, 32, -32))
+            self.assertEqual(rabbyt.collisions.pixel_filter([(a, b)]),
+                    [(a, b)])
+            self.assertEqual(rabbyt.collisions.pixel_filter([(b, a)]),
+                    [(b, a)])
+        finally:
+            rabbyt.collisions.remove_alpha_mask(1001)
+            rabbyt.collisions.remove_alpha_mask(1002)
+
+    def test_atlas(self):
+        # Only the right, transparent, half of the texture is shown.
+        b = self.Sprite(texture=1000, shape=(-2, 4, 2, -4),
+                tex_shape=(0.5, 1, 1, 0))
+        solid = self.Sprite(shape=(-10, 10, 10, -10))
+        self.assertEqual(rabbyt.collisions.pixel_filter([(b, solid)]), [])
+        self.assertEqual(rabbyt.collisions.pixel_filter([(solid, b)]), [])
+        self.assertFalse(self.collides(b))
+        # The left half is opaque.
+        c = self.Sprite(texture=1000, shape=(-2, 4, 2, -4),
+                tex_shape=(0, 1, 0.5, 0))
+        self.assertTrue(rabbyt.collisions.pixel_filter([(c, solid)]))
+        self.assertTrue(self.collides(c))
+
+    def test_without_mask(self):
+        self.assertFalse(self.collides(self.Sprite(shape=(1, 1, 3, -1))))
+        self.assertTrue(self.collides(self.Sprite(shape=(-1, 1, 1, -1))))
+        self.assertFalse(self.collides(Rect(1, 1, 3, -1)))
+
+    def test_pixel_collide(self):
+        b = self.sprite(x=6)
+        c = self.sprite(x=3)
+        self.assertEqual(pair_set(rabbyt.collisions.pixel_collide(
+                [self.a, b, c])), pair_set([(self.a, c), (b, c)]))
+
+
+def as_array(typecode, rows):
+    """Packs ``rows`` into a 2d memoryview (so the tests don't need numpy.)"""
+    flat = array.array(typecode, [v for row in rows for v in row])
+    return memoryview(flat).cast("B").cast(typecode,
+            (len(rows), len(rows[0])))
+
+class Test_collide_arrays(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(4)
+        self.data = [(r.uniform(0, 300), r.uniform(0, 300), r.uniform(1, 10))
+                for i in range(200)]
+        circles = [Circle(*d) for d in self.data]
+        self.expected = set(tuple(sorted((circles.index(a),
+                circles.index(b)))) for a, b in
+                rabbyt.collisions.collide(circles))
+
+    def pairs(self, result):
+        return set(tuple(p) for p in result.tolist())
+
+    def test_rows(self):
+        for typecode in "fd":
+            result = rabbyt.collisions.collide_arrays(
+                    as_array(typecode, self.data))
+            self.assertEqual(result.shape[1], 2)
+            self.assertEqual(self.pairs(result), self.expected)
+
+    def test_columns(self):
+        columns = [array.array("d", c) for c in zip(*self.data)]
+        result = rabbyt.collisions.collide_arrays(columns)
+        self.assertEqual(self.pairs(result), self.expected)
+
+    def test_brute_force(self):
+        result = rabbyt.collisions.brute_force_arrays(
+                as_array("f", self.data))
+        self.assertEqual(self.pairs(result), self.expected)
+
+    def test_out(self):
+        out = as_array("i", [(0, 0)] * 1000)
+        result = rabbyt.collisions.collide_arrays(as_array("f", self.data),
+                out)
+        self.assertEqual(self.pairs(result), self.expected)
+        self.assertEqual(result.obj, out.obj)
+
+    def test_out_long(self):
+        # numpy's int32 has the format "l" on Windows, where long is 32 bits.
+        out = as_array("l", [(0, 0)] * 1000)
+        data = as_array("f", self.data)
+        if out.itemsize == 4:
+            result = rabbyt.collisions.collide_arrays(data, out)
+            self.assertEqual(self.pairs(result), self.expected)
+        else:
+            self.assertRaises(ValueError, rabbyt.collisions.collide_arrays,
+                    data, out)
+
+    def test_out_too_small(self):
+        out = as_array("i", [(0, 0)])
+        self.assertRaises(ValueError, rabbyt.collisions.collide_arrays,
+                as_array("f", self.data), out)
+
+    def test_no_radius(self):
+        result = rabbyt.collisions.collide_arrays(
+                as_array("f", [(0, 0), (0, 0), (5, 5)]))
+        self.assertEqual(result.tolist(), [])
+
+    def test_bad_format(self):
+        self.assertRaises(TypeError, rabbyt.collisions.collide_arrays,
+                as_array("i", [(0, 0, 1)]))
+
+    def test_threads(self):
+        data = as_array("f", self.data)
+        for function in (rabbyt.collisions.collide_arrays,
+                rabbyt.collisions.brute_force_arrays):
+            expected = function(data).tolist()
+            for threads in (2, 3, 64, 0):
+                self.assertEqual(function(data, threads=threads).tolist(),
+                        expected)
+        out = as_array("i", [(0, 0)] * 1000)
+        result = rabbyt.collisions.collide_arrays(data, out, threads=4)
+        self.assertEqual(result.tolist(),
+                rabbyt.collisions.collide_arrays(data).tolist())
+
+    def test_collide_threads(self):
+        circles = [Circle(*d) for d in self.data]
+        expected = rabbyt.collisions.collide(circles)
+        for threads in (2, 3, 64, 0, None):
+            self.assertEqual(rabbyt.collisions.collide(circles,
+                    threads=threads), expected)
+        self.assertRaises(ValueError, rabbyt.collisions.collide, circles,
+                threads=-1)
+
+    def test_threads_one_group(self):
+        # Everything overlaps, so rdc() can't split the circles; the rows of
+        # the one group are split between the threads instead.
+        r = random.Random(7)
+        rows = [(r.uniform(0, 20), r.uniform(0, 20), 15) for i in range(300)]
+        circles = [Circle(*row) for row in rows]
+        data = as_array("f", rows)
+        expected = rabbyt.collisions.collide(circles)
+        expected_arrays = rabbyt.collisions.collide_arrays(data).tolist()
+        for threads in (2, 3, 64):
+            self.assertEqual(rabbyt.collisions.collide(circles,
+                    threads=threads), expected)
+            self.assertEqual(rabbyt.collisions.collide_arrays(data,
+                    threads=threads).tolist(), expected_arrays)
+
+    def test_callback(self):
+        data = as_array("f", self.data)
+        for function in (rabbyt.collisions.collide_arrays,
+                rabbyt.collisions.brute_force_arrays):
+            expected = function(data).tolist()
+            for batch_size in (1, 7, 100000):
+                batches = []
+                self.assertEqual(function(data, callback=batches.append,
+                        batch_size=batch_size), None)
+                self.assertTrue(all(len(b) == batch_size
+                        for b in batches[:-1]))
+                self.assertEqual(sum((b.tolist() for b in batches), []),
+                        expected)
+        self.assertRaises(ValueError, rabbyt.collisions.collide_arrays, data,
+                as_array("i", [(0, 0)]), callback=len)
+        self.assertRaises(ValueError, rabbyt.collisions.collide_arrays, data,
+                callback=len, batch_size=0)
+
+    def test_few_objects(self):
+        circles = [Circle(0, 0, 5), Circle(3, 0, 5), Circle(50, 0, 5)]
+        self.assertEqual(rabbyt.collisions.collide(circles),
+                [(circles[0], circles[1])])
+        self.assertEqual(rabbyt.collisions.collide_arrays(
+                as_array("f", [(0, 0, 5), (3, 0, 5), (50, 0, 5)])).tolist(),
+                [[0, 1]])
+
+    def test_iter_collide(self):
+        circles = [Circle(*d) for d in self.data]
+        groups = list(rabbyt.collisions.iter_collide(circles))
+        self.assertTrue(all(groups))
+        self.assertEqual(sum(groups, []), rabbyt.collisions.collide(circles))
+
+    def test_iter_collide_remove(self):
+        # Objects removed from the list while iterating (say, killed when
+        # hit) are still the ones that collided.
+        circles = [Circle(i * 100 + x, 0, 5) for i in range(15)
+                for x in (0, 3)]
+        expected = rabbyt.collisions.collide(circles)
+        found = []
+        for group in rabbyt.collisions.iter_collide(circles):
+            found.extend(group)
+            circles.remove(group[0][0])
+        self.assertEqual(found, expected)
+        self.assertEqual(len(circles), 15)
+
+
+def layers_match(a, b):
+    return bool(a.collision_category & b.collision_mask and
+            b.collision_category & a.collision_mask)
+
+class Test_layers(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(6)
+        self.objects = []
+        for i in range(150):
+            o = Circle(r.uniform(0, 200), r.uniform(0, 200), r.uniform(1, 10))
+            o.collision_category = r.choice([1, 2, 4])
+            o.collision_mask = r.choice([1, 2, 4, 3, 6, 0xFFFFFFFF])
+            self.objects.append(o)
+        self.threshold = rabbyt.collisions._group_sweep_threshold
+
+    def tearDown(self):
+        rabbyt.collisions._group_sweep_threshold = self.threshold
+
+    def check(self, function, *args):
+        everything = function(*args)
+        expected = [p for p in everything if layers_match(*p)]
+        self.assertTrue(0 < len(expected) < len(everything))
+        self.assertEqual(function(*args, use_masks=True), expected)
+
+    def test_collide(self):
+        self.check(rabbyt.collisions.collide, self.objects)
+        self.check(rabbyt.collisions.brute_force, self.objects)
+        self.check(rabbyt.collisions.aabb_collide, self.objects)
+
+    def test_groups(self):
+        a, b = self.objects[:70], self.objects[70:]
+        for threshold in (0, 1 << 30):
+            rabbyt.collisions._group_sweep_threshold = threshold
+            self.check(rabbyt.collisions.collide_groups, a, b)
+            self.check(rabbyt.collisions.aabb_collide_groups, a, b)
+
+    def test_single(self):
+        single = Circle(100, 100, 60)
+        single.collision_category = 2
+        single.collision_mask = 1
+        for function in (rabbyt.collisions.collide_single,
+                rabbyt.collisions.aabb_collide_single):
+            everything = function(single, self.objects)
+            self.assertEqual(function(single, self.objects, use_masks=True),
+                    [o for o in everything if layers_match(single, o)])
+
+    def test_sprite(self):
+        from rabbyt.sprites import Sprite
+        a = Sprite(shape=(-5, 5, 5, -5))
+        b = Sprite(shape=(-5, 5, 5, -5), x=2)
+        self.assertEqual(a.collision_category, 1)
+        self.assertEqual(a.collision_mask, 0xFFFFFFFF)
+        self.assertEqual(len(rabbyt.collisions.brute_force([a, b], True)), 1)
+        a.collision_mask = 2
+        self.assertEqual(rabbyt.collisions.brute_force([a, b], True), [])
+        self.assertEqual(len(rabbyt.collisions.brute_force([a, b])), 1)
+        b.collision_category = 3
+        self.assertEqual(len(rabbyt.collisions.obb_collide([a, b], True)), 1)
+
+    def test_sweep_and_prune(self):
+        expected = pair_set(rabbyt.collisions.collide(self.objects, True))
+        world = rabbyt.collisions.SweepAndPrune(self.objects)
+        self.assertEqual(pair_set(world.collide()), expected)
+
+        o = self.objects[0]
+        world.set_filter(o, mask=0)
+        self.assertEqual(pair_set(world.collide()), set(p for p in expected
+                if id(o) not in p))
+        world.set_filter(o)
+        self.assertEqual(pair_set(world.collide()), expected)
+
+    def test_spatial_hash(self):
+        world = rabbyt.collisions.SpatialHash(20, self.objects)
+        self.assertEqual(pair_set(world.collide()),
+                pair_set(rabbyt.collisions.collide(self.objects, True)))
+        found = world.query_radius(100, 100, 50, mask=2)
+        self.assertTrue(found)
+        self.assertEqual(found, [o for o in world.query_radius(100, 100, 50)
+                if o.collision_category == 2])
+
+    def test_arrays(self):
+        data = as_array("f", [(o.x, o.y, o.bounding_radius)
+                for o in self.objects])
+        categories = array.array("I", [o.collision_category
+                for o in self.objects])
+        masks = array.array("I", [o.collision_mask for o in self.objects])
+        expected = set(tuple(sorted((self.objects.index(a),
+                self.objects.index(b)))) for a, b in
+                rabbyt.collisions.collide(self.objects, True))
+        for function in (rabbyt.collisions.collide_arrays,
+                rabbyt.collisions.brute_force_arrays):
+            result = function(data, categories=categories, masks=masks)
+            self.assertEqual(set(tuple(p) for p in result.tolist()),
+                    expected)
+        self.assertRaises(ValueError, rabbyt.collisions.collide_arrays,
+                data, categories=categories[:5])
+
+
+class Test_contacts(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(7)
+        self.random = r
+        self.objects = [Circle(r.uniform(0, 200), r.uniform(0, 200),
+                r.uniform(1, 10)) for i in range(100)]
+        self.worlds = [rabbyt.collisions.SweepAndPrune(self.objects),
+                rabbyt.collisions.SpatialHash(20, self.objects)]
+
+    def test_changes(self):
+        for world in self.worlds:
+            previous = set()
+            for frame in range(5):
+                current = pair_set(rabbyt.collisions.collide(self.objects))
+                began, persisting, ended = world.contacts(persisting=True)
+                self.assertEqual(pair_set(began), current - previous)
+                self.assertEqual(pair_set(persisting), current & previous)
+                self.assertEqual(pair_set(ended), previous - current)
+                previous = current
+                for o in self.objects:
+                    o.x += self.random.uniform(-5, 5)
+                    o.y += self.random.uniform(-5, 5)
+
+    def test_callbacks(self):
+        a, b = Circle(0, 0, 5), Circle(3, 0, 5)
+        world = rabbyt.collisions.SpatialHash(10, [a, b])
+        events = []
+        def on_begin(x, y):
+            events.append("begin")
+        def on_end(x, y):
+            events.append("end")
+        self.assertEqual(len(world.contacts(on_begin=on_begin,
+                on_end=on_end)[0]), 1)
+        self.assertEqual(world.contacts(on_begin=on_begin, on_end=on_end),
+                ([], []))
+        b.x = 30
+        world.contacts(on_begin=on_begin, on_end=on_end)
+        self.assertEqual(events, ["begin", "end"])
+
+    def test_remove(self):
+        for world in self.worlds:
+            world.contacts()
+            o = rabbyt.collisions.collide(self.objects)[0][0]
+            others = [p for p in self.objects if p is not o]
+            expected = pair_set((o, p) for p in
+                    rabbyt.collisions.collide_single(o, others))
+            world.remove(o)
+            world.add(Circle(-500, -500, 1))
+            began, ended = world.contacts()
+            self.assertEqual(began, [])
+            self.assertEqual(pair_set(ended), expected)
+
+
+class Test_raycast(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(8)
+        self.objects = [Circle(r.uniform(0, 500), r.uniform(0, 500),
+                r.uniform(1, 10)) for i in range(300)]
+        self.hash = rabbyt.collisions.SpatialHash(20, self.objects)
+
+    def brute(self, origin, direction, max_dist):
+        """Samples points along the ray to find which circles it hits."""
+        length = (direction[0]**2 + direction[1]**2) ** .5
+        dx, dy = direction[0] / length, direction[1] / length
+        hit = set()
+        t = 0
+        while t <= max_dist:
+            x, y = origin[0] + dx*t, origin[1] + dy*t
+            for o in self.objects:
+                if (o.x-x)**2 + (o.y-y)**2 < (o.bounding_radius - .01)**2:
+                    hit.add(id(o))
+            t += .25
+        return hit
+
+    def test_simple(self):
+        objects = [(10, 0, 2), (30, 0, 5), (20, 20, 5)]
+        obj, dist = rabbyt.collisions.raycast((0, 0), (1, 0), 100, objects)
+        self.assertEqual(obj, (10, 0, 2))
+        self.assertAlmostEqual(dist, 8, 4)
+        hits = rabbyt.collisions.raycast((0, 0), (2, 0), 100, objects,
+                all_hits=True)
+        self.assertEqual([o for o, d in hits], [(10, 0, 2), (30, 0, 5)])
+        self.assertAlmostEqual(hits[1][1], 25, 4)
+        self.assertEqual(rabbyt.collisions.raycast((0, 0), (1, 0), 5,
+                objects), None)
+        self.assertEqual(rabbyt.collisions.raycast((0, 0), (-1, 0), 100,
+                objects), None)
+        self.assertEqual(rabbyt.collisions.raycast((29, 1), (0, 1), 1,
+                objects), ((30, 0, 5), 0))
+
+    def test_matches_list(self):
+        r = random.Random(9)
+        for i in range(50):
+            origin = (r.uniform(-100, 600), r.uniform(-100, 600))
+            direction = (r.uniform(-1, 1), r.uniform(-1, 1))
+            max_dist = r.choice([50, 300, float("inf")])
+            expected = rabbyt.collisions.raycast(origin, direction, max_dist,
+                    self.objects, all_hits=True)
+            self.assertEqual(rabbyt.collisions.raycast(origin, direction,
+                    max_dist, self.hash, all_hits=True), expected)
+            nearest = rabbyt.collisions.raycast(origin, direction, max_dist,
+                    self.hash)
+            self.assertEqual(nearest, expected[0] if expected else None)
+
+    def test_brute(self):
+        origin, direction = (0, 10), (1, 0.9)
+        hits = rabbyt.collisions.raycast(origin, direction, 400,
+                self.objects, all_hits=True)
+        self.assertTrue(hits)
+        self.assertTrue(self.brute(origin, direction, 400) <=
+                set(id(o) for o, d in hits))
+
+    def test_segment(self):
+        objects = [(10, 0, 2), (30, 0, 5)]
+        self.assertEqual(rabbyt.collisions.segment_query((0, 0), (20, 0),
+                objects, all_hits=True), [((10, 0, 2), 8)])
+        self.assertEqual(rabbyt.collisions.segment_query((30, 1), (30, 1),
+                objects), ((30, 0, 5), 0))
+
+    def test_mask(self):
+        a, b = Circle(10, 0, 2), Circle(20, 0, 2)
+        a.collision_category = 2
+        self.assertEqual(rabbyt.collisions.raycast((0, 0), (1, 0), 100,
+                [a, b], mask=1)[0], b)
+
+    def test_shapes(self):
+        from rabbyt.sprites import Sprite
+        # A long thin sprite at 45 degrees.  Its bounding circle is hit, but
+        # the sprite itself isn't.
+        s = Sprite(shape=(-50, 2, 50, -2), rot=45)
+        self.assertEqual(rabbyt.collisions.raycast((-30, -10), (1, 1), 100,
+                [s])[0], s)
+        self.assertEqual(rabbyt.collisions.raycast((-30, -10), (1, 1), 100,
+                [s], use_shapes=True), None)
+        s2, dist = rabbyt.collisions.raycast((-30, 0), (1, 0), 100, [s],
+                use_shapes=True)
+        self.assertAlmostEqual(dist, 30 - 2 * 2 ** .5, 3)
+
+
+class Test_nearest(unittest.TestCase):
+    def setUp(self):
+        r = random.Random(10)
+        self.random = r
+        self.objects = [Circle(r.uniform(0, 500), r.uniform(0, 500),
+                r.uniform(1, 10)) for i in range(400)]
+        self.objects.append(Circle(250, 250, 200))
+        self.hash = rabbyt.collisions.SpatialHash(20, self.objects)
+
+    def brute(self, x, y, k, max_dist=float("inf")):
+        d = sorted(((o.x-x)**2 + (o.y-y)**2, i) for i, o in
+                enumerate(self.objects))
+        return [self.objects[i] for d2, i in d[:k] if d2**.5 <= max_dist]
+
+    def test_matches_brute_force(self):
+        r = self.random
+        for i in range(50):
+            x, y = r.uniform(-100, 600), r.uniform(-100, 600)
+            k = r.choice([1, 3, 10])
+            result = self.hash.nearest(x, y, k)
+            self.assertEqual([o for o, d in result], self.brute(x, y, k))
+            self.assertEqual([d for o, d in result],
+                    sorted(d for o, d in result))
+
+    def test_max_dist(self):
+        result = self.hash.nearest(100, 100, 1000, max_dist=30)
+        self.assertEqual([o for o, d in result],
+                self.brute(100, 100, 1000, 30))
+
+    def test_moved(self):
+        o = self.objects[0]
+        o.x, o.y = 1000, 1000
+        self.hash.update()
+        self.assertEqual(self.hash.nearest(990, 990)[0][0], o)
+
+    def test_mask(self):
+        o = Circle(1, 1, 1)
+        self.hash.add(o, category=4)
+        [(found, distance)] = self.hash.nearest(0, 0, mask=4)
+        self.assertEqual(found, o)
+        self.assertAlmostEqual(distance, 2**.5, 5)
+
+    def test_empty(self):
+        world = rabbyt.collisions.SpatialHash(10)
+        self.assertEqual(world.nearest(0, 0), [])
+
+
 if __name__=="__main__":
     unittest.main()
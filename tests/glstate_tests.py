@@ -0,0 +1,48 @@
+import unittest
+
+import rabbyt
+from rabbyt import glstate
+from rabbyt.sprites import Sprite
+
+GL_BLEND = 0x0BE2
+GL_TEXTURE_2D = 0x0DE1
+
+class TestGLState(unittest.TestCase):
+    def setUp(self):
+        glstate.invalidate()
+        glstate.reset_counters()
+
+    def test_enable_skipped(self):
+        glstate.enable(GL_BLEND)
+        glstate.enable(GL_BLEND)
+        self.assertEqual(glstate.get_counters()["enable"], (1, 1))
+        glstate.disable(GL_BLEND)
+        self.assertEqual(glstate.get_counters()["enable"], (2, 1))
+
+    def test_invalidate(self):
+        glstate.bind_texture(GL_TEXTURE_2D, 3)
+        glstate.invalidate()
+        glstate.bind_texture(GL_TEXTURE_2D, 3)
+        self.assertEqual(glstate.get_counters()["bind_texture"], (2, 0))
+
+    def test_color(self):
+        glstate.color((1, 1, 1, 1))
+        glstate.color((1, 1, 1, 1))
+        glstate.color((1, 0, 1, 1))
+        self.assertEqual(glstate.get_counters()["color"], (2, 1))
+
+    def test_reset_counters(self):
+        glstate.blend_func(1, 2)
+        glstate.reset_counters()
+        self.assertEqual(glstate.get_counters()["blend_func"], (0, 0))
+
+    def test_render_shared_texture(self):
+        sprites = [Sprite(texture=7) for i in range(3)]
+        rabbyt.render_unsorted(sprites)
+        counters = glstate.get_counters()
+        self.assertEqual(counters["bind_texture"], (1, 2))
+        self.assertEqual(counters["color"], (1, 2))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,74 @@
+import unittest
+import subprocess
+import sys
+
+import rabbyt
+
+
+GL_MODULES = ["rabbyt._rabbyt", "rabbyt.glstate"]
+
+def loaded_after(statement):
+    # A fresh interpreter, so that nothing has been imported yet.
+    output = subprocess.check_output([sys.executable, "-c",
+            "import sys\n%s\nprint(' '.join(sys.modules))" % statement])
+    return output.decode().split()
+
+
+class TestLazyImport(unittest.TestCase):
+    def test_no_gl(self):
+        modules = loaded_after("import rabbyt.anims, rabbyt.collisions, "
+                "rabbyt.primitives")
+        self.assertIn("rabbyt.collisions", modules)
+        for name in GL_MODULES:
+            self.assertNotIn(name, modules)
+
+    def test_import_rabbyt(self):
+        modules = loaded_after("import rabbyt")
+        for name in GL_MODULES + ["rabbyt.anims", "rabbyt.sprites",
+                "rabbyt._sprites", "rabbyt.collisions"]:
+            self.assertNotIn(name, modules)
+
+    def test_first_use(self):
+        modules = loaded_after("import rabbyt\n"
+                "rabbyt.Sprite(x=rabbyt.lerp(0, 10, dt=100))")
+        self.assertIn("rabbyt.sprites", modules)
+        for name in GL_MODULES + ["rabbyt.collisions"]:
+            self.assertNotIn(name, modules)
+
+    def test_render_loads_renderer(self):
+        modules = loaded_after("import rabbyt\n"
+                "rabbyt.Sprite().render()")
+        self.assertIn("rabbyt._rabbyt", modules)
+
+    def test_names(self):
+        self.assertIs(rabbyt.lerp, rabbyt.anims.lerp)
+        self.assertIs(rabbyt.Sprite, rabbyt.sprites.Sprite)
+        camera = rabbyt.Camera((100, 100))
+        self.assertIsInstance(camera, sys.modules["rabbyt._rabbyt"].Camera)
+        self.assertIsInstance(camera, rabbyt.Camera)
+        self.assertNotIsInstance(object(), rabbyt.Camera)
+        self.assertEqual(rabbyt.render_unsorted.__name__, "render_unsorted")
+        self.assertIn("render_unsorted", dir(rabbyt))
+        self.assertIn("lerp", dir(rabbyt))
+        self.assertRaises(AttributeError, getattr, rabbyt, "no_such_name")
+
+    def test_set(self):
+        # The module's functions see what is set on it.
+        old = rabbyt.data_directory
+        rabbyt.data_directory = "data"
+        try:
+            self.assertEqual(
+                    rabbyt.pygame_load_texture.__globals__["data_directory"],
+                    "data")
+        finally:
+            rabbyt.data_directory = old
+
+    def test_star(self):
+        namespace = {}
+        exec("from rabbyt import *", namespace)
+        for name in rabbyt.__all__:
+            self.assertIn(name, namespace)
+
+
+if __name__ == "__main__":
+    unittest.main()
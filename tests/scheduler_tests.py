@@ -0,0 +1,218 @@
+import unittest
+import random
+
+import rabbyt
+
+
+class TestScheduler(unittest.TestCase):
+    def setUp(self):
+        self.scheduler = rabbyt.Scheduler()
+        self.calls = []
+
+    def add(self, time, name=None):
+        return self.scheduler.add(time,
+                lambda: self.calls.append(time if name is None else name))
+
+    def test_order(self):
+        for t in (30, 10, 20, 10.5):
+            self.add(t)
+        self.scheduler.pump(15)
+        self.assertEqual(self.calls, [10, 10.5])
+        self.scheduler.pump(30)
+        self.assertEqual(self.calls, [10, 10.5, 20, 30])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_fifo(self):
+        for name in "abcde":
+            self.add(5, name)
+        self.scheduler.pump(5)
+        self.assertEqual("".join(self.calls), "abcde")
+
+    def test_cancel(self):
+        a = self.add(1, "a")
+        b = self.add(1, "b")
+        self.assertTrue(a.active)
+        a.cancel()
+        a.cancel()
+        self.assertFalse(a.active)
+        self.assertEqual(len(self.scheduler), 1)
+        self.scheduler.pump(2)
+        self.assertEqual(self.calls, ["b"])
+        self.assertFalse(b.active)
+
+    def test_cancel_from_callback(self):
+        self.scheduler.add(1, lambda: b.cancel())
+        b = self.add(1, "b")
+        self.scheduler.pump(1)
+        self.assertEqual(self.calls, [])
+
+    def test_add_from_callback(self):
+        self.scheduler.add(1, lambda: self.add(2, "late"))
+        self.scheduler.pump(5)
+        self.assertEqual(self.calls, ["late"])
+
+    def test_past(self):
+        self.add(100)
+        self.scheduler.pump(100)
+        self.add(50)
+        self.scheduler.pump(101)
+        self.assertEqual(self.calls, [100, 50])
+
+    def test_far_future(self):
+        for t in (3, 1 << 15, 1 << 21, 1 << 27, (1 << 27) + 1):
+            self.add(t)
+        self.scheduler.pump(1 << 26)
+        self.assertEqual(self.calls, [3, 1 << 15, 1 << 21])
+        self.scheduler.pump(1 << 28)
+        self.assertEqual(self.calls[3:], [1 << 27, (1 << 27) + 1])
+
+    def test_random(self):
+        r = random.Random(3)
+        times = [r.choice([r.uniform(0, 1e6), r.randrange(0, 1000)])
+                for i in range(2000)]
+        timers = [self.add(t, i) for i, t in enumerate(times)]
+        cancelled = set(r.sample(range(len(times)), 200))
+        for i in cancelled:
+            timers[i].cancel()
+        now = 0
+        while now < 1e6:
+            now += r.expovariate(1 / 5000.0)
+            self.scheduler.pump(now)
+        self.scheduler.pump(1e6)
+        expected = sorted((t, i) for i, t in enumerate(times)
+                if i not in cancelled)
+        self.assertEqual(self.calls, [i for t, i in expected])
+
+    def test_resolution(self):
+        scheduler = rabbyt.Scheduler(resolution=0.25)
+        scheduler.add(1.1, lambda: self.calls.append(1.1))
+        scheduler.add(1.0, lambda: self.calls.append(1.0))
+        scheduler.pump(1.05)
+        self.assertEqual(self.calls, [1.0])
+
+
+class TestTask(unittest.TestCase):
+    # The scripts are generators using ``yield from`` so that they run on
+    # Python 3.4; ``async def`` and ``await`` work the same way.
+    def setUp(self):
+        self.scheduler = rabbyt.Scheduler()
+        self.calls = []
+
+    def start(self, coroutine, time=0):
+        return self.scheduler.start(coroutine, time)
+
+    def test_sleep(self):
+        def script():
+            for i in range(3):
+                self.calls.append(i)
+                yield from rabbyt.sleep(100)
+            return "end"
+        task = self.start(script())
+        self.assertEqual(self.calls, [])
+        self.scheduler.pump(0)
+        self.assertEqual(self.calls, [0])
+        # Sleeps count from when the task was due, not when it was pumped.
+        self.scheduler.pump(150)
+        self.scheduler.pump(200)
+        self.assertEqual(self.calls, [0, 1, 2])
+        self.assertFalse(task.done)
+        self.scheduler.pump(300)
+        self.assertTrue(task.done)
+        self.assertEqual(task.result, "end")
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_anim_finished(self):
+        sprite = rabbyt.Sprite()
+        sprite.x = rabbyt.lerp(0, 10, startt=0, endt=250)
+        def script():
+            yield from rabbyt.anim_finished(sprite, "x")
+            self.calls.append("x")
+            yield from rabbyt.anim_finished(rabbyt.lerp(0, 1, startt=0,
+                    endt=400))
+            self.calls.append("lerp")
+        self.start(script())
+        self.scheduler.pump(249)
+        self.assertEqual(self.calls, [])
+        self.scheduler.pump(250)
+        self.assertEqual(self.calls, ["x"])
+        self.scheduler.pump(400)
+        self.assertEqual(self.calls, ["x", "lerp"])
+
+    def test_anim_finished_already(self):
+        sprite = rabbyt.Sprite()
+        sprite.x = rabbyt.lerp(0, 10, startt=0, endt=100)
+        rabbyt.set_time(200)
+        # Reading the slot lets go of the finished anim.
+        self.assertEqual(sprite.x, 10)
+        def script():
+            yield from rabbyt.anim_finished(sprite, "x")
+            self.calls.append("x")
+            yield from rabbyt.anim_finished(sprite, "y")
+            self.calls.append("y")
+        self.start(script(), 50)
+        self.scheduler.pump(50)
+        self.assertEqual(self.calls, ["x", "y"])
+
+    def test_await_task(self):
+        def child():
+            yield from rabbyt.sleep(10)
+            return 5
+        def parent():
+            self.calls.append((yield from self.start(child())))
+            self.calls.append((yield from self.start(child(), 100)))
+        self.start(parent())
+        self.scheduler.pump(10)
+        self.assertEqual(self.calls, [5])
+        self.scheduler.pump(110)
+        self.assertEqual(self.calls, [5, 5])
+
+    def test_exception(self):
+        def child():
+            yield from rabbyt.sleep(1)
+            raise KeyError("child")
+        def parent():
+            try:
+                yield from self.start(child())
+            except KeyError:
+                self.calls.append("caught")
+        self.start(parent())
+        self.assertRaises(KeyError, self.scheduler.pump, 1)
+        self.scheduler.pump(1)
+        self.assertEqual(self.calls, ["caught"])
+
+    def test_cancel(self):
+        def script():
+            try:
+                yield from rabbyt.sleep(10)
+                self.calls.append("woke")
+            finally:
+                self.calls.append("closed")
+        task = self.start(script())
+        self.scheduler.pump(0)
+        task.cancel()
+        task.cancel()
+        self.assertTrue(task.done and task.cancelled)
+        self.assertEqual(self.calls, ["closed"])
+        self.assertEqual(len(self.scheduler), 0)
+
+    def test_bad_await(self):
+        def script():
+            yield "not a wait"
+        task = self.start(script())
+        self.assertRaises(TypeError, self.scheduler.pump, 0)
+        self.assertTrue(task.done)
+
+    def test_many(self):
+        def script(i):
+            for step in range(i % 5):
+                yield from rabbyt.sleep(1 + i % 7)
+            self.calls.append(i)
+        tasks = [self.start(script(i)) for i in range(1000)]
+        for now in range(40):
+            self.scheduler.pump(now)
+        self.assertTrue(all(task.done for task in tasks))
+        self.assertEqual(sorted(self.calls), list(range(1000)))
+
+
+if __name__ == "__main__":
+    unittest.main()
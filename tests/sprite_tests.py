@@ -115,5 +115,29 @@ class TestSpriteSidesRot(unittest.TestCase):
 
 
 
+class TestRender(unittest.TestCase):
+    def test_target_picked_on_assignment(self):
+        s = Sprite()
+        self.assertEqual(s.texture_target, 0)
+        s.texture = 5
+        self.assertNotEqual(s.texture_target, 0)
+
+    def test_render_unsorted_overridden(self):
+        import rabbyt
+        rendered = []
+        class MySprite(Sprite):
+            def render(self):
+                rendered.append(self)
+        sprites = [Sprite(), MySprite(), Sprite(), MySprite()]
+        rabbyt.render_unsorted(sprites)
+        self.assertEqual(rendered, [sprites[1], sprites[3]])
+
+    def test_render_unsorted_picks_target(self):
+        import rabbyt
+        s = Sprite()
+        rabbyt.render_unsorted([s])
+        self.assertNotEqual(s.texture_target, 0)
+
+
 if __name__ == '__main__':
     unittest.main()
@@ -0,0 +1,69 @@
+import unittest
+import io
+import json
+
+import rabbyt
+from rabbyt import stats
+from rabbyt.sprites import Sprite
+
+
+class TestStats(unittest.TestCase):
+    def setUp(self):
+        stats.clear_history()
+        stats.enable()
+        stats.begin_frame()
+
+    def tearDown(self):
+        stats.disable()
+
+    def test_render(self):
+        sprites = [Sprite(x=i*10) for i in range(3)]
+        rabbyt.render_unsorted(sprites)
+        frame = stats.end_frame()
+        self.assertEqual(frame.sprites_rendered, 3)
+        self.assertEqual(frame.draw_calls, 3)
+        self.assertEqual(frame.vertices, 12)
+
+    def test_culled(self):
+        sprites = [Sprite(x=0), Sprite(x=500)]
+        rabbyt.render_unsorted(sprites, rabbyt.Camera((100, 100)))
+        frame = stats.end_frame()
+        self.assertEqual(frame.sprites_rendered, 1)
+        self.assertEqual(frame.sprites_culled, 1)
+
+    def test_anim_evaluations(self):
+        s = Sprite()
+        s.x = rabbyt.lerp(0, 10, dt=1)
+        s.x
+        s.x
+        self.assertEqual(stats.end_frame().anim_evaluations, 2)
+
+    def test_disabled(self):
+        stats.disable()
+        rabbyt.render_unsorted([Sprite()])
+        stats.enable()
+        self.assertEqual(stats.end_frame().sprites_rendered, 0)
+
+    def test_history(self):
+        stats.end_frame()
+        stats.begin_frame()
+        rabbyt.render_unsorted([Sprite()])
+        stats.end_frame()
+        self.assertEqual([f.sprites_rendered for f in stats.history()],
+                [0, 1])
+
+    def test_export(self):
+        stats.end_frame()
+        f = io.StringIO()
+        stats.export(f, "json")
+        frames = json.loads(f.getvalue())
+        self.assertEqual(len(frames), 1)
+        self.assertEqual(frames[0]["sprites_rendered"], 0)
+        f = io.StringIO()
+        stats.export(f)
+        self.assertEqual(f.getvalue().splitlines()[0].split(",")[0],
+                "sprites_rendered")
+
+
+if __name__ == "__main__":
+    unittest.main()